@@ -12,5 +12,15 @@ __copyright__ = 'Copyright 2013 Charlie Guo'
 from .gmail import Gmail
 from .mailbox import Mailbox 
 from .message import Message 
+from .query import Query
+from .uidset import UIDSet
+from .cache import MessageCache
+from .store import MessageStore
+from .sync import SyncState, SyncResult
+from .idle import IdleEvent
+from .pool import ConnectionPool
+from .smtp import SendQueue, SendResult
+from .aio import AsyncGmail
+from .orchestrator import Orchestrator, Account
 from .exceptions import GmailException, ConnectionError, AuthenticationError
 from .utils import login, authenticate
@@ -0,0 +1,1040 @@
+# -*- coding: utf-8 -*-
+
+"""
+gmail.aio
+~~~~~~~~~~~~~~~~~~~
+
+This module contains an asyncio client mirroring Gmail, Mailbox and
+Message. Commands are tagged and pipelined over one connection, so many
+FETCH or STORE chunks, and many accounts, share a single event loop.
+
+"""
+
+import asyncio
+import base64
+import io
+import operator
+import re
+import ssl
+import time
+from collections import OrderedDict
+from contextlib import asynccontextmanager
+from functools import reduce
+from smtplib import SMTPException, SMTPServerDisconnected
+
+from .cache import MessageCache
+from .compress import DeflateCodec
+from .connection import _MAXLINE
+from .exceptions import AuthenticationError, ConnectionError, GmailException, Throttled
+from .gmail import Gmail, list_returns, mailbox_counts, unquoted, update_mailboxes
+from .idle import IDLE_RENEW, _add_event
+from .mailbox import (Mailbox, STATUS_ITEMS, _arrived, _changed_since, _first_pass, _known,
+                      _missing, _unique, _vanished, group_threads, is_throttled, parse_status, quote, search_returned,
+                      section_item, store_values, thread_query)
+from .message import (Attachment, Message, FLAGS, FULL, STRUCTURE, PART_PROFILES, PROFILE_ITEMS,
+                      _with_message, decode_chunks, encoded_size)
+from .parser import parse_list, parse_statuses
+from .smtp import connect_smtp, dropped, recipients, xoauth2_string
+from .uidset import UIDSet
+from .utf import encode as encode_utf7
+
+_LITERAL = re.compile(br'\{(\d+)\}$')
+_UNTAGGED = re.compile(br'\* (?:(\d+) )?([A-Z-]+)(?: (.*))?$', re.S)
+_RESPONSE_CODE = re.compile(br'\[([A-Z-]+)(?: ([^\]]*))?\]')
+# put in the idle queue when another command needs the connection
+_END_IDLE = object()
+
+
+class AsyncIMAPConnection:
+    """
+        An IMAP connection whose commands are coroutines. Every command gets its
+        own tag, so several can be in flight at once; untagged responses are
+        credited to the oldest command still waiting for its tagged reply.
+    """
+
+    def __init__(self, host, port=993, ssl_context=None):
+        self.host = host
+        self.port = port
+        self.ssl_context = ssl_context or ssl.create_default_context()
+        self.capabilities = ()
+        # untagged responses received while no command was in flight
+        self.untagged_responses = {}
+        # untagged responses of the last SELECT, read with ``response``
+        self.selected_responses = {}
+
+        self._reader = None
+        self._writer = None
+        self._task = None
+        self._error = None
+        self._tag = 0
+        # tag -> (future, untagged responses), oldest command first
+        self._pending = OrderedDict()
+        # called with each "+" continuation line
+        self._continuation = None
+        # queue of untagged responses while idling
+        self._idle = None
+        # set while no IDLE is running, and while no other command is in flight
+        self._idle_over = asyncio.Event()
+        self._idle_over.set()
+        self._quiet = asyncio.Event()
+        self._quiet.set()
+        self._busy = 0
+        # the DeflateCodec once COMPRESS succeeded, and the tag of a COMPRESS in flight
+        self.compression = None
+        self._compress = None
+        self._inflater = None
+
+    def __repr__(self):
+        return '<AsyncIMAPConnection {}:{}>'.format(self.host, self.port)
+
+    async def open(self):
+        self._reader, self._writer = await asyncio.open_connection(
+            self.host, self.port, ssl=self.ssl_context, limit=_MAXLINE)
+
+        greeting = _line(await self._read_response())
+        if not greeting.startswith((b'* OK', b'* PREAUTH')):
+            self._writer.close()
+            raise ConnectionError('Unexpected greeting: %r' % greeting)
+
+        self._task = asyncio.ensure_future(self._read_loop())
+        await self.capability()
+
+    async def _readline(self):
+        line = await self._reader.readline()
+        if not line.endswith(b'\n'):
+            raise ConnectionError('socket error: EOF')
+        return line.rstrip(b'\r\n')
+
+    async def _read_response(self):
+        # a response line plus any literals it announces, shaped like imaplib's
+        parts = [await self._readline()]
+        while True:
+            literal = _LITERAL.search(parts[-1])
+            if not literal:
+                return parts
+            parts[-1] = (parts[-1], await self._reader.readexactly(int(literal.group(1))))
+            parts.append(await self._readline())
+
+    async def _read_loop(self):
+        try:
+            while True:
+                parts = await self._read_response()
+                line = _line(parts)
+                if line.startswith(b'+'):
+                    if self._continuation is not None:
+                        self._continuation(line)
+                elif line.startswith(b'* '):
+                    self._untagged(parts)
+                else:
+                    self._tagged(line)
+                    if self._compress is not None and line.startswith(self._compress[0] + b' OK'):
+                        self._start_compression(self._compress[1])
+        except asyncio.CancelledError:
+            self._fail(ConnectionError('The connection was closed.'))
+            raise
+        except Exception as error:
+            self._fail(ConnectionError('The connection was lost: %s' % error))
+
+    def _start_compression(self, codec):
+        # runs in the read loop right after the tagged OK, before it reads on
+        raw = self._reader
+        self._reader = asyncio.StreamReader(limit=_MAXLINE)
+        self.compression = codec
+        self._inflater = asyncio.ensure_future(_inflate(raw, self._reader, codec))
+
+    def _write(self, data):
+        if self.compression is not None:
+            data = self.compression.compress(data)
+        self._writer.write(data)
+
+    def _fail(self, error):
+        self._error = error
+        pending, self._pending = self._pending, OrderedDict()
+        for future, _ in pending.values():
+            if not future.done():
+                future.set_exception(error)
+
+    def _untagged(self, parts):
+        if self._idle is not None:
+            self._idle.put_nowait(parts)
+            return
+
+        first = parts[0]
+        match = _UNTAGGED.match(_line(parts))
+        if not match:
+            return
+
+        number, type, data = match.groups()
+        type = type.decode()
+        if number is not None:
+            # imaplib keeps "<n> (...)" for "* <n> FETCH (...)"
+            data = number + b' ' + data if data else number
+        data = data or b''
+
+        untagged = next(iter(self._pending.values()))[1] if self._pending else self.untagged_responses
+        if isinstance(first, tuple):
+            untagged.setdefault(type, []).append((data, first[1]))
+            untagged[type].extend(parts[1:])
+        else:
+            untagged.setdefault(type, []).append(data)
+
+        if type == 'CAPABILITY':
+            self.capabilities = tuple(data.decode().upper().split())
+        elif type in ('OK', 'NO', 'BAD', 'PREAUTH'):
+            self._response_code(untagged, data)
+
+    def _response_code(self, untagged, text):
+        match = _RESPONSE_CODE.match(text)
+        if match:
+            type = match.group(1).decode()
+            untagged.setdefault(type, []).append(match.group(2))
+            if type == 'CAPABILITY':
+                self.capabilities = tuple(match.group(2).decode().upper().split())
+
+    def _tagged(self, line):
+        tag, _, rest = line.partition(b' ')
+        future, untagged = self._pending.pop(tag, (None, None))
+        if future is None or future.done():
+            return
+        type, _, text = rest.partition(b' ')
+        self._response_code(untagged, text)
+        future.set_result((type.decode(), untagged, text))
+
+    async def command(self, name, *args):
+        """
+            Send a command and wait for its tagged reply, returning the status
+            ("OK", "NO" or "BAD"), its untagged responses and the reply text.
+            A running IDLE is ended first, and issued again once it is answered.
+        """
+        self._busy += 1
+        self._quiet.clear()
+        try:
+            while not self._idle_over.is_set():
+                self._end_idle()
+                await self._idle_over.wait()
+            return await self._command(name, *args)
+        finally:
+            self._busy -= 1
+            if not self._busy:
+                self._quiet.set()
+
+    def _end_idle(self):
+        # IDLE lets nothing but DONE through (RFC 2177)
+        if self._idle is not None:
+            self._idle.put_nowait(_END_IDLE)
+
+    async def _command(self, name, *args):
+        if self._error is not None:
+            raise self._error
+        if self._writer is None:
+            raise ConnectionError('The connection is not open.')
+
+        self._tag += 1
+        tag = b'A%d' % self._tag
+        future = asyncio.get_running_loop().create_future()
+        # registered before sending, so every untagged response finds it
+        self._pending[tag] = (future, {})
+
+        arguments = [arg if isinstance(arg, bytes) else str(arg).encode() for arg in args]
+        self._write(b' '.join([tag, name.encode()] + arguments) + b'\r\n')
+        await self._writer.drain()
+        return await future
+
+    async def _simple(self, name, *args, response=None):
+        # the (type, data) pair imaplib returns for the same command
+        type, untagged, text = await self.command(name, *args)
+        if type == 'BAD':
+            raise GmailException('%s command error: %s %r' % (name, type, text))
+        if type == 'NO':
+            return type, [text]
+        return type, untagged.get(response or name, [None])
+
+    async def capability(self):
+        return await self._simple('CAPABILITY')
+
+    async def login(self, username, password):
+        type, _, text = await self.command('LOGIN', quote(username), quote(password))
+        if type != 'OK':
+            raise AuthenticationError(text.decode(errors='replace'))
+        return type, [text]
+
+    async def authenticate_xoauth2(self, username, access_token):
+        """AUTHENTICATE XOAUTH2, sending the token with the command (SASL-IR)."""
+        # a failed attempt gets a "+" with the error details, which is answered
+        # with an empty line before the tagged NO
+        self._continuation = lambda line: self._write(b'\r\n')
+        try:
+            auth_string = base64.b64encode(xoauth2_string(username, access_token).encode())
+            type, _, text = await self.command('AUTHENTICATE', 'XOAUTH2', auth_string)
+        finally:
+            self._continuation = None
+        if type != 'OK':
+            raise AuthenticationError(text.decode(errors='replace'))
+        return type, [text]
+
+    async def list(self, directory='""', pattern='*'):
+        return await self._simple('LIST', directory, pattern)
+
+    async def list_extended(self, returns, directory='""', pattern='"*"'):
+        """LIST with RETURN options, see ``IMAPConnection.list_extended``."""
+        type, untagged, text = await self.command('LIST', directory, pattern,
+                                                  'RETURN', '(%s)' % ' '.join(returns))
+        if type != 'OK':
+            return type, [text], []
+        return type, untagged.get('LIST', []), untagged.get('STATUS', [])
+
+    async def select(self, mailbox='INBOX', readonly=False):
+        type, untagged, text = await self.command('EXAMINE' if readonly else 'SELECT', mailbox)
+        if type != 'OK':
+            raise GmailException('SELECT %s failed: %r' % (mailbox, text))
+        self.selected_responses = untagged
+        return type, untagged.get('EXISTS', [None])
+
+    async def status(self, mailbox, names):
+        return await self._simple('STATUS', mailbox, names)
+
+    def response(self, code):
+        """Pop the ``code`` responses of the last SELECT, like ``imaplib.IMAP4.response``."""
+        return code, self.selected_responses.pop(code.upper(), [None])
+
+    async def uid(self, command, *args):
+        command = command.upper()
+        # imaplib returns SEARCH responses for searches and FETCH ones otherwise
+        response = command if command in ('SEARCH', 'SORT', 'THREAD') else 'FETCH'
+        if command == 'SEARCH' and args and str(args[0]).upper() == 'RETURN':
+            response = 'ESEARCH'
+        return await self._simple('UID', command, *args, response=response)
+
+    async def expunge(self):
+        return await self._simple('EXPUNGE')
+
+    async def enable(self, capability):
+        return await self._simple('ENABLE', capability, response='ENABLED')
+
+    async def noop(self):
+        return await self._simple('NOOP')
+
+    async def compress(self, level=None):
+        """Turn on COMPRESS=DEFLATE, see ``IMAPConnection.compress``."""
+        if self.compression is not None:
+            return True
+        if 'COMPRESS=DEFLATE' not in self.capabilities:
+            await self.capability()
+            if 'COMPRESS=DEFLATE' not in self.capabilities:
+                return False
+
+        codec = DeflateCodec() if level is None else DeflateCodec(level)
+        # the read loop switches streams as soon as it sees the tagged OK
+        self._compress = (b'A%d' % (self._tag + 1), codec)
+        try:
+            type, _, _ = await self.command('COMPRESS', 'DEFLATE')
+        finally:
+            self._compress = None
+        return type == 'OK'
+
+    async def idle(self, timeout=None, renew=IDLE_RENEW):
+        """
+            Yield an IdleEvent for every change the server reports on the selected
+            mailbox, for ``timeout`` seconds or forever. As in ``gmail.idle.idle``,
+            IDLE is ended before events are yielded and re-issued every ``renew``
+            seconds; it is also ended while other commands use the connection.
+        """
+        loop = asyncio.get_running_loop()
+        deadline = timeout and loop.time() + timeout
+        while deadline is None or loop.time() < deadline:
+            for event in await self.idle_until(_idle_stop(loop, deadline, renew)):
+                yield event
+
+    async def idle_until(self, stop):
+        """
+            IDLE until the server reports a change, until ``stop`` (a loop time) or
+            until another command needs the connection; returns the events.
+        """
+        if 'IDLE' not in self.capabilities:
+            raise GmailException('The server does not support IDLE.')
+
+        # the commands in flight are answered before IDLE starts
+        await self._quiet.wait()
+        loop = asyncio.get_running_loop()
+        # the queue receives the "+" line (bytes), untagged responses (lists),
+        # _END_IDLE, and None once the IDLE command completed or the connection failed
+        queue = self._idle = asyncio.Queue()
+        self._idle_over.clear()
+        self._continuation = queue.put_nowait
+        done = asyncio.ensure_future(self._command('IDLE'))
+        done.add_done_callback(lambda _: queue.put_nowait(None))
+
+        events = []
+        started = ending = False
+        try:
+            while not (started and (events or ending)):
+                wait = None
+                if started:
+                    wait = stop - loop.time()
+                    if wait <= 0:
+                        break
+                try:
+                    item = await asyncio.wait_for(queue.get(), wait)
+                except asyncio.TimeoutError:
+                    break
+
+                if item is None:
+                    type, _, text = done.result()
+                    raise GmailException('IDLE failed: %s %r' % (type, text))
+                if item is _END_IDLE:
+                    # DONE can only be sent once the server took the IDLE
+                    ending = True
+                elif isinstance(item, bytes):
+                    started = True
+                else:
+                    _add_event(events, item)
+        finally:
+            self._continuation = None
+            if started and not done.done():
+                self._write(b'DONE\r\n')
+                await done
+            self._idle = None
+            self._idle_over.set()
+            while not queue.empty():
+                item = queue.get_nowait()
+                if isinstance(item, list):
+                    _add_event(events, item)
+        return events
+
+    async def logout(self):
+        try:
+            await self._simple('LOGOUT')
+        except ConnectionError:
+            pass
+        self.close()
+
+    def close(self):
+        if self._task is not None:
+            self._task.cancel()
+        if self._inflater is not None:
+            self._inflater.cancel()
+        if self._writer is not None:
+            self._writer.close()
+
+
+class AsyncAttachment(Attachment):
+    """An Attachment of an AsyncMessage, whose payload is read with coroutines."""
+
+    @property
+    def payload(self):
+        raise GmailException('The payload of an async attachment is read with '
+                             '"await attachment.read()" or "await attachment.write(fileobj)".')
+
+    async def read(self):
+        """The whole decoded payload."""
+        output = io.BytesIO()
+        await self.write(output)
+        return output.getvalue()
+
+    async def head(self, size=4096):
+        """The first ``size`` decoded bytes, see ``Attachment.head``."""
+        length = encoded_size(size, self.encoding)
+        encoded = self._local()
+        if encoded is None:
+            encoded = await self.message.mailbox.fetch_section(self.message, self.section, 0, length)
+        return b''.join(decode_chunks([encoded[:length]], self.encoding))[:size]
+
+    async def write(self, fileobj, resume=False):
+        """Decode the payload into ``fileobj``, see ``Attachment.write``."""
+        self._start(resume)
+        encoded = self._local()
+
+        more = True
+        while more:
+            if encoded is not None:
+                chunk = memoryview(encoded)[self.position:self.position + self.CHUNK_SIZE]
+            else:
+                chunk = await self.message.mailbox.fetch_section(
+                    self.message, self.section, self.position, self.CHUNK_SIZE)
+            more = self._write(fileobj, chunk)
+
+        self._finish(fileobj)
+
+    async def save(self, path=None, resume=False):
+        path = self._path(path)
+        with self._open(path, resume) as f:
+            await self.write(f, resume)
+        return path
+
+
+class AsyncMessage(Message):
+    """
+        A Message of an AsyncMailbox. Fields can't be fetched on first access
+        from inside the event loop, so they have to be loaded first with
+        ``await message.fetch()`` or a prefetching ``get_mail``.
+    """
+
+    __slots__ = ()
+
+    attachment_class = AsyncAttachment
+
+    def _fetch(self, group=FULL):
+        raise GmailException('The %s fields of %r are not loaded, await fetch() first.' % (group, self))
+
+    async def fetch(self, profile=None):
+        """Fetch this message using ``profile``, by default its own one."""
+        await self.mailbox.fetch([self], profile=profile or self.profile, refresh=True)
+        return self
+
+    async def fetch_thread(self, profile=None):
+        """Fill ``thread`` with this conversation, see ``Message.fetch_thread``."""
+        if FLAGS not in self._loaded:
+            await self.mailbox.fetch([self], profile=FLAGS)
+        thread = await self.mailbox.thread(self.thread_id, profile=profile or self.profile)
+        self.thread = _with_message(thread, self)
+        return self.thread
+
+    async def preview(self, size=2048):
+        """The first ``size`` bytes of the text (or html) body, see ``Message.preview``."""
+        if STRUCTURE not in self._loaded:
+            await self.mailbox.fetch([self], profile=STRUCTURE)
+        part = self._preview_part()
+        return await part.head(size) if part else None
+
+
+class AsyncMailbox(Mailbox):
+    """
+        A Mailbox whose IMAP operations are coroutines. The chunks of a bulk
+        FETCH or STORE are pipelined rather than sent one round trip at a time.
+    """
+
+    message_class = AsyncMessage
+
+    @property
+    def messages(self):
+        return self._messages
+
+    async def get_mail(self,
+                       prefetch=False,
+                       chunk_size=Mailbox.FETCH_CHUNK_SIZE,
+                       profile=FULL,
+                       **kwargs):
+
+        emails = [self._message(str(uid).encode(), profile) for uid in await self.uids(**kwargs)]
+
+        if prefetch:
+            await self.fetch(emails, chunk_size, profile)
+
+        return emails
+
+    async def iter_mail(self,
+                        chunk_size=Mailbox.FETCH_CHUNK_SIZE,
+                        profile=FULL,
+                        cache=False,
+                        **kwargs):
+        """Yield the messages matching ``kwargs``, see ``Mailbox.iter_mail``."""
+        uids = await self.uids(**kwargs)
+
+        for chunk in uids.chunks(chunk_size):
+            messages = [self._message(str(uid).encode(), profile, cache) for uid in chunk]
+
+            await self.fetch(messages, chunk_size, profile)
+
+            for message in messages:
+                yield message
+
+    async def threads(self, chunk_size=Mailbox.FETCH_CHUNK_SIZE, profile=FULL, **kwargs):
+        """The conversations with a message matching ``kwargs``, see ``Mailbox.threads``."""
+        matched = await self.fetch(await self.uids(**kwargs), chunk_size, profile)
+        thread_ids = _unique(message.thread_id for message in matched)
+        return await self._threads(thread_ids, chunk_size, profile)
+
+    async def thread(self, thread_id, chunk_size=Mailbox.FETCH_CHUNK_SIZE, profile=FULL):
+        threads = await self._threads([thread_id], chunk_size, profile)
+        return threads[0] if threads else []
+
+    async def _threads(self, thread_ids, chunk_size, profile):
+        size = self.THREAD_SEARCH_SIZE
+        searches = await asyncio.gather(*[self.uids(query=thread_query(thread_ids[start:start + size]))
+                                          for start in range(0, len(thread_ids), size)])
+        uids = reduce(operator.or_, searches, UIDSet())
+        return group_threads(await self.fetch(uids, chunk_size, profile))
+
+    async def search(self, **kwargs):
+        """Return the UIDs of the messages matching ``kwargs``."""
+        async with self._imap() as imap:
+            response, data = await imap.uid('SEARCH', *self.criteria(**kwargs))
+            return self._search_uids(response, data)
+
+    async def uids(self, **kwargs):
+        """The UIDs of the messages matching ``kwargs`` as a UIDSet."""
+        return (await self._search_return(('ALL',), kwargs))['ALL']
+
+    async def count(self, **kwargs):
+        """The number of messages matching ``kwargs``, see ``Mailbox.count``."""
+        return (await self._search_return(('COUNT',), kwargs))['COUNT']
+
+    async def uid_range(self, **kwargs):
+        returned = await self._search_return(('MIN', 'MAX'), kwargs)
+        return returned['MIN'], returned['MAX']
+
+    async def page(self,
+                   number=0,
+                   size=50,
+                   newest=True,
+                   prefetch=False,
+                   chunk_size=Mailbox.FETCH_CHUNK_SIZE,
+                   profile=FULL,
+                   **kwargs):
+        """Page ``number`` of the messages matching ``kwargs``, see ``Mailbox.page``."""
+        uids = (await self.uids(**kwargs)).page(number, size, newest)
+        emails = [self._message(str(uid).encode(), profile) for uid in uids]
+
+        if prefetch:
+            await self.fetch(emails, chunk_size, profile)
+
+        return emails
+
+    async def _search_return(self, returns, kwargs):
+        async with self._imap() as imap:
+            esearch = 'ESEARCH' in imap.capabilities
+            response, data = await imap.uid('SEARCH', *self._return_criteria(returns, esearch, kwargs))
+            return search_returned(returns, esearch, response, data)
+
+    async def fetch(self, messages, chunk_size=Mailbox.FETCH_CHUNK_SIZE, profile=FULL, refresh=False):
+        """Fill ``messages`` using the fetch ``profile``, see ``Mailbox.fetch``."""
+        if isinstance(messages, UIDSet):
+            messages = [self._message(str(uid).encode(), profile) for uid in messages]
+        pending = self._pending(messages, profile, refresh)
+        parsing = []
+
+        # one selection for every pass
+        async with self._imap():
+            if profile != FLAGS:
+                stored = self._load_stored(pending, parsing)
+                await self._fetch_items(stored, PROFILE_ITEMS[FLAGS], {FLAGS}, chunk_size)
+
+            await self._fetch_items(self._first_pending(pending, profile),
+                                    PROFILE_ITEMS[profile], _first_pass(profile), chunk_size, parsing)
+
+            if profile in PART_PROFILES:
+                await asyncio.gather(*[self._fetch_items(batch, items, {profile}, chunk_size)
+                                       for items, batch in self._part_batches(pending, profile)])
+
+        # the bodies are parsed in gmail.parse_executor without blocking the loop
+        fields = await asyncio.gather(*[asyncio.wrap_future(future) for _, future in parsing])
+        for (message, _), parsed in zip(parsing, fields):
+            message._load_email(parsed)
+
+        return messages
+
+    async def _fetch_items(self, messages, items, groups, chunk_size, parsing=None):
+        async with self._imap() as imap:
+            results = await asyncio.gather(*[
+                imap.uid('FETCH', str(chunk), items)
+                for chunk in UIDSet(messages).chunks(chunk_size)])
+
+        for response, data in results:
+            if response == 'OK':
+                self._load_fetched(messages, groups, data, parsing)
+            elif is_throttled(data):
+                raise Throttled('FETCH was throttled: %r' % data)
+
+    async def fetch_section(self, message, section, offset=None, length=None):
+        """Fetch the MIME part ``section`` of ``message``, see ``Mailbox.fetch_section``."""
+        async with self._imap() as imap:
+            response, data = await imap.uid(
+                'FETCH', str(int(message.uid)), '(%s)' % section_item(section, offset, length))
+            return self._section(message, section, response, data)
+
+
+    async def store(self, messages, command, values, chunk_size=Mailbox.STORE_CHUNK_SIZE):
+        """Run a bulk UID STORE over ``messages``, see ``Mailbox.store``."""
+        targets = self._store_targets(messages)
+        chunks = list(UIDSet(messages).chunks(chunk_size))
+
+        async with self._imap() as imap:
+            results = await asyncio.gather(*[
+                imap.uid('STORE', str(chunk), command, store_values(command, values))
+                for chunk in chunks])
+
+        for chunk, (response, data) in zip(chunks, results):
+            self._stored(targets, chunk, command, values, response, data)
+
+    async def move(self, messages, destination, chunk_size=Mailbox.STORE_CHUNK_SIZE):
+        """Move ``messages`` to the mailbox named ``destination``, see ``Mailbox.move``."""
+        target = quote(encode_utf7(destination))
+        uids = UIDSet(messages)
+        chunks = list(uids.chunks(chunk_size))
+
+        async with self._imap() as imap:
+            if 'MOVE' in imap.capabilities:
+                results = await asyncio.gather(*[
+                    imap.uid('MOVE', str(chunk), target) for chunk in chunks])
+            else:
+                results = [await self._copy_and_expunge(chunk, target) for chunk in chunks]
+
+        for response, data in results:
+            if response != 'OK':
+                raise GmailException('Moving to %s failed: %r' % (destination, data))
+
+        for uid in uids:
+            self._messages.pop(str(uid).encode())
+
+    async def _copy_and_expunge(self, uids, target):
+        async with self._imap() as imap:
+            response, data = await imap.uid('COPY', str(uids), target)
+            if response == 'OK':
+                await self.store(uids, '+FLAGS', ['\\Deleted'])
+                if 'UIDPLUS' in imap.capabilities:
+                    response, data = await self.expunge(uids)
+            return response, data
+
+    async def expunge(self, messages):
+        """Permanently remove ``messages`` already flagged \\Deleted, see ``Mailbox.expunge``."""
+        async with self._imap() as imap:
+            if 'UIDPLUS' not in imap.capabilities:
+                raise GmailException('UID EXPUNGE needs UIDPLUS, which the server does not offer.')
+            return await imap.uid('EXPUNGE', str(UIDSet(messages)))
+
+    async def delete(self, messages):
+        """Move ``messages`` to the trash, or delete them for good if already there."""
+        if self.name == self.gmail.trash_name:
+            await self.store(messages, '+FLAGS', ['\\Deleted'])
+            if 'UIDPLUS' in self.gmail.imap.capabilities:
+                await self.expunge(messages)
+            for message in messages:
+                self._messages.pop(str(int(getattr(message, 'uid', message))).encode())
+        else:
+            await self.move(messages, self.gmail.trash_name)
+
+    async def sync(self, state=None):
+        """What changed since ``state``, as a SyncResult, see ``Mailbox.sync``."""
+        qresync = await self.gmail.enable('QRESYNC')
+        condstore = qresync or 'CONDSTORE' in self.gmail.imap.capabilities
+
+        # SELECT again for the current UIDNEXT, HIGHESTMODSEQ and EXISTS
+        async with self._imap(force=True) as imap:
+            if state is None or state.uidvalidity != self.uidvalidity:
+                return self._sync_reset(state, list(await self.uids()))
+
+            new = []
+            if self.uidnext is None or self.uidnext > state.uidnext:
+                new = _arrived(state, await self.uids(uid='%d:*' % state.uidnext))
+
+            changed, vanished = [], None
+            if not condstore or state.highestmodseq is None:
+                changed = None
+            elif self._sync_modified(state):
+                type, untagged, _ = await imap.command('UID', 'FETCH', *_changed_since(state, qresync))
+                if type == 'OK':
+                    changed = self._sync_changed(untagged.get('FETCH', []))
+                if qresync:
+                    vanished = _vanished(untagged.get('VANISHED', []))
+
+            if vanished is None:
+                vanished = []
+                if self._sync_shrunk(state, new):
+                    vanished = _missing(state, await self.uids(uid=_known(state)))
+
+        return self._sync_result(state, new, changed, vanished)
+
+    async def idle(self, timeout=None, renew=IDLE_RENEW):
+        """
+            Wait for changes on this mailbox, see ``AsyncGmail.idle``. It is only
+            held while IDLE runs, so a task needing another mailbox ends the IDLE
+            and gets its turn before this one is selected again.
+        """
+        loop = asyncio.get_running_loop()
+        deadline = timeout and loop.time() + timeout
+        while deadline is None or loop.time() < deadline:
+            async with self.gmail.hold_mailbox(self, idle=True) as imap:
+                events = await imap.idle_until(_idle_stop(loop, deadline, renew))
+            for event in events:
+                yield event
+
+    async def select(self, readonly=None):
+        """SELECT (or EXAMINE) this mailbox, see ``Mailbox.select``."""
+        async with self._imap(readonly, force=True):
+            pass
+
+    async def ensure_selected(self, readonly=None):
+        async with self._imap(readonly):
+            pass
+
+    def _imap(self, readonly=None, force=False):
+        # the connection, with this mailbox kept selected for the block
+        return self.gmail.hold_mailbox(self, readonly, force)
+
+    async def status(self, items=STATUS_ITEMS):
+        """The STATUS of this mailbox without selecting it, see ``Mailbox.status``."""
+        response, data = await self.gmail.imap.status(quote(self.external_name),
+                                                      '(%s)' % ' '.join(items))
+        self.counts = parse_status(response, data)
+        return self.counts
+
+
+class AsyncGmail:
+    """
+        The asyncio counterpart of Gmail. IMAP runs on the event loop; SMTP
+        sends are handed to the default executor one at a time.
+    """
+
+    GMAIL_IMAP_HOST = Gmail.GMAIL_IMAP_HOST
+    GMAIL_IMAP_PORT = Gmail.GMAIL_IMAP_PORT
+    GMAIL_SMTP_HOST = Gmail.GMAIL_SMTP_HOST
+    GMAIL_SMTP_PORT = Gmail.GMAIL_SMTP_PORT
+
+    mailbox_class = AsyncMailbox
+    MAILBOX_REFRESH = Gmail.MAILBOX_REFRESH
+
+    def __init__(self, cache_factory=MessageCache, store=None, parse_executor=None, readonly=False,
+                 compress=False):
+        self.username = None
+        self.password = None
+        self.access_token = None
+
+        self.imap = None
+        self.smtp = None
+        self.logged_in = False
+        self.enabled = set()
+        self.mailboxes = {}
+        self.special_use = {}
+        self.listed_at = None
+        self.current_mailbox = None
+        self.selected = None
+        self.readonly = readonly
+        self.compress = compress
+        # commands in flight which need the selected mailbox, and the condition
+        # other mailboxes wait on until there are none
+        self._mailbox_users = 0
+        # blocks waiting for another mailbox than the selected one
+        self._mailbox_waiters = 0
+        self._selection = asyncio.Condition()
+        self.cache_factory = cache_factory
+        self.store = store
+        self.parse_executor = parse_executor
+
+        self._smtp_lock = asyncio.Lock()
+
+    def __repr__(self):
+        return '<AsyncGmail {}>'.format(self.username)
+
+    async def _connect_imap(self):
+        self.imap = AsyncIMAPConnection(self.GMAIL_IMAP_HOST, self.GMAIL_IMAP_PORT)
+        await self.imap.open()
+        self.enabled = set()
+        self.selected = None
+        return self.imap
+
+    async def login(self, username, password, only_fetch=False):
+        # by default logins for both IMAP and SMTP connection
+        self.username = username
+        self.password = password
+
+        if not self.imap:
+            await self._connect_imap()
+        response, _ = await self.imap.login(username, password)
+        self.logged_in = response == 'OK'
+        if self.logged_in:
+            await self._start_session()
+
+        if not only_fetch:
+            await self._in_executor(self._connect_smtp)
+
+        return self.logged_in
+
+    async def authenticate(self, username, access_token):
+        self.username = username
+        self.access_token = access_token
+
+        if not self.imap:
+            await self._connect_imap()
+        response, _ = await self.imap.authenticate_xoauth2(username, access_token)
+        self.logged_in = response == 'OK'
+        if self.logged_in:
+            await self._start_session()
+
+        return self.logged_in
+
+    async def _start_session(self):
+        if self.compress:
+            await self.imap.compress()
+        await self.fetch_mailboxes()
+
+    async def enable(self, capability):
+        """ENABLE an IMAP extension once per connection, see ``Gmail.enable``."""
+        if capability in self.enabled:
+            return True
+        capabilities = self.imap.capabilities
+        if capability not in capabilities or 'ENABLE' not in capabilities \
+                or self.selected is not None:
+            return False
+
+        response, _ = await self.imap.enable(capability)
+        if response == 'OK':
+            self.enabled.add(capability)
+        return response == 'OK'
+
+    async def fetch_mailboxes(self, status=None):
+        """LIST the mailboxes, see ``Gmail.fetch_mailboxes``."""
+        returns = list_returns(self.imap.capabilities, status)
+        if returns:
+            response, listed, statuses = await self.imap.list_extended(returns)
+        else:
+            (response, listed), statuses = await self.imap.list(), []
+        if response == 'OK':
+            update_mailboxes(self, parse_list(listed), parse_statuses(statuses))
+
+    async def counts(self, items=STATUS_ITEMS):
+        """The STATUS counts of every selectable mailbox, see ``Gmail.counts``."""
+        if 'LIST-STATUS' in self.imap.capabilities:
+            await self.fetch_mailboxes(status=items)
+        else:
+            await asyncio.gather(*[mailbox.status(items) for mailbox in list(self.mailboxes.values())
+                                   if mailbox.selectable])
+        return mailbox_counts(self)
+
+    async def use_mailbox(self, mailbox, readonly=None, force=False):
+        """SELECT or EXAMINE ``mailbox`` unless already open, see ``Gmail.use_mailbox``."""
+        name = unquoted(mailbox)
+        self.current_mailbox = name
+        if not name:
+            return False
+
+        if not force and self._is_selected(name, readonly):
+            return False
+
+        readonly = self.readonly if readonly is None else readonly
+        self.selected = None
+        await self.imap.select(quote(name), readonly)
+        self.selected = (name, readonly)
+        return True
+
+    def _is_selected(self, name, readonly=None):
+        # a read-write selection serves read-only use too
+        readonly = self.readonly if readonly is None else readonly
+        return self.selected is not None and self.selected[0] == name \
+            and (readonly or not self.selected[1])
+
+    @asynccontextmanager
+    async def hold_mailbox(self, mailbox, readonly=None, force=False, idle=False):
+        """
+            Keep ``mailbox`` selected while the block runs, yielding the connection.
+            Blocks on the same mailbox share it and pipeline their commands; a block
+            needing another mailbox (or a fresh SELECT) waits until they are done,
+            so no command runs in a mailbox selected by someone else. It ends a
+            running IDLE, and ``idle`` blocks let such waiting blocks go first.
+        """
+        name = unquoted(mailbox.external_name)
+        async with self._selection:
+            while self._mailbox_users and (force or not self._is_selected(name, readonly)) \
+                    or idle and self._mailbox_waiters:
+                if not idle:
+                    # an IDLE holding the mailbox would not end by itself
+                    self.imap._end_idle()
+                    self._mailbox_waiters += 1
+                try:
+                    await self._selection.wait()
+                finally:
+                    if not idle:
+                        self._mailbox_waiters -= 1
+            if await self.use_mailbox(mailbox.external_name, readonly, force):
+                mailbox._selected()
+            self._mailbox_users += 1
+        try:
+            yield self.imap
+        finally:
+            async with self._selection:
+                self._mailbox_users -= 1
+                self._selection.notify_all()
+
+    async def get_mailbox(self, mailbox_name):
+        if not self.logged_in:
+            raise AuthenticationError('You must log in first.')
+
+        if self.listed_at is None or time.time() - self.listed_at > self.MAILBOX_REFRESH:
+            await self.fetch_mailboxes()
+
+        mailbox = self.mailboxes.get(encode_utf7(mailbox_name).encode())
+
+        if mailbox:
+            await mailbox.ensure_selected()
+
+        return mailbox
+
+    async def find(self, mailbox_name=None, **kwargs):
+        box = await self.get_mailbox(mailbox_name or self.all_mail_name)
+        return await box.get_mail(**kwargs)
+
+    def idle(self, timeout=None, renew=IDLE_RENEW):
+        """Wait for changes on the selected mailbox, see ``Gmail.idle``."""
+        return self.imap.idle(timeout, renew)
+
+    special_mailbox = Gmail.special_mailbox
+    special_name = Gmail.special_name
+    trash_name = Gmail.trash_name
+    all_mail_name = Gmail.all_mail_name
+    labels = Gmail.labels
+
+    async def send(self, message):
+        async with self._smtp_lock:
+            await self._in_executor(self._send, message)
+
+    def _send(self, message):
+        if self.smtp is None:
+            self._connect_smtp()
+        try:
+            self.smtp.sendmail(self.username, recipients(message), message.as_string())
+        except SMTPException as error:
+            if not dropped(error):
+                raise
+            # Gmail drops idle SMTP connections, so reconnect once
+            self._connect_smtp()
+            self.smtp.sendmail(self.username, recipients(message), message.as_string())
+
+    def _connect_smtp(self):
+        self.smtp = connect_smtp(self.username, self.password, self.access_token,
+                                 host=self.GMAIL_SMTP_HOST, port=self.GMAIL_SMTP_PORT)
+        return self.smtp
+
+    def _in_executor(self, function, *args):
+        return asyncio.get_running_loop().run_in_executor(None, function, *args)
+
+    async def logout(self):
+        await self.imap.logout()
+        self.logged_in = False
+
+        if self.smtp is not None:
+            smtp, self.smtp = self.smtp, None
+            try:
+                await self._in_executor(smtp.quit)
+            except (SMTPServerDisconnected, OSError):
+                pass
+
+    @property
+    def mail_domain(self):
+        return self.username.split('@')[-1]
+
+
+def _line(parts):
+    return parts[0][0] if isinstance(parts[0], tuple) else parts[0]
+
+
+def _idle_stop(loop, deadline, renew):
+    # when the next IDLE ends at the latest
+    stop = loop.time() + renew
+    return stop if deadline is None else min(stop, deadline)
+
+
+async def _inflate(raw, reader, codec):
+    """Feed ``reader`` what arrives on ``raw``, inflated by ``codec``."""
+    try:
+        while True:
+            wire = await raw.read(65536)
+            if not wire:
+                reader.feed_eof()
+                return
+            data = codec.decompress(wire)
+            if data:
+                reader.feed_data(data)
+    except asyncio.CancelledError:
+        reader.feed_eof()
+        raise
+    except Exception as error:
+        reader.set_exception(error)
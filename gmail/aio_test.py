@@ -0,0 +1,140 @@
+import asyncio
+import socket
+import threading
+
+import pytest
+
+from gmail.aio import AsyncGmail, AsyncIMAPConnection
+from gmail.exceptions import GmailException
+from gmail.session_test import AFTER_LOGIN, FakeServer
+from gmail.uidset import UIDSet
+
+
+def serve(capabilities=AFTER_LOGIN, **kwargs):
+    """A local port a FakeServer answers on, and a list the server lands in."""
+    listener = socket.socket()
+    listener.bind(('127.0.0.1', 0))
+    listener.listen(1)
+    accepted = []
+
+    def accept():
+        sock, _ = listener.accept()
+        listener.close()
+        accepted.append(FakeServer(sock, capabilities, **kwargs))
+        accepted[0].run()
+
+    threading.Thread(target=accept, daemon=True).start()
+    return listener.getsockname()[1], accepted
+
+
+async def login(capabilities=AFTER_LOGIN, **kwargs):
+    """An AsyncGmail session logged in to a FakeServer, and the server."""
+    port, accepted = serve(capabilities, **kwargs)
+    gmail = AsyncGmail()
+    gmail.imap = AsyncIMAPConnection('127.0.0.1', port)
+    # the fake server speaks plain text
+    gmail.imap.ssl_context = None
+    await gmail.imap.open()
+    await gmail.login('user@example.com', 'password', only_fetch=True)
+    return gmail, accepted[0]
+
+
+def test_mailboxes_used_at_once_each_see_their_own_messages():
+    async def run():
+        gmail, fake = await login()
+        inbox = await gmail.get_mailbox('INBOX')
+        trash = await gmail.get_mailbox('[Gmail]/Trash')
+        found = await asyncio.gather(inbox.uids(), trash.uids(), inbox.count())
+        gmail.imap.close()
+        return found
+
+    inbox, trash, count = asyncio.run(run())
+    assert (list(inbox), list(trash), count) == ([1, 2, 3], [7], 3)
+
+
+def test_sync_of_a_quiet_mailbox_reports_nothing():
+    async def run():
+        gmail, fake = await login()
+        inbox = await gmail.get_mailbox('INBOX')
+        first = await inbox.sync()
+        del fake.commands[:]
+        second = await inbox.sync(first.state)
+        gmail.imap.close()
+        return first, second, fake.commands
+
+    first, second, commands = asyncio.run(run())
+    assert first.new == [1, 2, 3]
+    assert (second.new, second.changed, second.vanished) == ([], [], [])
+    assert commands == ['SELECT "INBOX"']
+
+
+async def idle_beside(mailbox, command):
+    """The events of ``mailbox.idle`` while ``command`` runs, and its result."""
+    async def idle():
+        return [event.type async for event in mailbox.idle(timeout=0.3)]
+
+    async def later():
+        await asyncio.sleep(0.1)
+        return await command
+
+    return await asyncio.gather(idle(), later())
+
+
+def test_idle_ends_for_a_command_on_the_same_mailbox():
+    async def run():
+        gmail, fake = await login()
+        inbox = await gmail.get_mailbox('INBOX')
+        del fake.commands[:]
+        events, count = await idle_beside(inbox, inbox.count())
+        gmail.imap.close()
+        return events, count, fake.commands
+
+    events, count, commands = asyncio.run(run())
+    assert (events, count) == ([], 3)
+    assert commands == ['IDLE', 'DONE', 'UID SEARCH RETURN (COUNT) ALL', 'IDLE', 'DONE']
+
+
+def test_idle_lets_another_mailbox_go_first():
+    async def run():
+        gmail, fake = await login()
+        inbox = await gmail.get_mailbox('INBOX')
+        trash = await gmail.get_mailbox('[Gmail]/Trash')
+        del fake.commands[:]
+        events, uids = await idle_beside(inbox, trash.uids())
+        gmail.imap.close()
+        return events, uids, fake.commands
+
+    events, uids, commands = asyncio.run(run())
+    assert list(uids) == [7]
+    assert commands[:5] == ['SELECT "INBOX"', 'IDLE', 'DONE', 'SELECT "[Gmail]/Trash"', 'UID SEARCH RETURN (ALL) ALL']
+    assert commands[5:] == ['SELECT "INBOX"', 'IDLE', 'DONE']
+
+
+def test_events_are_yielded_once_idle_is_over():
+    async def run():
+        gmail, fake = await login()
+        inbox = await gmail.get_mailbox('INBOX')
+        fake.pushes = [['4 EXISTS']]
+        del fake.commands[:]
+        counts = [await inbox.count() async for event in inbox.idle(timeout=0.3)]
+        gmail.imap.close()
+        return counts, fake.commands
+
+    counts, commands = asyncio.run(run())
+    assert counts == [3]
+    assert commands == ['IDLE', 'DONE', 'UID SEARCH RETURN (COUNT) ALL', 'IDLE', 'DONE']
+
+
+def test_async_attachments_have_no_blocking_payload():
+    async def run():
+        gmail, fake = await login()
+        inbox = await gmail.get_mailbox('INBOX')
+        message, = await inbox.fetch(UIDSet([2]))
+        attachment = message.attachments[-1]
+        with pytest.raises(GmailException):
+            attachment.payload
+        payload = await attachment.read()
+        gmail.imap.close()
+        return payload
+
+    assert asyncio.run(run()) == b'PDFDATA'
@@ -0,0 +1,126 @@
+# -*- coding: utf-8 -*-
+
+"""
+gmail.cache
+~~~~~~~~~~~~~~~~~~~
+
+This module contains the in-memory cache of parsed messages kept by each
+Mailbox.
+
+"""
+
+from collections import OrderedDict
+
+
+class MessageCache:
+    """
+        A dict-like LRU cache of messages keyed by UID, bounded by number of
+        entries and by the bytes the messages hold. ``None`` means unbounded.
+    """
+
+    def __init__(self, max_entries=None, max_bytes=None):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+
+        # uid -> (message, size)
+        self._entries = OrderedDict()
+        self.bytes = 0
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+        self.uidvalidity = None
+
+    def __repr__(self):
+        return '<MessageCache {} messages, {} bytes>'.format(len(self), self.bytes)
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, uid):
+        return uid in self._entries
+
+    def __iter__(self):
+        return iter(list(self._entries))
+
+    def __getitem__(self, uid):
+        message = self.get(uid)
+        if message is None:
+            raise KeyError(uid)
+        return message
+
+    def __setitem__(self, uid, message):
+        self.put(uid, message)
+
+    def __delitem__(self, uid):
+        _, size = self._entries.pop(uid)
+        self.bytes -= size
+
+    def keys(self):
+        return list(self._entries)
+
+    def values(self):
+        return [message for message, _ in self._entries.values()]
+
+    def items(self):
+        return [(uid, message) for uid, (message, _) in self._entries.items()]
+
+    def get(self, uid, default=None):
+        entry = self._entries.get(uid)
+        if entry is None:
+            self.misses += 1
+            return default
+
+        self.hits += 1
+        self._entries.move_to_end(uid)
+        return entry[0]
+
+    def put(self, uid, message):
+        if uid in self._entries:
+            del self[uid]
+
+        size = message._size
+        self._entries[uid] = (message, size)
+        self.bytes += size
+        self._evict()
+
+    def update(self, uid):
+        """Re-measure a cached message after more of it has been fetched."""
+        entry = self._entries.get(uid)
+        if entry is not None:
+            self.put(uid, entry[0])
+
+    def pop(self, uid, default=None):
+        if uid not in self._entries:
+            return default
+        message = self._entries[uid][0]
+        del self[uid]
+        return message
+
+    def clear(self):
+        self._entries.clear()
+        self.bytes = 0
+
+    def validate(self, uidvalidity):
+        """Drop every entry if the mailbox UIDVALIDITY has changed."""
+        if self.uidvalidity is not None and uidvalidity != self.uidvalidity:
+            self.clear()
+        self.uidvalidity = uidvalidity
+
+    def stats(self):
+        return {
+            'entries': len(self),
+            'bytes': self.bytes,
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+        }
+
+    def _evict(self):
+        while self._entries and (
+                (self.max_entries is not None and len(self._entries) > self.max_entries) or
+                (self.max_bytes is not None and self.bytes > self.max_bytes)):
+            _, (_, size) = self._entries.popitem(last=False)
+            self.bytes -= size
+            self.evictions += 1
@@ -0,0 +1,52 @@
+from gmail.cache import MessageCache
+from gmail.message import Message
+from gmail.parser_test import RAW
+from gmail.session_test import login
+from gmail.uidset import UIDSet
+
+
+def message(uid, size=0):
+    message = Message(None, uid)
+    message._size = size
+    return message
+
+
+def test_least_recently_used_entries_are_evicted():
+    cache = MessageCache(max_entries=2)
+    cache[b'1'], cache[b'2'] = message(b'1'), message(b'2')
+    cache.get(b'1')
+    cache[b'3'] = message(b'3')
+    assert cache.keys() == [b'1', b'3']
+    assert cache.stats() == {'entries': 2, 'bytes': 0, 'hits': 1, 'misses': 0, 'evictions': 1}
+
+
+def test_entries_are_evicted_past_max_bytes():
+    cache = MessageCache(max_bytes=100)
+    cache[b'1'], cache[b'2'] = message(b'1', 60), message(b'2', 30)
+    cache[b'3'] = message(b'3', 20)
+    assert cache.keys() == [b'2', b'3'] and cache.bytes == 50
+
+
+def test_update_measures_a_message_again():
+    cache = MessageCache(max_bytes=100)
+    cache[b'1'], cache[b'2'] = message(b'1', 10), message(b'2', 10)
+    cache.get(b'2')._size = 95
+    cache.update(b'2')
+    assert cache.keys() == [b'2'] and cache.bytes == 95
+    assert cache.get(b'1') is None and cache.misses == 1
+
+
+def test_a_new_uidvalidity_empties_the_cache():
+    cache = MessageCache()
+    cache.validate(1)
+    cache[b'1'] = message(b'1', 10)
+    cache.validate(1)
+    assert len(cache) == 1
+    cache.validate(2)
+    assert len(cache) == 0 and cache.bytes == 0
+
+
+def test_a_mailbox_cache_holds_the_fetched_bodies():
+    gmail, fake = login()
+    gmail.inbox.fetch(UIDSet([1, 2]))
+    assert gmail.inbox.cache.stats()['bytes'] == 2 * len(RAW)
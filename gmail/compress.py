@@ -0,0 +1,59 @@
+# -*- coding: utf-8 -*-
+
+"""
+gmail.compress
+~~~~~~~~~~~~~~~~~~~
+
+This module contains DeflateCodec, the two DEFLATE streams of an IMAP
+connection after COMPRESS=DEFLATE (RFC 4978). It only turns bytes into
+bytes, so the blocking and the asyncio connections share it.
+
+"""
+
+import zlib
+
+# RFC 4978 asks for raw DEFLATE, without zlib header or checksum
+_WBITS = -15
+
+
+class DeflateCodec:
+    """
+        Compresses what a connection sends and inflates what it receives,
+        counting the bytes on the wire and the bytes they stand for.
+    """
+
+    def __init__(self, level=zlib.Z_DEFAULT_COMPRESSION):
+        self._deflate = zlib.compressobj(level, zlib.DEFLATED, _WBITS)
+        self._inflate = zlib.decompressobj(_WBITS)
+
+        # bytes before compression and after it, each way
+        self.sent = 0
+        self.sent_wire = 0
+        self.received = 0
+        self.received_wire = 0
+
+    def __repr__(self):
+        return '<DeflateCodec received {} of {} bytes, sent {} of {}>'.format(
+            self.received_wire, self.received, self.sent_wire, self.sent)
+
+    def compress(self, data):
+        """
+            Compress ``data`` and flush it, since a command can't wait in the
+            compressor for more to come.
+        """
+        wire = self._deflate.compress(data) + self._deflate.flush(zlib.Z_SYNC_FLUSH)
+        self.sent += len(data)
+        self.sent_wire += len(wire)
+        return wire
+
+    def decompress(self, wire):
+        """Inflate ``wire``; may return nothing until a whole block has arrived."""
+        data = self._inflate.decompress(wire)
+        self.received += len(data)
+        self.received_wire += len(wire)
+        return data
+
+    @property
+    def ratio(self):
+        """How many received bytes every byte on the wire stood for."""
+        return self.received / self.received_wire if self.received_wire else None
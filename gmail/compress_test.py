@@ -0,0 +1,48 @@
+import asyncio
+
+from gmail.aio_test import login as async_login
+from gmail.compress import DeflateCodec
+from gmail.parser_test import RAW
+from gmail.session_test import AFTER_LOGIN, login
+from gmail.uidset import UIDSet
+
+COMPRESSING = AFTER_LOGIN + ' COMPRESS=DEFLATE'
+
+
+def test_codecs_read_each_other():
+    client, server = DeflateCodec(), DeflateCodec()
+    wire = client.compress(RAW * 10)
+    assert server.decompress(wire) == RAW * 10
+    assert (client.sent, client.sent_wire) == (len(RAW) * 10, len(wire))
+    assert server.ratio == len(RAW) * 10 / len(wire) > 5
+    assert DeflateCodec().ratio is None
+
+
+def test_commands_and_responses_are_compressed():
+    gmail, fake = login(COMPRESSING)
+    assert gmail.imap.compress()
+    message, = gmail.inbox.fetch(UIDSet([2]))
+    assert message.attachments[-1].payload == b'PDFDATA'
+    assert fake.commands[-1] == 'UID FETCH 2 (BODY.PEEK[] FLAGS X-GM-THRID X-GM-MSGID X-GM-LABELS)'
+    assert gmail.imap.compression.received > gmail.imap.compression.received_wire
+
+
+def test_compress_needs_the_capability():
+    gmail, fake = login()
+    assert not gmail.imap.compress()
+    assert gmail.imap.compression is None
+    assert 'COMPRESS DEFLATE' not in fake.commands
+
+
+def test_the_async_connection_compresses_too():
+    async def run():
+        gmail, fake = await async_login(COMPRESSING)
+        compressed = await gmail.imap.compress()
+        inbox = await gmail.get_mailbox('INBOX')
+        uids = await inbox.uids()
+        gmail.imap.close()
+        return compressed, uids, gmail.imap.compression, fake.commands
+
+    compressed, uids, codec, commands = asyncio.run(run())
+    assert compressed and list(uids) == [1, 2, 3]
+    assert 'COMPRESS DEFLATE' in commands and codec.sent_wire > 0
@@ -0,0 +1,126 @@
+# -*- coding: utf-8 -*-
+
+"""
+gmail.connection
+~~~~~~~~~~~~~~~~~~~
+
+This module contains the IMAP connection used by Gmail: imaplib's
+IMAP4_SSL reading through its own buffer, so callers can wait for a
+response with a timeout (as IDLE does) without losing buffered data, and
+optionally compressing its traffic with COMPRESS=DEFLATE.
+
+"""
+
+import imaplib
+import select
+
+from .compress import DeflateCodec
+
+# same limit imaplib puts on a single response line
+_MAXLINE = 1000000
+
+# imaplib refuses commands it doesn't know
+imaplib.Commands.setdefault('COMPRESS', ('AUTH', 'SELECTED'))
+
+
+class IMAPConnection(imaplib.IMAP4_SSL):
+
+    def open(self, host='', port=imaplib.IMAP4_SSL_PORT, timeout=None):
+        self._buffer = bytearray()
+        # the DeflateCodec once COMPRESS succeeded
+        self.compression = None
+        imaplib.IMAP4_SSL.open(self, host, port, timeout)
+
+    def _recv(self):
+        data = self.sock.recv(65536)
+        if not data:
+            raise self.abort('socket error: EOF')
+        if self.compression is not None:
+            data = self.compression.decompress(data)
+        self._buffer += data
+
+    def send(self, data):
+        if self.compression is not None:
+            data = self.compression.compress(data)
+        imaplib.IMAP4_SSL.send(self, data)
+
+    def compress(self, level=None):
+        """
+            Turn on COMPRESS=DEFLATE (RFC 4978) for the rest of the connection.
+            Returns False when the server doesn't offer it; the byte counts are
+            kept in ``compression``.
+        """
+        if self.compression is not None:
+            return True
+        if 'COMPRESS=DEFLATE' not in self.capabilities:
+            self._update_capabilities()
+            if 'COMPRESS=DEFLATE' not in self.capabilities:
+                return False
+
+        typ, dat = self._simple_command('COMPRESS', 'DEFLATE')
+        if typ != 'OK':
+            return False
+
+        codec = DeflateCodec() if level is None else DeflateCodec(level)
+        # whatever the server sent after the tagged OK is compressed already
+        pending, self._buffer = bytes(self._buffer), bytearray()
+        self.compression = codec
+        if pending:
+            self._buffer += codec.decompress(pending)
+        return True
+
+    def _update_capabilities(self):
+        # the capabilities grow after login, and Gmail names them in its reply
+        typ, dat = self._untagged_response('OK', [None], 'CAPABILITY')
+        if dat[-1] is None:
+            typ, dat = self.capability()
+        if dat[-1]:
+            self.capabilities = tuple(dat[-1].decode().upper().split())
+
+    def read(self, size):
+        while len(self._buffer) < size:
+            self._recv()
+        data = bytes(self._buffer[:size])
+        del self._buffer[:size]
+        return data
+
+    def readline(self):
+        searched = 0
+        while True:
+            end = self._buffer.find(b'\n', searched)
+            if end >= 0:
+                break
+            if len(self._buffer) > _MAXLINE:
+                raise self.error('got more than %d bytes' % _MAXLINE)
+            searched = len(self._buffer)
+            self._recv()
+
+        line = bytes(self._buffer[:end + 1])
+        del self._buffer[:end + 1]
+        return line
+
+    def uid(self, command, *args):
+        if command.upper() == 'SEARCH' and args and str(args[0]).upper() == 'RETURN':
+            # SEARCH RETURN is answered with ESEARCH rather than SEARCH
+            typ, dat = self._simple_command('UID', command, *args)
+            return self._untagged_response(typ, dat, 'ESEARCH')
+        return imaplib.IMAP4_SSL.uid(self, command, *args)
+
+    def list_extended(self, returns, directory='""', pattern='"*"'):
+        """
+            LIST with RETURN options (RFC 5258), e.g. ``['SPECIAL-USE']``. Returns
+            the status, the LIST data and the data of any STATUS responses.
+        """
+        self.untagged_responses.pop('STATUS', None)
+        typ, dat = self._simple_command('LIST', directory, pattern,
+                                        'RETURN', '(%s)' % ' '.join(returns))
+        status = self.untagged_responses.pop('STATUS', [])
+        typ, dat = self._untagged_response(typ, dat, 'LIST')
+        return typ, dat, status
+
+    def wait(self, timeout):
+        """Return True once a response can be read, or False after ``timeout`` seconds."""
+        if self._buffer or getattr(self.sock, 'pending', lambda: 0)():
+            return True
+        readable, _, _ = select.select([self.sock], [], [], timeout)
+        return bool(readable)
@@ -24,3 +24,7 @@ class AuthenticationError(GmailException):
 
 class Timeout(GmailException):
     """The request timed out."""
+
+
+class Throttled(GmailException):
+    """Gmail throttled the account, the request should be retried later."""
@@ -1,11 +1,17 @@
 import imaplib
 import logging
 import re
-import smtplib
-from smtplib import SMTPResponseException, SMTPServerDisconnected, SMTPAuthenticationError
-import sys
-
-from .mailbox import Mailbox
+from smtplib import SMTPException, SMTPResponseException, SMTPServerDisconnected
+import time
+
+from .cache import MessageCache
+from .connection import IMAPConnection
+from .idle import IDLE_RENEW, idle
+from .mailbox import Mailbox, ALL_MAIL, STATUS_ITEMS, TRASH_NAMES
+from .parser import parse_list, parse_statuses
+from .query import quote
+from .smtp import SendQueue, connect_smtp, dropped, recipients, xoauth2_string
+from .uidset import UIDSet
 from .utf import encode as encode_utf7, decode as decode_utf7
 from .exceptions import *
 
@@ -20,11 +26,16 @@ class Gmail:
     GMAIL_IMAP_PORT = 993
 
     # GMail SMTP defaults
-    # TODO: implement SMTP functions
     GMAIL_SMTP_HOST = "smtp.gmail.com"
     GMAIL_SMTP_PORT = 587
 
-    def __init__(self, debug=True):
+    mailbox_class = Mailbox
+
+    # seconds after which the mailbox list is fetched again on get_mailbox
+    MAILBOX_REFRESH = 5 * 60
+
+    def __init__(self, debug=True, cache_factory=MessageCache, store=None, parse_executor=None,
+                 readonly=False, compress=False):
         self.username = None
         self.password = None
         self.access_token = None
@@ -32,9 +43,27 @@ class Gmail:
         self.imap = None
         self.smtp = None
         self.logged_in = False
+        # extensions turned on with ENABLE on the current IMAP connection
+        self.enabled = set()
         self.mailboxes = {}
+        # the mailboxes by SPECIAL-USE attribute, e.g. '\\Trash'
+        self.special_use = {}
+        # time.time() of the last LIST
+        self.listed_at = None
         self.current_mailbox = None
+        # (name, readonly) of the mailbox selected on the IMAP connection
+        self.selected = None
+        # open mailboxes with EXAMINE rather than SELECT, e.g. for reporting jobs
+        self.readonly = readonly
+        # turn on COMPRESS=DEFLATE after login, see IMAPConnection.compress
+        self.compress = compress
         self.debug = debug
+        # builds the message cache of each mailbox
+        self.cache_factory = cache_factory
+        # optional on-disk MessageStore checked before fetching message bodies
+        self.store = store
+        # optional executor, e.g. a ProcessPoolExecutor, parsing fetched bodies
+        self.parse_executor = parse_executor
 
         # self.connect_imap()
 
@@ -46,11 +75,31 @@ class Gmail:
         #         raise Exception('connect_imapion failure.')
         #     self.imap = None
 
-        self.imap = imaplib.IMAP4_SSL(
+        self.imap = IMAPConnection(
             self.GMAIL_IMAP_HOST, self.GMAIL_IMAP_PORT)
+        self.enabled = set()
+        self.selected = None
 
         return self.imap
 
+    def enable(self, capability):
+        """
+            ENABLE an IMAP extension, such as CONDSTORE, once per connection.
+            Returns False when the server doesn't support it, or when a mailbox is
+            already selected (ENABLE is only valid before that, RFC 5161).
+        """
+        if capability in self.enabled:
+            return True
+        capabilities = self.imap.capabilities
+        if capability not in capabilities or 'ENABLE' not in capabilities \
+                or self.imap.state != 'AUTH':
+            return False
+
+        response, _ = self.imap.enable(capability)
+        if response == 'OK':
+            self.enabled.add(capability)
+        return response == 'OK'
+
     def is_connected(self):
         """
             Check is session connected - initially by checking session instance and
@@ -72,47 +121,74 @@ class Gmail:
             return False
 
     def _connect_smtp(self, raise_errors=True):
+        # logs in with the credentials of the IMAP session
+        self.smtp = connect_smtp(self.username, self.password, self.access_token, self.debug,
+                                 self.GMAIL_SMTP_HOST, self.GMAIL_SMTP_PORT)
+        return self.smtp
 
-        self.smtp = smtplib.SMTP(self.GMAIL_SMTP_HOST, self.GMAIL_SMTP_PORT)
-        self.smtp.set_debuglevel(self.debug)
+    def fetch_mailboxes(self, status=None):
+        """
+            LIST the mailboxes, with their SPECIAL-USE attributes and, when ``status``
+            names STATUS items and the server has LIST-STATUS, their counts, all in
+            one command. Known Mailbox objects are kept.
+        """
+        returns = list_returns(self.imap.capabilities, status)
+        if returns:
+            response, listed, statuses = self.imap.list_extended(returns)
+        else:
+            (response, listed), statuses = self.imap.list(), []
+        if response == 'OK':
+            update_mailboxes(self, parse_list(listed), parse_statuses(statuses))
 
-        self.smtp.ehlo()
-        self.smtp.starttls()
-        self.smtp.ehlo()
+    def counts(self, items=STATUS_ITEMS):
+        """
+            The STATUS counts of every selectable mailbox by name, from one LIST-STATUS
+            when the server has it and one STATUS per mailbox otherwise.
+        """
+        if 'LIST-STATUS' in self.imap.capabilities:
+            self.fetch_mailboxes(status=items)
+        else:
+            for mailbox in list(self.mailboxes.values()):
+                if mailbox.selectable:
+                    mailbox.status(items)
+        return mailbox_counts(self)
+
+    def special_mailbox(self, use):
+        """The mailbox with the SPECIAL-USE attribute ``use``, e.g. '\\Sent', or None."""
+        return self.special_use.get(use)
+
+    def use_mailbox(self, mailbox, readonly=None, force=False):
+        """
+            SELECT ``mailbox``, or EXAMINE it when ``readonly``, unless the connection
+            already has it open (read-write serves read-only use too) or ``force`` is
+            set. Returns True when a command was sent.
+        """
+        name = unquoted(mailbox)
+        self.current_mailbox = name
+        if not name:
+            return False
 
-        return self.smtp
+        readonly = self.readonly if readonly is None else readonly
+        if not force and self.selected is not None and self.selected[0] == name \
+                and (readonly or not self.selected[1]):
+            return False
 
-    def fetch_mailboxes(self):
-        response, mailbox_list = self.imap.list()
-        if response == 'OK':
-            for mailbox in mailbox_list:
-                mailbox_name = mailbox.split(
-                    b'"/"')[-1].replace(b'"', b'').strip()
-                mailbox = Mailbox(self)
-                mailbox.external_name = mailbox_name
-                self.mailboxes[mailbox_name] = mailbox
-
-    def use_mailbox(self, mailbox):
-        if mailbox:
-            self.imap.select(mailbox)
-        self.current_mailbox = mailbox
+        response, _ = self.imap.select(quote(name), readonly)
+        self.selected = (name, readonly) if response == 'OK' else None
+        return True
 
     def get_mailbox(self, mailbox_name):
 
         if not self.logged_in:
             raise AuthenticationError('You must log in first.')
 
-        quoted_mailbox_name = None
-
-        if sys.version_info[0] == 3:
-            quoted_mailbox_name = bytes('"' + mailbox_name + '"', 'ascii')
-            mailbox_name = bytes(mailbox_name, "ascii")
+        if self.listed_at is None or time.time() - self.listed_at > self.MAILBOX_REFRESH:
+            self.fetch_mailboxes()
 
-        mailbox = self.mailboxes.get(mailbox_name) \
-                      or self.mailboxes.get(encode_utf7(mailbox_name))
+        mailbox = self.mailboxes.get(encode_utf7(mailbox_name).encode())
 
-        if mailbox and not self.current_mailbox == mailbox_name:
-            self.use_mailbox(quoted_mailbox_name or mailbox_name)
+        if mailbox:
+            mailbox.ensure_selected()
 
         return mailbox
 
@@ -120,7 +196,7 @@ class Gmail:
         mailbox = self.mailboxes.get(mailbox_name)
         if not mailbox:
             self.imap.create(mailbox_name)
-            mailbox = Mailbox(self, mailbox_name)
+            mailbox = self.mailbox_class(self, mailbox_name)
             self.mailboxes[mailbox_name] = mailbox
 
         return mailbox
@@ -138,19 +214,40 @@ class Gmail:
         imap_login = self.imap.login(self.username, self.password)
         self.logged_in = (imap_login and imap_login[0] == 'OK')
         if self.logged_in:
-            self.fetch_mailboxes()
+            self._start_session()
         return self.logged_in
 
+    def _start_session(self):
+        # imaplib reads the capabilities before login only, and Gmail lists
+        # MOVE, UIDPLUS, ESEARCH, CONDSTORE and LIST-STATUS once logged in
+        self.imap._update_capabilities()
+        if self.compress:
+            self.imap.compress()
+        self.fetch_mailboxes()
+
     def send(self, message):
-        if not self.is_connected():
+        if self.smtp is None:
             self._connect_smtp()
+        try:
+            return self.smtp.sendmail(self.username, recipients(message), message.as_string())
+        except SMTPException as error:
+            if not dropped(error):
+                raise
+            # Gmail drops idle SMTP connections, so reconnect once
+            self._connect_smtp()
+            return self.smtp.sendmail(self.username, recipients(message), message.as_string())
 
-        recepients = []
-        recepients.extend(message.get_all('To') or [])
-        recepients.extend(message.get_all('Bcc') or [])
-        recepients.extend(message.get_all('Cc') or [])
-
-        self.smtp.sendmail(self.username, recepients, message.as_string())
+    def send_queue(self, connections=2, rotate_after=100):
+        """
+            A SendQueue for this account, sending many messages over ``connections``
+            SMTP connections kept open between messages.
+        """
+        return SendQueue(self.username, self.password, self.access_token,
+                         connections=connections,
+                         rotate_after=rotate_after,
+                         debug=self.debug,
+                         host=self.GMAIL_SMTP_HOST,
+                         port=self.GMAIL_SMTP_PORT)
 
     def login(self, username, password, only_fetch=False):
         # by default logins for both IMAP and SMTP connection
@@ -166,12 +263,6 @@ class Gmail:
         if not only_fetch:
             self._connect_smtp()
 
-            try:
-                self.smtp.login(self.username, self.password)
-
-            except SMTPAuthenticationError:
-                raise AuthenticationError
-
         return self.logged_in
 
     def authenticate(self, username, access_token):
@@ -182,18 +273,47 @@ class Gmail:
             self._connect_imap()
 
         try:
-            auth_string = 'user=%s\1auth=Bearer %s\1\1' % (
-                username, access_token)
+            auth_string = xoauth2_string(username, access_token)
             imap_auth = self.imap.authenticate(
                 'XOAUTH2', lambda x: auth_string)
             self.logged_in = (imap_auth and imap_auth[0] == 'OK')
             if self.logged_in:
-                self.fetch_mailboxes()
+                self._start_session()
         except imaplib.IMAP4.error:
             raise AuthenticationError
 
         return self.logged_in
 
+    def reconnect(self):
+        """
+            Replace a dropped IMAP connection: connect and log in again with the
+            same credentials, then reselect the mailbox that was in use.
+        """
+        selected = self.selected
+        try:
+            self.imap.shutdown()
+        except (imaplib.IMAP4.error, OSError, AttributeError):
+            pass
+        self.imap = None
+
+        if self.access_token:
+            self.authenticate(self.username, self.access_token)
+        else:
+            self._login_imap(self.username, self.password)
+
+        if selected is not None:
+            self.use_mailbox(*selected)
+        return self.logged_in
+
+    def idle(self, timeout=None, renew=IDLE_RENEW):
+        """
+            Wait for changes on the selected mailbox, yielding an IdleEvent for each
+            EXISTS, EXPUNGE or FETCH the server pushes. Runs for ``timeout`` seconds,
+            or until the caller stops iterating. IDLE is over while the loop body
+            runs, so it can send commands, e.g. to sync the mailbox.
+        """
+        return idle(self.imap, timeout, renew)
+
     def logout(self):
         self.imap.logout()
         self.logged_in = False
@@ -201,13 +321,18 @@ class Gmail:
     def get_label(self, label_name):
         return self.get_mailbox(label_name)
 
-    def find(self, mailbox_name="[Gmail]/All Mail", **kwargs):
-        box = self.get_mailbox(mailbox_name)
-        return box.mail(**kwargs)
+    def find(self, mailbox_name=None, **kwargs):
+        box = self.get_mailbox(mailbox_name or self.all_mail_name)
+        return box.get_mail(**kwargs)
 
     def copy(self, uid, to_mailbox, from_mailbox=None):
+        """Copy a UID, or Message objects, UIDs or a UIDSet, to ``to_mailbox``."""
         if from_mailbox:
             self.use_mailbox(from_mailbox)
+        if isinstance(uid, int):
+            uid = str(uid)
+        elif not isinstance(uid, (str, bytes)):
+            uid = str(UIDSet(uid))
         self.imap.uid('COPY', uid, to_mailbox)
 
     def labels(self, require_unicode=False):
@@ -217,30 +342,100 @@ class Gmail:
                     for key in keys]
         return keys
 
+    def special_name(self, use, default):
+        """The name of the mailbox marked ``use``, or ``default`` without SPECIAL-USE."""
+        mailbox = self.special_use.get(use)
+        return mailbox.name if mailbox is not None else default
+
+    @property
+    def trash_name(self):
+        if '\\Trash' in self.special_use:
+            return self.special_use['\\Trash'].name
+        for name in TRASH_NAMES:
+            if encode_utf7(name).encode() in self.mailboxes:
+                return name
+        return TRASH_NAMES[0]
+
+    @property
+    def all_mail_name(self):
+        return self.special_name('\\All', ALL_MAIL)
+
     @property
     def inbox(self):
         return self.get_mailbox("INBOX")
 
     @property
     def spam(self):
-        return self.get_mailbox("[Gmail]/Spam")
+        return self.get_mailbox(self.special_name('\\Junk', "[Gmail]/Spam"))
 
     @property
     def starred(self):
-        return self.get_mailbox("[Gmail]/Starred")
+        return self.get_mailbox(self.special_name('\\Flagged', "[Gmail]/Starred"))
 
     @property
     def all_mail(self):
-        return self.get_mailbox("[Gmail]/All Mail")
+        return self.get_mailbox(self.all_mail_name)
 
     @property
     def sent_mail(self):
-        return self.get_mailbox("[Gmail]/Sent Mail")
+        return self.get_mailbox(self.special_name('\\Sent', "[Gmail]/Sent Mail"))
 
     @property
     def important(self):
-        return self.get_mailbox("[Gmail]/Important")
+        return self.get_mailbox(self.special_name('\\Important', "[Gmail]/Important"))
 
     @property
     def mail_domain(self):
         return self.username.split('@')[-1]
+
+
+def list_returns(capabilities, status=None):
+    """
+        The RETURN options of a LIST asking for SPECIAL-USE and ``status`` items.
+        RETURN (SPECIAL-USE) needs LIST-EXTENDED (RFC 6154); without it a plain
+        LIST still carries the attributes.
+    """
+    returns = []
+    if 'SPECIAL-USE' in capabilities and 'LIST-EXTENDED' in capabilities:
+        returns.append('SPECIAL-USE')
+    if status and 'LIST-STATUS' in capabilities:
+        returns.append('STATUS (%s)' % ' '.join(status))
+    return returns
+
+
+def update_mailboxes(gmail, listed, statuses):
+    """Bring ``gmail.mailboxes`` and ``gmail.special_use`` in line with a parsed LIST."""
+    mailboxes, special_use = {}, {}
+    for attributes, delimiter, name in listed:
+        mailbox = gmail.mailboxes.get(name)
+        if mailbox is None:
+            mailbox = gmail.mailbox_class(gmail)
+            mailbox.external_name = name
+        mailbox.attributes = attributes
+        mailbox.delimiter = delimiter
+        if name in statuses:
+            mailbox.counts = statuses[name]
+        mailboxes[name] = mailbox
+
+        use = mailbox.special_use
+        if use is not None:
+            special_use.setdefault(use, mailbox)
+
+    gmail.mailboxes.clear()
+    gmail.mailboxes.update(mailboxes)
+    gmail.special_use = special_use
+    gmail.listed_at = time.time()
+
+
+def mailbox_counts(gmail):
+    return dict((mailbox.name, mailbox.counts) for mailbox in gmail.mailboxes.values()
+                if mailbox.counts is not None)
+
+
+def unquoted(mailbox):
+    """A mailbox name given as str or bytes, quoted or not, as an unquoted str."""
+    if isinstance(mailbox, bytes):
+        mailbox = mailbox.decode()
+    if mailbox and len(mailbox) > 1 and mailbox[0] == mailbox[-1] == '"':
+        mailbox = mailbox[1:-1].replace('\\"', '"').replace('\\\\', '\\')
+    return mailbox
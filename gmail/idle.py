@@ -0,0 +1,130 @@
+# -*- coding: utf-8 -*-
+
+"""
+gmail.idle
+~~~~~~~~~~~~~~~~~~~
+
+This module implements IMAP IDLE (RFC 2177) on top of an IMAPConnection.
+
+"""
+
+import re
+import time
+
+from .exceptions import GmailException
+from .parser import fetch_items, tokenize
+
+# Gmail ends IDLE after about 29 minutes, so it is re-issued before that
+IDLE_RENEW = 25 * 60
+
+_UNTAGGED = re.compile(br'\* (\d+) (EXISTS|EXPUNGE|RECENT|FETCH)\b')
+
+
+class IdleEvent:
+    """An EXISTS, EXPUNGE, RECENT or FETCH response received while idling."""
+
+    def __init__(self, type, number, items=None):
+        self.type = type
+        # message count for EXISTS/RECENT, sequence number for EXPUNGE/FETCH
+        self.number = number
+        # FETCH items, e.g. {'FLAGS': [...], 'UID': b'42'}
+        self.items = items or {}
+
+    def __repr__(self):
+        return '<IdleEvent {} {}>'.format(self.type, self.number)
+
+
+def _read_response(imap):
+    # a response line plus any literals it announces
+    parts = [imap.readline()]
+    while True:
+        literal = re.search(br'\{(\d+)\}\r?\n$', parts[-1])
+        if not literal:
+            return parts
+        parts[-1] = (parts[-1].rstrip(), imap.read(int(literal.group(1))))
+        parts.append(imap.readline())
+
+
+def _event(parts):
+    line = parts[0][0] if isinstance(parts[0], tuple) else parts[0]
+    match = _UNTAGGED.match(line)
+    if not match:
+        return None
+
+    type = match.group(2).decode()
+    items = None
+    if type == 'FETCH':
+        # drop the leading "* " so the response reads "<seq> FETCH (...)"
+        first = parts[0]
+        if isinstance(first, tuple):
+            parts = [(first[0][2:], first[1])] + parts[1:]
+        else:
+            parts = [first[2:]] + parts[1:]
+        tokens = tokenize(parts)
+        items = fetch_items([tokens[0], tokens[2]] if len(tokens) > 2 else tokens)
+    return IdleEvent(type, int(match.group(1)), items)
+
+
+def idle(imap, timeout=None, renew=IDLE_RENEW, before=None):
+    """
+        Yield an IdleEvent for every change the server reports on the selected
+        mailbox, for ``timeout`` seconds or forever. IDLE is ended with DONE
+        before events are yielded, so the loop may send other commands, and is
+        issued again when it resumes, or every ``renew`` seconds, after calling
+        ``before`` if given.
+    """
+    if 'IDLE' not in imap.capabilities:
+        raise GmailException('The server does not support IDLE.')
+
+    deadline = timeout and time.time() + timeout
+
+    while deadline is None or time.time() < deadline:
+        stop = time.time() + renew
+        if deadline is not None:
+            stop = min(stop, deadline)
+
+        if before is not None:
+            before()
+        for event in _idle_until(imap, stop):
+            yield event
+
+
+def _idle_until(imap, stop):
+    """IDLE until the server reports a change or ``stop``, returning its events."""
+    tag = imap._new_tag()
+    del imap.tagged_commands[tag]
+    imap.send(tag + b' IDLE\r\n')
+
+    events = []
+    while True:
+        parts = _read_response(imap)
+        line = parts[0][0] if isinstance(parts[0], tuple) else parts[0]
+        if line.startswith(b'+'):
+            break
+        if line.startswith(tag + b' '):
+            raise GmailException('IDLE failed: %r' % line)
+        _add_event(events, parts)
+
+    try:
+        while not events:
+            remaining = stop - time.time()
+            if remaining <= 0:
+                break
+            if imap.wait(remaining):
+                _add_event(events, _read_response(imap))
+    finally:
+        # the responses sent before the server reads DONE are kept too
+        imap.send(b'DONE\r\n')
+        while True:
+            parts = _read_response(imap)
+            line = parts[0][0] if isinstance(parts[0], tuple) else parts[0]
+            if line.startswith(tag + b' '):
+                break
+            _add_event(events, parts)
+    return events
+
+
+def _add_event(events, parts):
+    event = _event(parts)
+    if event:
+        events.append(event)
@@ -0,0 +1,39 @@
+import pytest
+
+from gmail.exceptions import GmailException
+from gmail.session_test import login
+
+
+def test_commands_sent_from_the_loop_run_between_idles():
+    gmail, fake = login()
+    fake.pushes = [['4 EXISTS', '1 FETCH (UID 1 FLAGS (\\Seen))']]
+    events, counts = [], []
+    for event in gmail.inbox.idle(timeout=0.3):
+        events.append((event.type, event.number, event.items))
+        counts.append(gmail.inbox.count())
+
+    assert events == [('EXISTS', 4, {}), ('FETCH', 1, {'UID': b'1', 'FLAGS': [b'\\Seen']})]
+    assert counts == [3, 3]
+    assert fake.commands == ['SELECT "INBOX"', 'IDLE', 'DONE', 'UID SEARCH RETURN (COUNT) ALL',
+                             'UID SEARCH RETURN (COUNT) ALL', 'IDLE', 'DONE']
+
+
+def test_the_mailbox_is_selected_again_before_each_idle():
+    gmail, fake = login()
+    fake.pushes = [['4 EXISTS']]
+    for event in gmail.inbox.idle(timeout=0.3):
+        gmail.get_mailbox('[Gmail]/Trash').count()
+
+    assert fake.commands[-3:] == ['SELECT "INBOX"', 'IDLE', 'DONE']
+
+
+def test_idle_is_renewed():
+    gmail, fake = login()
+    assert list(gmail.inbox.idle(timeout=0.25, renew=0.1)) == []
+    assert fake.commands[1:] == ['IDLE', 'DONE'] * 3
+
+
+def test_idle_needs_the_capability():
+    gmail, fake = login('IMAP4rev1')
+    with pytest.raises(GmailException):
+        next(gmail.idle(timeout=0.1))
@@ -1,16 +1,57 @@
-import datetime
+import operator
+import re
+from functools import reduce
 
-from .message import Message
+from .message import (Message, FLAGS, FULL, STRUCTURE, PART_PROFILES, PROFILE_GROUPS, PROFILE_ITEMS,
+                      parse_email)
+from .exceptions import GmailException, Throttled
+from .idle import IDLE_RENEW, idle
+from .parser import parse_fetch
+from .query import Query, quote
+from .sync import SyncResult, SyncState
+from .uidset import UIDSet
 from .utf import encode as encode_utf7, decode as decode_utf7
 
 
+ALL_MAIL = '[Gmail]/All Mail'
+# the correlator opening an ESEARCH response
+_ESEARCH_TAG = re.compile(r'^\(TAG "[^"]*"\)\s*')
+# what Mailbox.status asks for by default
+STATUS_ITEMS = ('MESSAGES', 'UNSEEN', 'UIDNEXT', 'UIDVALIDITY')
+# the trash is called "Bin" in some locales
+TRASH_NAMES = ('[Gmail]/Trash', '[Gmail]/Bin')
+# SPECIAL-USE attributes (RFC 6154, plus Gmail's \Important) by lower case,
+# since servers don't agree on the case of attributes
+SPECIAL_USES = dict((use.lower(), use) for use in (
+    '\\All', '\\Archive', '\\Drafts', '\\Flagged', '\\Junk', '\\Sent', '\\Trash',
+    '\\Important'))
+
+
 class Mailbox:
+    message_class = Message
 
-    def __init__(self, gmail, name="INBOX"):
+    # number of UIDs sent per UID FETCH when prefetching
+    FETCH_CHUNK_SIZE = 500
+    # number of UIDs sent per UID STORE in bulk operations
+    STORE_CHUNK_SIZE = 1000
+    # number of thread ids ORed together in one UID SEARCH
+    THREAD_SEARCH_SIZE = 50
+
+    def __init__(self, gmail, name="INBOX", cache=None):
         self.name = name
         self.gmail = gmail
         self.date_format = "%d-%b-%Y"
-        self._messages = {}
+        self.uidvalidity = None
+        self.uidnext = None
+        self.highestmodseq = None
+        self.exists = None
+        # from LIST: the mailbox attributes, e.g. ('\\HasNoChildren', '\\Sent'),
+        # and the hierarchy delimiter
+        self.attributes = ()
+        self.delimiter = '/'
+        # the last STATUS counts, e.g. {'MESSAGES': 120, 'UNSEEN': 3}
+        self.counts = None
+        self._messages = cache if cache is not None else gmail.cache_factory()
 
     def __repr__(self):
         return '<Mailbox {}>'.format(self.external_name)
@@ -19,6 +60,10 @@ class Mailbox:
     def messages(self):
         return self._messages or self.get_mail()
 
+    @property
+    def cache(self):
+        return self._messages
+
     @property
     def external_name(self):
         if "external_name" not in vars(self):
@@ -31,75 +76,685 @@ class Mailbox:
             del vars(self)["external_name"]
         self.name = decode_utf7(value)
 
+    @property
+    def selectable(self):
+        return not any(attribute.lower() in ('\\noselect', '\\nonexistent')
+                       for attribute in self.attributes)
+
+    @property
+    def special_use(self):
+        """The SPECIAL-USE attribute of this mailbox, e.g. '\\Trash', or None."""
+        for attribute in self.attributes:
+            use = SPECIAL_USES.get(attribute.lower())
+            if use is not None:
+                return use
+        return None
+
+    @property
+    def parent(self):
+        if not self.delimiter or self.delimiter not in self.name:
+            return None
+        return self.gmail.mailboxes.get(
+            encode_utf7(self.name.rsplit(self.delimiter, 1)[0]).encode())
+
+    @property
+    def children(self):
+        return [mailbox for mailbox in self.gmail.mailboxes.values() if mailbox.parent is self]
+
     def get_mail(self,
+                 prefetch=False,
+                 chunk_size=FETCH_CHUNK_SIZE,
+                 profile=FULL,
                  **kwargs):
 
-        search = ['ALL']
+        emails = [self._message(str(uid).encode(), profile) for uid in self.uids(**kwargs)]
+
+        if prefetch:
+            self.fetch(emails, chunk_size, profile)
+
+        return emails
+
+    def iter_mail(self,
+                  chunk_size=FETCH_CHUNK_SIZE,
+                  profile=FULL,
+                  cache=False,
+                  **kwargs):
+        """
+            Yield the messages matching ``kwargs``, fetched ``chunk_size`` at a time.
+            Unless ``cache`` is set the mailbox keeps no reference to them, so memory
+            stays flat however large the mailbox is.
+        """
+        for chunk in self.uids(**kwargs).chunks(chunk_size):
+            messages = [self._message(str(uid).encode(), profile, cache) for uid in chunk]
+
+            self.fetch(messages, chunk_size, profile)
+
+            for message in messages:
+                yield message
+
+    def threads(self, chunk_size=FETCH_CHUNK_SIZE, profile=FULL, **kwargs):
+        """
+            The conversations with a message matching ``kwargs``, most recently active
+            first, each a list of messages oldest first. The other members are found
+            by X-GM-THRID in this mailbox (use All Mail for whole conversations) and
+            fetched in batches; messages already in the cache are not fetched again.
+        """
+        matched = self.fetch(self.uids(**kwargs), chunk_size, profile)
+        thread_ids = _unique(message.thread_id for message in matched)
+        return self._threads(thread_ids, chunk_size, profile)
+
+    def thread(self, thread_id, chunk_size=FETCH_CHUNK_SIZE, profile=FULL):
+        """The messages of conversation ``thread_id`` in this mailbox, oldest first."""
+        threads = self._threads([thread_id], chunk_size, profile)
+        return threads[0] if threads else []
+
+    def _threads(self, thread_ids, chunk_size, profile):
+        uids = UIDSet()
+        for start in range(0, len(thread_ids), self.THREAD_SEARCH_SIZE):
+            uids |= self.uids(query=thread_query(thread_ids[start:start + self.THREAD_SEARCH_SIZE]))
+        return group_threads(self.fetch(uids, chunk_size, profile))
+
+    def _message(self, uid, profile, cache=True):
+        message = self._messages.get(uid)
+        if message is None:
+            message = self.message_class(self, uid, profile)
+            if cache:
+                self._messages[uid] = message
+        return message
+
+    def search(self, **kwargs):
+        """Return the UIDs of the messages matching ``kwargs``."""
+        response, data = self._imap().uid('SEARCH', *self.criteria(**kwargs))
+        return self._search_uids(response, data)
+
+    def uids(self, **kwargs):
+        """
+            The UIDs of the messages matching ``kwargs`` as a UIDSet, sent as a
+            compact sequence set when the server has ESEARCH.
+        """
+        return self._search_return(('ALL',), kwargs)['ALL']
+
+    def criteria(self, **kwargs):
+        """
+            Build the SEARCH criteria for the ``get_mail`` keyword arguments; pass a
+            Query as ``query`` for conditions keywords can't express.
+        """
+        return Query(**kwargs).criteria(self.date_format)
+
+    def _search_uids(self, response, data):
+        if response != 'OK' or not data or data[0] is None:
+            return []
+
+        # filter out empty strings
+        return [_f
+                for _f in data[0].split(b' ')
+                if _f]
+
+    def count(self, **kwargs):
+        """The number of messages matching ``kwargs``, without listing their UIDs."""
+        return self._search_return(('COUNT',), kwargs)['COUNT']
 
-        kwargs.get('read') and search.append('SEEN')
-        kwargs.get('unread') and search.append('UNSEEN')
+    def uid_range(self, **kwargs):
+        """The lowest and highest UIDs matching ``kwargs``, or (None, None)."""
+        returned = self._search_return(('MIN', 'MAX'), kwargs)
+        return returned['MIN'], returned['MAX']
 
-        kwargs.get('starred') and search.append('FLAGGED')
-        kwargs.get('unstarred') and search.append('UNFLAGGED')
+    def page(self,
+             number=0,
+             size=50,
+             newest=True,
+             prefetch=False,
+             chunk_size=FETCH_CHUNK_SIZE,
+             profile=FULL,
+             **kwargs):
+        """
+            Page ``number`` of ``size`` messages matching ``kwargs``, newest first
+            unless ``newest`` is False. Only the messages of the page are created.
+        """
+        uids = self.uids(**kwargs).page(number, size, newest)
+        emails = [self._message(str(uid).encode(), profile) for uid in uids]
 
-        kwargs.get('deleted') and search.append('DELETED')
-        kwargs.get('undeleted') and search.append('UNDELETED')
+        if prefetch:
+            self.fetch(emails, chunk_size, profile)
 
-        kwargs.get('draft') and search.append('DRAFT')
-        kwargs.get('undraft') and search.append('UNDRAFT')
+        return emails
+
+    def _search_return(self, returns, kwargs):
+        imap = self._imap()
+        esearch = 'ESEARCH' in imap.capabilities
+        response, data = imap.uid('SEARCH', *self._return_criteria(returns, esearch, kwargs))
+        return search_returned(returns, esearch, response, data)
+
+    def _return_criteria(self, returns, esearch, kwargs):
+        criteria = self.criteria(**kwargs)
+        if esearch:
+            # ESEARCH answers with the counts or a compact sequence set, not every UID
+            return ['RETURN', '(%s)' % ' '.join(returns)] + criteria
+        return criteria
+
+    def fetch(self, messages, chunk_size=FETCH_CHUNK_SIZE, profile=FULL, refresh=False):
+        """
+            Fill ``messages`` using the fetch ``profile``, with one UID FETCH per
+            ``chunk_size`` UIDs instead of one round trip per message. Messages which
+            already hold that profile are skipped unless ``refresh`` is set. Given a
+            UIDSet, returns the messages for those UIDs.
+        """
+        if isinstance(messages, UIDSet):
+            messages = [self._message(str(uid).encode(), profile) for uid in messages]
+        pending = self._pending(messages, profile, refresh)
+        # (message, future) of the bodies handed to gmail.parse_executor
+        parsing = []
 
-        kwargs.get('header') and search.extend(
-            ['HEADER', kwargs.get('header')[0], kwargs.get('header')[1]])
+        if profile != FLAGS:
+            # flags and labels can change, so they always come from the server
+            stored = self._load_stored(pending, parsing)
+            self._fetch_items(stored, PROFILE_ITEMS[FLAGS], {FLAGS}, chunk_size)
 
-        kwargs.get('sender') and search.extend(['FROM', kwargs.get('sender')])
-        kwargs.get('fr') and search.extend(['FROM', kwargs.get('fr')])
-        kwargs.get('from') and search.extend(['FROM', kwargs.get('from')])
-        kwargs.get('not_from') and search.extend(['NOT FROM', kwargs.get('not_from')])
-        kwargs.get('to') and search.extend(['TO', kwargs.get('to')])
-        kwargs.get('cc') and search.extend(['CC', kwargs.get('cc')])
+        self._fetch_items(self._first_pending(pending, profile),
+                          PROFILE_ITEMS[profile], _first_pass(profile), chunk_size, parsing)
 
-        kwargs.get('subject') and search.extend(
-            ['SUBJECT', kwargs.get('subject')])
-        kwargs.get('body') and search.extend(['BODY', kwargs.get('body')])
+        if profile in PART_PROFILES:
+            for items, batch in self._part_batches(pending, profile):
+                self._fetch_items(batch, items, {profile}, chunk_size)
 
-        kwargs.get('label') and search.extend(
-            ['X-GM-LABELS', kwargs.get('label')])
+        for message, future in parsing:
+            message._load_email(future.result())
 
-        kwargs.get('query') and search.extend(
-            ['X-GM-RAW', kwargs.get('query')])
+        return messages
 
-        if 'on' in kwargs and isinstance(kwargs['on'], datetime.datetime):
-            kwargs['on'] = kwargs['on'].date()
-        if 'before' in kwargs and isinstance(kwargs['before'], datetime.datetime):
-            kwargs['before'] = kwargs['before'].date()
-        if 'after' in kwargs and isinstance(kwargs['after'], datetime.datetime):
-            kwargs['after'] = kwargs['after'].date()
+    def _pending(self, messages, profile, refresh):
+        return dict((int(message.uid), message) for message in messages
+                    if refresh or not message.is_loaded(profile))
 
-        kwargs.get('before') and search.extend(
-            ['BEFORE', kwargs.get('before').strftime(self.date_format)])
+    def _first_pending(self, messages, profile):
+        if profile not in PART_PROFILES:
+            return messages
+        # the part numbers come from BODYSTRUCTURE, fetched first unless known
+        return dict((uid, message) for uid, message in messages.items()
+                    if STRUCTURE not in message._loaded)
 
-        kwargs.get('after') and search.extend(
-            ['SINCE', kwargs.get('after').strftime(self.date_format)])
+    def _fetch_items(self, messages, items, groups, chunk_size, parsing=None):
+        for chunk in UIDSet(messages).chunks(chunk_size):
+            response, data = self._imap().uid('FETCH', str(chunk), items)
+            if response == 'OK':
+                self._load_fetched(messages, groups, data, parsing)
+            elif is_throttled(data):
+                raise Throttled('FETCH was throttled: %r' % data)
 
-        kwargs.get('on') and search.extend(
-            ['ON', kwargs.get('on').strftime(self.date_format)])
+    def _load_fetched(self, messages, groups, data, parsing=None):
+        raw_messages = []
+        for fetched in parse_fetch(data):
+            uid = int(fetched.get('UID') or 0)
+            message = messages.get(uid)
+            if message is None:
+                continue
 
+            raw = fetched.get('BODY[]')
+            self._load(message, fetched, groups, parsing)
+            self._messages.update(message.uid)
 
-        kwargs.get('uid') and search.extend(['UID', kwargs['uid']])
+            if raw is not None:
+                raw_messages.append((uid, raw, message.message_id, message.thread_id))
 
-        emails = []
+        self._store(raw_messages)
 
-        response, data = self.gmail.imap.uid('SEARCH', *search)
+    def _part_batches(self, messages, profile):
+        """
+            Group messages whose BODYSTRUCTURE is loaded by the section of the part
+            ``profile`` fetches, yielding the FETCH items and messages of each group.
+        """
+        content_type = PART_PROFILES[profile]
+        by_section = {}
+        for uid, message in messages.items():
+            if STRUCTURE not in message._loaded:
+                continue
+            part = message.text_parts().get(content_type)
+            if part is not None:
+                by_section.setdefault(part.section, {})[uid] = message
+            else:
+                message._load({}, {profile})
+
+        for section, batch in by_section.items():
+            yield '(%s)' % section_item(section), batch
+
+    def fetch_section(self, message, section, offset=None, length=None):
+        """
+            Fetch the MIME part ``section`` of ``message``, still transfer-encoded.
+            With ``offset`` and ``length`` only that range of it is fetched.
+        """
+        response, data = self._imap().uid(
+            'FETCH', str(int(message.uid)), '(%s)' % section_item(section, offset, length))
+        return self._section(message, section, response, data)
+
+    def _section(self, message, section, response, data):
         if response == 'OK':
+            name = 'BODY[%s]' % section
+            for fetched in parse_fetch(data):
+                if int(fetched.get('UID') or 0) != int(message.uid):
+                    continue
+                # a partial fetch comes back as BODY[<section>]<offset>
+                for key, value in fetched.items():
+                    if key.split('<')[0] == name and value is not None:
+                        return bytes(value)
+        if is_throttled(data):
+            raise Throttled('FETCH was throttled: %r' % data)
+        raise GmailException('Fetching part %s of %r failed: %r' % (section, message, data))
 
-            # filter out empty strings
-            uids = [_f
-                    for _f in data[0].split(b' ')
-                    if _f]
+    def _load(self, message, items, groups, parsing=None):
+        """
+            Load FETCH ``items`` into ``message``. With a parse executor the body
+            is parsed there; the future is added to ``parsing`` to be applied later.
+        """
+        executor = self.gmail.parse_executor
+        raw = items.get('BODY[]')
+        if raw is None or parsing is None or executor is None:
+            message._load(items, groups)
+            return
 
-            for uid in uids:
-                if uid not in self._messages:
-                    self._messages[uid] = Message(self, uid)
-                emails.append(self._messages[uid])
+        message._load(items, groups, parse=False)
+        parsing.append((message, executor.submit(parse_email, raw)))
 
-        return emails
+    def _load_stored(self, messages, parsing=None):
+        """
+            Load the messages found in the on-disk store, moving them out of
+            ``messages`` into the returned dict.
+        """
+        store = self.gmail.store
+        if store is None or self.uidvalidity is None:
+            return {}
+
+        stored = store.get_messages(self.name, self.uidvalidity, messages)
+        local = {}
+        for uid, (raw, gm_msgid, gm_thrid) in stored.items():
+            message = messages.pop(uid)
+            self._load(message,
+                       {'BODY[]': raw,
+                        'X-GM-MSGID': gm_msgid and gm_msgid.encode(),
+                        'X-GM-THRID': gm_thrid and gm_thrid.encode()},
+                       PROFILE_GROUPS[FULL] - {FLAGS},
+                       parsing)
+            local[uid] = message
+        return local
+
+    def _store(self, raw_messages):
+        store = self.gmail.store
+        if store is not None and self.uidvalidity is not None and raw_messages:
+            store.put_messages(self.name, self.uidvalidity, raw_messages)
+
+    def store(self, messages, command, values, chunk_size=STORE_CHUNK_SIZE):
+        """
+            Run ``UID STORE <uid-set> <command> (<values>)`` over ``messages``, given
+            as Message objects, UIDs or a UIDSet, with one command per ``chunk_size``
+            UIDs. Messages are updated from the FETCH responses the server returns.
+        """
+        targets = self._store_targets(messages)
+
+        for chunk in UIDSet(messages).chunks(chunk_size):
+            response, data = self._imap().uid(
+                'STORE', str(chunk), command, store_values(command, values))
+            self._stored(targets, chunk, command, values, response, data)
+
+    def _store_targets(self, messages):
+        # the messages given as objects; the others are looked up in the cache
+        if isinstance(messages, UIDSet):
+            return {}
+        return dict((int(message.uid), message) for message in messages
+                    if isinstance(message, Message))
+
+    def _target(self, targets, uid):
+        message = targets.get(uid)
+        if message is None:
+            message = self._messages.get(str(uid).encode())
+        return message
+
+    def _stored(self, targets, chunk, command, values, response, data):
+        if response != 'OK':
+            if is_throttled(data):
+                raise Throttled('STORE %s was throttled: %r' % (command, data))
+            raise GmailException('STORE %s failed: %r' % (command, data))
+
+        echoed = set()
+        for fetched in parse_fetch(data):
+            uid = int(fetched.get('UID') or 0)
+            message = self._target(targets, uid)
+            if message is not None:
+                message._load(fetched, ())
+                echoed.add(uid)
+
+        for uid in chunk:
+            message = self._target(targets, uid)
+            if uid not in echoed and message is not None:
+                message._stored(command, list(values))
+
+    def mark_read(self, messages):
+        return self.store(messages, '+FLAGS', ['\\Seen'])
+
+    def mark_unread(self, messages):
+        return self.store(messages, '-FLAGS', ['\\Seen'])
+
+    def star(self, messages):
+        return self.store(messages, '+FLAGS', ['\\Flagged'])
+
+    def unstar(self, messages):
+        return self.store(messages, '-FLAGS', ['\\Flagged'])
+
+    def add_label(self, messages, label):
+        return self.store(messages, '+X-GM-LABELS', [label])
+
+    def remove_label(self, messages, label):
+        return self.store(messages, '-X-GM-LABELS', [label])
+
+    def move(self, messages, destination, chunk_size=STORE_CHUNK_SIZE):
+        """
+            Move ``messages``, given as Message objects, UIDs or a UIDSet, to the mailbox named
+            ``destination``. Uses UID MOVE (RFC 6851) when the server has it and
+            otherwise COPY, STORE \\Deleted and UID EXPUNGE, one round per chunk.
+            Without UIDPLUS the originals are left flagged \\Deleted, since a plain
+            EXPUNGE would remove every other \\Deleted message too.
+        """
+        imap = self._imap()
+        target = quote(encode_utf7(destination))
+        uids = UIDSet(messages)
+
+        for chunk in uids.chunks(chunk_size):
+            if 'MOVE' in imap.capabilities:
+                response, data = imap.uid('MOVE', str(chunk), target)
+            else:
+                response, data = imap.uid('COPY', str(chunk), target)
+                if response == 'OK':
+                    self.store(chunk, '+FLAGS', ['\\Deleted'])
+                    if 'UIDPLUS' in imap.capabilities:
+                        response, data = self.expunge(chunk)
+            if response != 'OK':
+                raise GmailException('Moving to %s failed: %r' % (destination, data))
+
+        for uid in uids:
+            self._messages.pop(str(uid).encode())
+
+    def expunge(self, messages):
+        """
+            Permanently remove ``messages`` already flagged \\Deleted. Needs UIDPLUS:
+            a plain EXPUNGE would remove every \\Deleted message in the mailbox.
+        """
+        imap = self._imap()
+        if 'UIDPLUS' not in imap.capabilities:
+            raise GmailException('UID EXPUNGE needs UIDPLUS, which the server does not offer.')
+        return imap.uid('EXPUNGE', str(UIDSet(messages)))
+
+    def archive(self, messages):
+        return self.move(messages, self.gmail.all_mail_name)
+
+    def delete(self, messages):
+        """Move ``messages`` to the trash, or delete them for good if already there."""
+        if self.name == self.gmail.trash_name:
+            self.store(messages, '+FLAGS', ['\\Deleted'])
+            if 'UIDPLUS' in self.gmail.imap.capabilities:
+                self.expunge(messages)
+            for message in messages:
+                self._messages.pop(str(int(getattr(message, 'uid', message))).encode())
+        else:
+            self.move(messages, self.gmail.trash_name)
+
+    def sync(self, state=None):
+        """
+            Return a SyncResult with the UIDs that are new, had their flags or labels
+            changed, or vanished since ``state``, the ``state`` of a previous result.
+            With CONDSTORE (and QRESYNC, when the server has it) a quiet mailbox
+            costs a single SELECT.
+        """
+        qresync = self.gmail.enable('QRESYNC')
+        # CHANGEDSINCE turns CONDSTORE on by itself (RFC 7162), no ENABLE needed
+        condstore = qresync or 'CONDSTORE' in self.gmail.imap.capabilities
+        self.select()
+
+        if state is None or state.uidvalidity != self.uidvalidity:
+            return self._sync_reset(state, list(self.uids()))
+
+        new = []
+        if self.uidnext is None or self.uidnext > state.uidnext:
+            # n:* matches the highest UID even when it is below n
+            new = _arrived(state, self.uids(uid='%d:*' % state.uidnext))
+
+        changed, vanished = [], None
+        if not condstore or state.highestmodseq is None:
+            # without mod-sequences there is no telling which messages changed
+            changed = None
+        elif self._sync_modified(state):
+            response, data = self.gmail.imap.uid('FETCH', *_changed_since(state, qresync))
+            if response == 'OK':
+                changed = self._sync_changed(data)
+            if qresync:
+                vanished = _vanished(self.gmail.imap.response('VANISHED')[1])
+
+        if vanished is None:
+            vanished = []
+            if self._sync_shrunk(state, new):
+                vanished = _missing(state, self.uids(uid=_known(state)))
+
+        return self._sync_result(state, new, changed, vanished)
+
+    def _sync_reset(self, state, uids):
+        return SyncResult(self._sync_state(uids),
+                          new=uids,
+                          vanished=state.uids if state else None,
+                          reset=state is not None)
+
+    def _sync_modified(self, state):
+        return state.uids and (self.highestmodseq is None or self.highestmodseq > state.highestmodseq)
+
+    def _sync_changed(self, data):
+        # the UIDs of a CHANGEDSINCE fetch, updating the cached messages' flags
+        changed = []
+        for fetched in parse_fetch(data):
+            uid = int(fetched.get('UID') or 0)
+            changed.append(uid)
+            message = self._messages.get(str(uid).encode())
+            if message is not None:
+                message._load(fetched, {FLAGS})
+        return changed
+
+    def _sync_shrunk(self, state, new):
+        return state.uids and (self.exists is None or self.exists != len(state.uids) + len(new))
+
+    def _sync_result(self, state, new, changed, vanished):
+        for uid in vanished:
+            self._messages.pop(str(uid).encode())
+
+        uids = sorted(set(state.uids).difference(vanished).union(new))
+        return SyncResult(self._sync_state(uids), new=new, changed=changed, vanished=vanished)
+
+    def _sync_state(self, uids):
+        uidnext = self.uidnext or (uids[-1] + 1 if uids else 1)
+        return SyncState(self.uidvalidity, uidnext, self.highestmodseq, uids)
+
+    def idle(self, timeout=None, renew=IDLE_RENEW):
+        """
+            Wait for changes on this mailbox, see ``Gmail.idle``. It is selected
+            again before each IDLE, in case the loop opened another one.
+        """
+        return idle(self.gmail.imap, timeout, renew, self.ensure_selected)
+
+    def select(self, readonly=None):
+        """
+            SELECT this mailbox, or EXAMINE it when ``readonly``, and record the
+            state the server returned.
+        """
+        self.gmail.use_mailbox(self.external_name, readonly, force=True)
+        self._selected()
+
+    def ensure_selected(self, readonly=None):
+        """Select this mailbox unless it's already open on the connection."""
+        if self.gmail.use_mailbox(self.external_name, readonly):
+            self._selected()
+
+    def _imap(self):
+        # every command of this mailbox runs with it selected
+        self.ensure_selected()
+        return self.gmail.imap
+
+    def status(self, items=STATUS_ITEMS):
+        """
+            The STATUS of this mailbox, e.g. ``{'MESSAGES': 120, 'UNSEEN': 3}``,
+            without selecting it.
+        """
+        response, data = self.gmail.imap.status(quote(self.external_name), '(%s)' % ' '.join(items))
+        self.counts = parse_status(response, data)
+        return self.counts
+
+    def _selected(self):
+        """Record the state returned by SELECT for this mailbox."""
+        imap = self.gmail.imap
+        self.uidnext = _response_number(imap, 'UIDNEXT')
+        self.highestmodseq = _response_number(imap, 'HIGHESTMODSEQ')
+        self.exists = _response_number(imap, 'EXISTS')
+
+        uidvalidity = _response_number(imap, 'UIDVALIDITY')
+        if uidvalidity is not None:
+            self.uidvalidity = uidvalidity
+            self._messages.validate(self.uidvalidity)
+            if self.gmail.store is not None:
+                self.gmail.store.discard(self.name, self.uidvalidity)
+
+
+def _response_number(imap, code):
+    _, values = imap.response(code)
+    if values and values[-1] is not None:
+        return int(values[-1].split()[0])
+    return None
+
+
+def parse_esearch(data):
+    """The return data of an ESEARCH response, e.g. ``{'COUNT': 5, 'MIN': 1}``."""
+    returned = {}
+    for value in data:
+        if not value:
+            continue
+        if isinstance(value, bytes):
+            value = value.decode()
+        tokens = _ESEARCH_TAG.sub('', value).split()
+        if tokens and tokens[0].upper() == 'UID':
+            tokens = tokens[1:]
+        for key, item in zip(tokens[::2], tokens[1::2]):
+            key = key.upper()
+            returned[key] = UIDSet(item) if key == 'ALL' else int(item)
+    return returned
+
+
+def search_returned(returns, esearch, response, data):
+    """
+        The ``returns`` (COUNT, MIN, MAX or ALL) of a UID SEARCH, from its ESEARCH
+        response or, without ESEARCH, from the plain list of UIDs.
+    """
+    if response != 'OK':
+        if is_throttled(data):
+            raise Throttled('SEARCH was throttled: %r' % data)
+        raise GmailException('SEARCH failed: %r' % data)
+
+    if esearch:
+        returned = parse_esearch(data)
+    else:
+        uids = UIDSet.from_search(data)
+        returned = {'COUNT': len(uids), 'MIN': uids.first, 'MAX': uids.last, 'ALL': uids}
+
+    # servers leave out MIN, MAX and ALL when nothing matches
+    defaults = {'COUNT': 0, 'MIN': None, 'MAX': None, 'ALL': UIDSet()}
+    return dict((key, returned.get(key, defaults[key])) for key in returns)
+
+
+def thread_query(thread_ids):
+    """A Query matching the messages of any of ``thread_ids``."""
+    return reduce(operator.or_, [Query(thread_id=thread_id) for thread_id in thread_ids])
+
+
+def group_threads(messages):
+    """
+        Group ``messages`` by X-GM-THRID into conversations ordered by UID, and set
+        each message's ``thread``. The most recently active conversation comes first.
+    """
+    threads = {}
+    for message in messages:
+        threads.setdefault(message.thread_id, []).append(message)
+
+    conversations = []
+    for thread in threads.values():
+        thread.sort(key=lambda message: int(message.uid))
+        for message in thread:
+            message.thread = thread
+        conversations.append(thread)
+
+    conversations.sort(key=lambda thread: int(thread[-1].uid), reverse=True)
+    return conversations
+
+
+def _unique(values):
+    seen = set()
+    return [value for value in values
+            if value is not None and not (value in seen or seen.add(value))]
+
+
+def _arrived(state, uids):
+    return [uid for uid in uids if uid >= state.uidnext]
+
+
+def _known(state):
+    return '1:%d' % max(state.uidnext - 1, 1)
+
+
+def _changed_since(state, qresync):
+    # the arguments of the UID FETCH asking what changed since ``state``
+    modifier = '(CHANGEDSINCE %d%s)' % (state.highestmodseq, ' VANISHED' if qresync else '')
+    return _known(state), '(UID FLAGS X-GM-LABELS)', modifier
+
+
+def _vanished(data):
+    vanished = []
+    for values in data:
+        if values is not None:
+            vanished.extend(UIDSet(values.split()[-1]))
+    return vanished
+
+
+def _missing(state, present):
+    return [uid for uid in state.uids if uid not in present]
+
+
+def parse_status(response, data):
+    """The counters of a STATUS response as a dict."""
+    if response != 'OK':
+        if is_throttled(data):
+            raise Throttled('STATUS was throttled: %r' % data)
+        raise GmailException('STATUS failed: %r' % data)
+
+    status = {}
+    for value in data:
+        if not isinstance(value, bytes) or b'(' not in value:
+            continue
+        tokens = value[value.rindex(b'(') + 1:].rstrip(b')').split()
+        for key, number in zip(tokens[::2], tokens[1::2]):
+            status[key.decode().upper()] = int(number)
+    return status
+
+
+def is_throttled(data):
+    """Whether a NO response carries Gmail's [THROTTLED] code."""
+    return any(b'THROTTLED' in value for value in data if isinstance(value, bytes))
+
+
+def _first_pass(profile):
+    if profile in PART_PROFILES:
+        # the part numbers are only known once BODYSTRUCTURE is in
+        return PROFILE_GROUPS[profile] - {profile}
+    return PROFILE_GROUPS[profile]
+
+
+def store_values(command, values):
+    if 'X-GM-LABELS' in command.upper():
+        return '(%s)' % ' '.join(quote(value) for value in values)
+    return '(%s)' % ' '.join(values)
+
+
+def section_item(section, offset=None, length=None):
+    """The FETCH item for MIME part ``section``, or a range of it."""
+    if offset is None:
+        return 'BODY.PEEK[%s]' % section
+    return 'BODY.PEEK[%s]<%d.%d>' % (section, offset, length)
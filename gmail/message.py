@@ -1,8 +1,10 @@
+import base64
 import datetime
 import email
+import io
 import logging
 import os
-import re
+import quopri
 import sys
 import time
 from email.encoders import encode_base64
@@ -11,9 +13,12 @@ from email.mime.base import MIMEBase
 from email.mime.multipart import MIMEMultipart
 from email.mime.text import MIMEText
 from email.utils import formatdate, make_msgid
-from imaplib import ParseFlags
 from mimetypes import guess_type
 
+from .exceptions import GmailException
+from .parser import (fetch_items, format_addresses, mime_part, mime_payload, mime_structure,
+                     parse_bodystructure, tokenize)
+
 logging.basicConfig(level=logging.DEBUG)
 logger = logging.getLogger()
 
@@ -23,49 +28,146 @@ else:
     unicode_type = str
 
 
+# Fetch profiles, from the cheapest to the most complete. Each one fills
+# only its own groups of fields; touching a field from another group
+# upgrades the message lazily with a fuller fetch.
+FLAGS = 'flags'
+ENVELOPE = 'envelope'
+HEADERS = 'headers'
+STRUCTURE = 'structure'
+TEXT = 'text'
+HTML = 'html'
+FULL = 'full'
+
+GMAIL_ITEMS = 'FLAGS X-GM-THRID X-GM-MSGID X-GM-LABELS'
+HEADER_FIELDS = ('FROM', 'TO', 'CC', 'SUBJECT', 'DATE', 'DELIVERED-TO', 'MESSAGE-ID')
+
+PROFILE_ITEMS = {
+    FLAGS: '(%s)' % GMAIL_ITEMS,
+    ENVELOPE: '(ENVELOPE %s)' % GMAIL_ITEMS,
+    HEADERS: '(BODY.PEEK[HEADER.FIELDS (%s)] %s)' % (' '.join(HEADER_FIELDS), GMAIL_ITEMS),
+    STRUCTURE: '(BODYSTRUCTURE %s)' % GMAIL_ITEMS,
+    # the text or html part itself is fetched in a second pass, see Mailbox.fetch
+    TEXT: '(BODYSTRUCTURE %s)' % GMAIL_ITEMS,
+    HTML: '(BODYSTRUCTURE %s)' % GMAIL_ITEMS,
+    FULL: '(BODY.PEEK[] %s)' % GMAIL_ITEMS,
+}
+
+PROFILE_GROUPS = {
+    FLAGS: {FLAGS},
+    ENVELOPE: {FLAGS, ENVELOPE},
+    HEADERS: {FLAGS, ENVELOPE, HEADERS},
+    STRUCTURE: {FLAGS, STRUCTURE},
+    TEXT: {FLAGS, STRUCTURE, TEXT},
+    HTML: {FLAGS, STRUCTURE, HTML},
+    FULL: {FLAGS, ENVELOPE, HEADERS, STRUCTURE, TEXT, HTML, FULL},
+}
+
+# the content type of the part fetched by each part profile
+PART_PROFILES = {
+    TEXT: 'text/plain',
+    HTML: 'text/html',
+}
+
+# groups shared by the messages which haven't loaded anything yet
+_NOTHING_LOADED = frozenset()
+
+
+class Field:
+    """
+        A message field filled by the fetch of ``group``. Reading it before that
+        group is loaded fetches it; an unset field reads as ``default()``.
+    """
+
+    def __init__(self, group=None, default=None):
+        self.group = group
+        self.default = default
+
+    def __set_name__(self, owner, name):
+        self.name = name
+
+    def __get__(self, message, owner=None):
+        if message is None:
+            return self
+        if self.group is not None and self.group not in message._loaded:
+            message._fetch(self.group)
+
+        fields = message._fields
+        if fields is None or self.name not in fields:
+            value = self.default() if self.default is not None else None
+            if value is None:
+                return None
+            # kept, so a default list can be changed in place
+            self.__set__(message, value)
+            return value
+        return fields[self.name]
+
+    def __set__(self, message, value):
+        if message._fields is None:
+            message._fields = {}
+        message._fields[self.name] = value
+
+
 class Message:
-    sent_at = None
+    """
+        A message of a mailbox. Until a fetch fills them, its fields take no room,
+        so a stub for each UID of a large search costs a few dozen bytes.
+    """
 
-    def __init__(self,
-                 mailbox,
-                 uid):
+    __slots__ = ('uid', 'mailbox', 'profile', '_loaded', '_size', '_fields')
 
-        self.uid = uid
-        self.mailbox = mailbox
-        self.gmail = mailbox.gmail if mailbox else None
+    flags = Field(FLAGS, list)
+    labels = Field(FLAGS, list)
+    thread_id = Field(FLAGS)
+    message_id = Field(FLAGS)
 
-        # this is the wrapped object. based on the type this can be a MimeText
-        # or MimeMultipart
-        self.message = None
-        self.headers = {}
+    subject = Field(ENVELOPE)
+    to = Field(ENVELOPE)
+    fr = Field(ENVELOPE)
+    cc = Field(ENVELOPE)
+    sent_at = Field(ENVELOPE)
 
-        self.subject = None
-        self.body = None
-        self.html = None
+    headers = Field(HEADERS, dict)
+    delivered_to = Field(HEADERS)
 
-        self.to = None
-        self.fr = None
-        self.cc = None
-        self.delivered_to = None
+    structure = Field(STRUCTURE)
+    attachments = Field(STRUCTURE)
+    body = Field(TEXT)
+    html = Field(HTML)
 
-        self.sent_at = None
+    # this is the wrapped object. based on the type this can be a MimeText
+    # or MimeMultipart
+    message = Field(FULL)
 
-        self.flags = []
-        self.labels = []
+    # the other messages of the conversation, see fetch_thread
+    thread = Field(default=list)
 
-        self.thread_id = None
-        self.thread = []
-        self.message_id = None
+    def __init__(self,
+                 mailbox,
+                 uid,
+                 profile=FULL):
+
+        self.uid = uid
+        self.mailbox = mailbox
 
-        self.attachments = None
+        # profile used when a field is touched before being fetched
+        self.profile = profile
+        # groups of fields (see Field) that have been fetched
+        self._loaded = _NOTHING_LOADED
+        # bytes of message content held, used to bound the mailbox cache
+        self._size = 0
+        # the values of the fields, once any is set
+        self._fields = None
 
     def __repr__(self):
         return f'<Message {self.uid}>'
 
-    def __getattribute__(self, item):
-        if not object.__getattribute__(self, item):
-            self._fetch()
-        return object.__getattribute__(self, item)
+    @property
+    def gmail(self):
+        return self.mailbox.gmail if self.mailbox else None
+
+    def is_loaded(self, profile):
+        return PROFILE_GROUPS[profile] <= self._loaded
 
     @staticmethod
     def create(subject,
@@ -137,32 +239,20 @@ class Message:
         return '\\Seen' in self.flags
 
     def read(self):
-        flag = '\\Seen'
-        self.gmail.imap.uid('STORE', self.uid, '+FLAGS', flag)
-        if flag not in self.flags:
-            self.flags.append(flag)
+        return self.mailbox.store([self], '+FLAGS', ['\\Seen'])
 
     def unread(self):
-        flag = '\\Seen'
-        self.gmail.imap.uid('STORE', self.uid, '-FLAGS', flag)
-        if flag in self.flags:
-            self.flags.remove(flag)
+        return self.mailbox.store([self], '-FLAGS', ['\\Seen'])
 
     @property
     def is_starred(self):
         return '\\Flagged' in self.flags
 
     def star(self):
-        flag = '\\Flagged'
-        self.gmail.imap.uid('STORE', self.uid, '+FLAGS', flag)
-        if flag not in self.flags:
-            self.flags.append(flag)
+        return self.mailbox.store([self], '+FLAGS', ['\\Flagged'])
 
     def unstar(self):
-        flag = '\\Flagged'
-        self.gmail.imap.uid('STORE', self.uid, '-FLAGS', flag)
-        if flag in self.flags:
-            self.flags.remove(flag)
+        return self.mailbox.store([self], '-FLAGS', ['\\Flagged'])
 
     @property
     def is_draft(self):
@@ -173,92 +263,192 @@ class Message:
         return full_label in self.labels
 
     def add_label(self, label):
-        full_label = '%s' % label
-        self.gmail.imap.uid('STORE', self.uid, '+X-GM-LABELS', full_label)
-        if full_label not in self.labels:
-            self.labels.append(full_label)
+        return self.mailbox.store([self], '+X-GM-LABELS', ['%s' % label])
 
     def remove_label(self, label):
-        full_label = '%s' % label
-        self.gmail.imap.uid('STORE', self.uid, '-X-GM-LABELS', full_label)
-        if full_label in self.labels:
-            self.labels.remove(full_label)
+        return self.mailbox.store([self], '-X-GM-LABELS', ['%s' % label])
+
+    def _stored(self, command, values):
+        """Apply a STORE the server didn't echo back to the fetched flags or labels."""
+        if FLAGS not in self._loaded:
+            return
+        field = self.labels if 'X-GM-LABELS' in command.upper() else self.flags
+        if command.startswith('+'):
+            field.extend(value for value in values if value not in field)
+        elif command.startswith('-'):
+            field[:] = [value for value in field if value not in values]
+        else:
+            field[:] = values
 
     @property
     def is_deleted(self):
         return '\\Deleted' in self.flags
 
     def delete(self):
-        flag = '\\Deleted'
-        self.gmail.imap.uid('STORE', self.uid, '+FLAGS', flag)
-        if flag not in self.flags:
-            self.flags.append(flag)
-
-        trash = '[Gmail]/Trash' if '[Gmail]/Trash' in self.gmail.labels() else '[Gmail]/Bin'
-        if self.mailbox.name not in ['[Gmail]/Bin', '[Gmail]/Trash']:
-            self.move_to(trash)
+        return self.mailbox.delete([self])
 
     def move_to(self, name):
-        self.gmail.copy(self.uid, name, self.mailbox.name)
-        if name not in ['[Gmail]/Bin', '[Gmail]/Trash']:
-            self.delete()
+        return self.mailbox.move([self], name)
 
     def archive(self):
-        self.move_to('[Gmail]/All Mail')
+        return self.mailbox.archive([self])
 
     def parse(self, raw_message):
-        raw_headers = raw_message[0].decode()
-        raw_email = raw_message[1]
-
-        self.message = email.message_from_bytes(raw_email)
-        self.headers = parse_headers(self.message)
-
-        self.to = self.message['to']
-        self.fr = self.message['from']
-        self.delivered_to = self.message['delivered_to']
-
-        self.subject = parse_subject(self.message['subject'])
+        self._load(fetch_items(tokenize([raw_message])), PROFILE_GROUPS[FULL])
 
-        if self.message.get_content_maintype() == "multipart":
-            for content in self.message.walk():
-                if content.get_content_type() == "text/plain":
-                    self.body = content.get_payload(decode=True)
-                elif content.get_content_type() == "text/html":
-                    self.html = content.get_payload(decode=True)
-        elif self.message.get_content_maintype() == "text":
-            self.body = self.message.get_payload()
-
-        self.sent_at = datetime.datetime.fromtimestamp(
-            time.mktime(email.utils.parsedate_tz(self.message['date'])[:9]))
-
-        self.flags = parse_flags(raw_headers)
-
-        self.labels = parse_labels(raw_headers)
-
-        if re.search(r'X-GM-THRID (\d+)', raw_headers):
-            self.thread_id = re.search(
-                r'X-GM-THRID (\d+)', raw_headers).groups(1)[0]
-        if re.search(r'X-GM-MSGID (\d+)', raw_headers):
-            self.message_id = re.search(
-                r'X-GM-MSGID (\d+)', raw_headers).groups(1)[0]
+    def _load(self, items, groups, parse=True):
+        """
+            Fill the fields found in ``items``, a dict of FETCH items. Without
+            ``parse`` the whole body is only measured, see ``Mailbox._load``.
+        """
+        loaded = self._loaded.union(groups)
+        fresh = loaded - self._loaded
+        # mark first: reading a field of an unloaded group would fetch it
+        self._loaded = loaded
+        # a refetch brings the same content again, so it is counted once
+        content = sum(len(value) for name, value in items.items()
+                      if name.startswith('BODY[') and isinstance(value, bytes))
+        if FULL in fresh:
+            # the whole message holds the parts counted before
+            self._size = content
+        elif fresh:
+            self._size += content
+
+        if 'FLAGS' in items:
+            self.flags = [flag.decode() for flag in items['FLAGS']]
+        if 'X-GM-LABELS' in items:
+            self.labels = [label.decode() for label in items['X-GM-LABELS']]
+        if items.get('X-GM-THRID'):
+            self.thread_id = items['X-GM-THRID'].decode()
+        if items.get('X-GM-MSGID'):
+            self.message_id = items['X-GM-MSGID'].decode()
+
+        if items.get('ENVELOPE'):
+            self._parse_envelope(items['ENVELOPE'])
+        if items.get('BODYSTRUCTURE'):
+            self._set_structure(parse_bodystructure(items['BODYSTRUCTURE']))
+
+        for name, value in items.items():
+            if value is None or not name.startswith('BODY['):
+                continue
+            if name == 'BODY[]':
+                if parse:
+                    self._parse_email(value)
+            elif name.startswith('BODY[HEADER'):
+                self._parse_headers(email.message_from_bytes(value))
+            else:
+                self._parse_text_part(name[5:-1], value)
 
-        # Parse attachments into attachment objects array for this message
-        self.attachments = [a for a in [
+    def _parse_envelope(self, envelope):
+        date, subject, fr, _, _, to, cc = envelope[:7]
+        self.sent_at = parse_date(date and date.decode())
+        self.subject = parse_subject(subject and subject.decode('utf-8', 'replace'))
+        self.fr = format_addresses(fr)
+        self.to = format_addresses(to)
+        self.cc = format_addresses(cc)
 
-            Attachment(attachment)
-            for attachment in self.message._payload
-            if not isinstance(attachment, str)
-            if attachment.get('Content-Disposition') is not None
+    def _parse_headers(self, message):
+        self._load_email(header_fields(message))
 
-        ] if a]
+    def _parse_email(self, raw_email):
+        self.message = email.message_from_bytes(raw_email)
+        self._load_email(email_fields(self.message))
 
-    def _fetch(self):
-        _, results = self.gmail.imap.uid(
-            'FETCH', self.uid, '(BODY.PEEK[] FLAGS X-GM-THRID X-GM-MSGID X-GM-LABELS)')
+    def _load_email(self, fields):
+        """Fill the fields parsed by ``parse_email``, possibly in another process."""
+        for name, value in fields.items():
+            if name == 'structure':
+                self._set_structure(value)
+            else:
+                setattr(self, name, value)
+
+    def _set_structure(self, structure):
+        self.structure = structure
+        # only metadata: payloads are fetched by part number when read
+        self.attachments = [attachment for attachment in (
+            self.attachment_class(self, part)
+            for part in structure.walk() if part.is_attachment) if attachment]
+
+    def text_parts(self):
+        """The plain text and html parts of ``structure``, by content type."""
+        parts = {}
+        for part in self.structure.walk() if self.structure else []:
+            if part.content_type in ('text/plain', 'text/html') and not part.is_attachment:
+                parts.setdefault(part.content_type, part)
+        return parts
+
+    def part(self, section):
+        """The MIME part numbered ``section`` in ``structure``, as an Attachment."""
+        for part in self.structure.walk() if self.structure else []:
+            if part.section == section:
+                return self.attachment_class(self, part)
+        return None
+
+    def _preview_part(self):
+        parts = self.text_parts()
+        part = parts.get('text/plain') or parts.get('text/html')
+        return part and self.attachment_class(self, part)
+
+    def preview(self, size=2048):
+        """The first ``size`` bytes of the text (or html) body, fetching only those."""
+        part = self._preview_part()
+        return part.head(size) if part else None
+
+    def _parse_text_part(self, section, data):
+        for content_type, part in self.text_parts().items():
+            if part.section == section:
+                payload = decode_transfer_encoding(data, part.encoding)
+                if content_type == 'text/plain':
+                    self.body = payload
+                else:
+                    self.html = payload
+
+    def _fetch(self, group=FULL):
+        profile = self.profile if group in PROFILE_GROUPS[self.profile] else group
+        self._session_mailbox().fetch([self], profile=profile, refresh=True)
+
+    def _session_mailbox(self):
+        if self.mailbox is None:
+            raise GmailException('%r is detached from its session, only its loaded fields '
+                                 'can be read.' % self)
+        return self.mailbox
+
+    def fetch(self, profile=None):
+        """Fetch this message using ``profile``, by default its own one."""
+        self._session_mailbox().fetch([self], profile=profile or self.profile, refresh=True)
+        return self
+
+    def detached(self):
+        """
+            A copy of this message with the fields loaded so far and no mailbox,
+            safe to hand over once its session is used elsewhere.
+        """
+        message = self._copy()
+        if self._fields is not None and 'thread' in self._fields:
+            message.thread = [message if member is self else member._copy()
+                              for member in self._fields['thread']]
+        return message
 
-        self.parse(results[0])
+    def _copy(self):
+        message = type(self)(None, self.uid, self.profile)
+        message._loaded = self._loaded
+        message._size = self._size
+        if self._fields is not None:
+            message._fields = dict(self._fields)
+            message._fields.pop('thread', None)
+            if 'structure' in self._fields:
+                # the attachments of the copy read its own parsed message
+                message._set_structure(self._fields['structure'])
+        return message
 
-        return self.message
+    def fetch_thread(self, profile=None):
+        """
+            Fill ``thread`` with the messages of this conversation in the same mailbox,
+            oldest first, fetched together using ``profile``; returns ``thread``.
+        """
+        thread = self._session_mailbox().thread(self.thread_id, profile=profile or self.profile)
+        self.thread = _with_message(thread, self)
+        return self.thread
 
     @property
     def string_sent_at(self):
@@ -293,34 +483,139 @@ Message.string_date = Message.string_sent_at
 
 
 class Attachment:
-
-    def __init__(self, attachment):
-        self.name = attachment.get_filename()
-        # Raw file data
-        self.payload = attachment.get_payload(decode=True)
-        # Filesize in kilobytes
-        try:
-            self.size = int(round(len(self.payload) / 1000.0))
-        except TypeError:
-            self.size = 0
+    """
+        An attachment, or any other MIME part, known by its part only. The payload
+        is read from the parsed message when there is one, else fetched with
+        BODY.PEEK[<section>], and decoded a chunk at a time.
+    """
+
+    # encoded bytes decoded at a time
+    CHUNK_SIZE = 64 * 1024
+
+    def __init__(self, message, part):
+        self.message = message
+        self.part = part
+        self.name = part.filename
+        self.content_type = part.content_type
+        self.encoding = part.encoding
+        # MIME part number, e.g. "2" or "1.3"
+        self.section = part.section
+        # size of the transfer-encoded payload in bytes
+        self.encoded_size = part.size
+        # Filesize in kilobytes, estimated from the encoded size
+        self.size = int(round(decoded_size(part.size, part.encoding) / 1000.0))
+
+        # progress of the last write: encoded bytes read and decoded bytes written
+        self.position = 0
+        self.written = 0
+        self._decoder = None
 
     def __bool__(self):
-        return bool(self.size)
+        return bool(self.encoded_size)
 
     def __repr__(self):
-        return f'<Attachment {self.name}'
+        return f'<Attachment {self.name}>'
+
+    @property
+    def payload(self):
+        """The whole decoded payload."""
+        output = io.BytesIO()
+        self.write(output)
+        return output.getvalue()
+
+    def _local(self):
+        # the part of the parsed message, without fetching anything
+        message = self.message
+        if FULL not in message._loaded or message.message is None:
+            return None
+        part = mime_part(message.message, self.section)
+        return None if part is None else mime_payload(part)
+
+    def head(self, size=4096):
+        """
+            The first ``size`` decoded bytes of the payload, fetching only about
+            that much with a partial FETCH (``BODY.PEEK[<section>]<0.length>``).
+        """
+        length = encoded_size(size, self.encoding)
+        encoded = self._local()
+        if encoded is None:
+            encoded = self.message._session_mailbox().fetch_section(self.message, self.section, 0, length)
+        return b''.join(decode_chunks([encoded[:length]], self.encoding))[:size]
+
+    def _start(self, resume):
+        if not resume or self._decoder is None:
+            self.position = 0
+            self.written = 0
+            self._decoder = Decoder(self.encoding)
+
+    def _write(self, fileobj, chunk):
+        data = self._decoder.decode(chunk)
+        fileobj.write(data)
+        # only counted once written, so a failed fetch is simply retried
+        self.position += len(chunk)
+        self.written += len(data)
+        return len(chunk) == self.CHUNK_SIZE
+
+    def _finish(self, fileobj):
+        data = self._decoder.flush()
+        fileobj.write(data)
+        self.written += len(data)
+        self._decoder = None
+
+    def write(self, fileobj, resume=False):
+        """
+            Decode the payload into ``fileobj``, a binary file-like object. Payloads
+            which aren't at hand are fetched ``CHUNK_SIZE`` bytes per partial FETCH;
+            with ``resume`` a write which failed part way, say because the
+            connection dropped, continues after the last chunk written.
+        """
+        self._start(resume)
+        encoded = self._local()
+
+        more = True
+        while more:
+            if encoded is not None:
+                chunk = memoryview(encoded)[self.position:self.position + self.CHUNK_SIZE]
+            else:
+                chunk = self.message._session_mailbox().fetch_section(
+                    self.message, self.section, self.position, self.CHUNK_SIZE)
+            more = self._write(fileobj, chunk)
+
+        self._finish(fileobj)
 
-    def save(self, path=None):
+    def _path(self, path):
         if path is None:
             # Save as name of attachment if there is no path specified
-            path = self.name
-        elif os.path.isdir(path):
+            return self.name
+        if os.path.isdir(path):
             # If the path is a directory, save as name of attachment in that
             # directory
-            path = os.path.join(path, self.name)
+            return os.path.join(path, self.name)
+        return path
+
+    def _open(self, path, resume):
+        if resume and self._decoder is not None:
+            f = open(path, 'r+b')
+            # drop anything written after the last completed chunk
+            f.seek(self.written)
+            f.truncate()
+            return f
+        return open(path, 'wb')
+
+    def save(self, path=None, resume=False):
+        """Save the payload to ``path``; see ``write`` for ``resume``."""
+        path = self._path(path)
+        with self._open(path, resume) as f:
+            self.write(f, resume)
+        return path
+
 
-        with open(path, 'wb') as f:
-            f.write(self.payload)
+Message.attachment_class = Attachment
+
+
+def _with_message(thread, message):
+    # a message outside the mailbox cache stands in for its cached copy
+    return [message if member.uid == message.uid else member for member in thread]
 
 
 def charset(s):
@@ -334,22 +629,122 @@ def parse_headers(message):
     return hdrs
 
 
-def parse_flags(headers):
-    if sys.version_info[0] == 3:
-        headers = bytes(headers, "ascii")
-    return list(ParseFlags(headers))
+def parse_email(raw_email):
+    """
+        Parse a raw RFC822 message into a dict of Message fields. The values,
+        the parsed message included, pickle, so this can run in a process pool.
+    """
+    message = email.message_from_bytes(raw_email)
+    fields = email_fields(message)
+    # kept so attachments are read from it rather than fetched again
+    fields['message'] = message
+    return fields
+
+
+def header_fields(message):
+    return dict(headers=parse_headers(message),
+                to=message['to'],
+                fr=message['from'],
+                cc=message['cc'],
+                delivered_to=message['delivered-to'],
+                subject=parse_subject(message['subject']),
+                sent_at=parse_date(message['date']))
+
+
+def email_fields(message):
+    fields = header_fields(message)
+
+    if message.get_content_maintype() == "multipart":
+        for content in message.walk():
+            if content.get_content_type() == "text/plain":
+                fields['body'] = content.get_payload(decode=True)
+            elif content.get_content_type() == "text/html":
+                fields['html'] = content.get_payload(decode=True)
+    elif message.get_content_maintype() == "text":
+        fields['body'] = message.get_payload()
+
+    # attachments are built from the structure, see Message._load_email
+    fields['structure'] = mime_structure(message)
+
+    return fields
+
+
+def parse_date(date):
+    parsed = date and email.utils.parsedate_tz(date)
+    if not parsed:
+        return None
+    return datetime.datetime.fromtimestamp(time.mktime(parsed[:9]))
+
+
+def decode_transfer_encoding(data, encoding):
+    if encoding == 'base64':
+        return base64.b64decode(data)
+    if encoding == 'quoted-printable':
+        return quopri.decodestring(data)
+    return data
+
+
+def decoded_size(size, encoding):
+    """Estimate the decoded size of ``size`` transfer-encoded bytes."""
+    if encoding == 'base64':
+        # 57 bytes per 76 character line plus CRLF
+        return size * 57 // 78
+    return size
+
+
+class Decoder:
+    """Decodes a transfer-encoded payload fed to it in arbitrary chunks."""
+
+    def __init__(self, encoding):
+        self.encoding = encoding
+        # encoded bytes which can't be decoded until more arrive
+        self.pending = b''
+
+    def decode(self, chunk):
+        if self.encoding == 'base64':
+            data = self.pending + bytes(chunk).translate(None, b' \t\r\n')
+            # only whole groups of four characters can be decoded
+            end = len(data) - len(data) % 4
+        elif self.encoding == 'quoted-printable':
+            data = self.pending + bytes(chunk)
+            # a soft line break or =XX escape may straddle chunks
+            end = data.rfind(b'\n') + 1
+        else:
+            return bytes(chunk)
+
+        self.pending = data[end:]
+        return decode_transfer_encoding(data[:end], self.encoding) if end else b''
+
+    def flush(self):
+        pending, self.pending = self.pending, b''
+        if self.encoding == 'base64':
+            if len(pending) % 4 == 1:
+                # a lone character can't be decoded, as at the end of a partial fetch
+                return b''
+            pending += b'=' * (-len(pending) % 4)
+        return decode_transfer_encoding(pending, self.encoding) if pending else b''
+
+
+def decode_chunks(chunks, encoding):
+    """Decode transfer-encoded ``chunks`` one at a time, yielding the decoded bytes."""
+    decoder = Decoder(encoding)
+    for chunk in chunks:
+        yield decoder.decode(chunk)
+    yield decoder.flush()
 
 
-def parse_labels(headers):
-    if re.search(r'X-GM-LABELS \(([^\)]+)\)', headers):
-        labels = re.search(
-            r'X-GM-LABELS \(([^\)]+)\)', headers).groups(1)[0].split(' ')
-        return [l.replace('"', '') for l in labels]
-    else:
-        return list()
+def encoded_size(size, encoding):
+    """The most transfer-encoded bytes ``size`` decoded bytes can take."""
+    if encoding == 'base64':
+        return (size + 56) // 57 * 78
+    if encoding == 'quoted-printable':
+        return size * 3 + size // 25 + 3
+    return size
 
 
 def parse_subject(encoded_subject):
+    if encoded_subject is None:
+        return None
     dh = decode_header(encoded_subject)
     return ''.join([str(t[0]) for t in dh])
 
@@ -0,0 +1,304 @@
+# -*- coding: utf-8 -*-
+
+"""
+gmail.orchestrator
+~~~~~~~~~~~~~~~~~~~
+
+This module runs jobs across many Gmail accounts from one worker pool,
+keeping each account within its connection cap and download quota and
+backing off when Gmail throttles it.
+
+"""
+
+import imaplib
+import random
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+
+from .exceptions import GmailException, Throttled
+from .message import Message
+from .pool import ConnectionPool
+
+# Gmail lets an account download about 2500 MB over IMAP per day
+DAILY_DOWNLOAD = 2500 * 1024 * 1024
+_DAY = 24 * 60 * 60
+
+
+class Account:
+    """The credentials of one account: a password or an OAuth access token."""
+
+    def __init__(self, username, password=None, access_token=None):
+        self.username = username
+        self.password = password
+        self.access_token = access_token
+
+    def __repr__(self):
+        return '<Account {}>'.format(self.username)
+
+
+class AccountProgress:
+    """How far the jobs of one account have got."""
+
+    def __init__(self, username):
+        self.username = username
+        self.queued = 0
+        self.running = 0
+        self.done = 0
+        self.failed = 0
+        self.retries = 0
+        # estimated bytes downloaded in the last 24 hours
+        self.downloaded = 0
+        # time.time() before which no job is started, after a throttle
+        self.backoff_until = 0
+
+    def __repr__(self):
+        return '<AccountProgress {} queued={} running={} done={} failed={}>'.format(
+            self.username, self.queued, self.running, self.done, self.failed)
+
+
+class _Job:
+
+    def __init__(self, function, args, kwargs):
+        self.function = function
+        self.args = args
+        self.kwargs = kwargs
+        self.future = Future()
+        self.attempts = 0
+
+
+class _AccountState:
+
+    def __init__(self, pool):
+        self.pool = pool
+        self.jobs = deque()
+        self.progress = AccountProgress(pool.username)
+        # (time, bytes) of every finished job in the last 24 hours
+        self.downloads = deque()
+        # set while a timer is due to restart the queue after a wait
+        self.waiting = False
+
+
+class Orchestrator:
+    """
+        Runs jobs, callables taking an authenticated Gmail session, for many
+        accounts on ``workers`` threads. Each account uses at most ``connections``
+        sessions at once, and jobs failing with [THROTTLED] or a dropped
+        connection are retried up to ``retries`` times with exponential backoff.
+    """
+
+    def __init__(self,
+                 accounts,
+                 workers=8,
+                 connections=2,
+                 daily_download=DAILY_DOWNLOAD,
+                 retries=5,
+                 backoff=30,
+                 max_backoff=15 * 60,
+                 on_progress=None,
+                 **gmail_kwargs):
+        self.connections = connections
+        self.daily_download = daily_download
+        self.retries = retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        # called with an AccountProgress whenever a job of that account ends
+        self.on_progress = on_progress
+
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=workers)
+        self._timers = set()
+        # set by shutdown: nothing is started or queued again after that
+        self._closed = False
+        self._accounts = {}
+        for account in accounts:
+            pool = ConnectionPool(account.username,
+                                  password=account.password,
+                                  access_token=account.access_token,
+                                  size=connections,
+                                  **gmail_kwargs)
+            self._accounts[account.username] = _AccountState(pool)
+
+    def __repr__(self):
+        return '<Orchestrator {} accounts>'.format(len(self._accounts))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.shutdown()
+
+    @property
+    def progress(self):
+        return dict((username, state.progress) for username, state in self._accounts.items())
+
+    def submit(self, username, function, *args, **kwargs):
+        """Queue ``function(gmail, *args, **kwargs)`` for the account ``username``."""
+        state = self._accounts[username]
+        job = _Job(function, args, kwargs)
+        with self._lock:
+            if self._closed:
+                raise GmailException('The orchestrator was shut down.')
+            state.jobs.append(job)
+            state.progress.queued += 1
+        self._dispatch()
+        return job.future
+
+    def map(self, function, *args, **kwargs):
+        """Queue ``function`` for every account, returning a future per username."""
+        return dict((username, self.submit(username, function, *args, **kwargs))
+                    for username in self._accounts)
+
+    def find(self, mailbox_name=None, **kwargs):
+        """
+            Search every account, returning a future per username. The messages
+            are prefetched and detached from the session, which goes back to the
+            pool: their unloaded fields can't be read, pass them to a job instead.
+        """
+        kwargs.setdefault('prefetch', True)
+        return self.map(_find, mailbox_name, **kwargs)
+
+    def get_mail(self, mailbox_name="INBOX", **kwargs):
+        """The messages of ``mailbox_name`` in every account, detached as for ``find``."""
+        kwargs.setdefault('prefetch', True)
+        return self.map(_get_mail, mailbox_name, **kwargs)
+
+    def sync(self, mailbox_name="INBOX", states=None):
+        """Sync ``mailbox_name`` of every account from ``states``, a dict of SyncStates."""
+        states = states or {}
+        return dict((username, self.submit(username, _sync, mailbox_name, states.get(username)))
+                    for username in self._accounts)
+
+    def _dispatch(self):
+        now = time.time()
+        with self._lock:
+            if self._closed:
+                return
+            for state in self._accounts.values():
+                progress = state.progress
+                while state.jobs and progress.running < self.connections:
+                    wait = max(progress.backoff_until - now, self._quota_wait(state, now))
+                    if wait > 0:
+                        if not state.waiting:
+                            state.waiting = True
+                            self._later(state, wait)
+                        break
+                    job = state.jobs.popleft()
+                    progress.queued -= 1
+                    progress.running += 1
+                    self._executor.submit(self._run, state, job)
+
+    def _quota_wait(self, state, now):
+        # seconds until the downloads of the last 24 hours fit the quota again
+        while state.downloads and state.downloads[0][0] < now - _DAY:
+            state.progress.downloaded -= state.downloads.popleft()[1]
+        if state.progress.downloaded < self.daily_download:
+            return 0
+        return state.downloads[0][0] + _DAY - now
+
+    def _later(self, state, delay):
+        if self._closed:
+            return
+
+        def run():
+            with self._lock:
+                self._timers.discard(timer)
+                state.waiting = False
+            self._dispatch()
+
+        timer = threading.Timer(delay, run)
+        timer.daemon = True
+        self._timers.add(timer)
+        timer.start()
+
+    def _run(self, state, job):
+        progress = state.progress
+        if not job.attempts and not job.future.set_running_or_notify_cancel():
+            with self._lock:
+                progress.running -= 1
+            self._dispatch()
+            return
+
+        retry = False
+        try:
+            job.attempts += 1
+            with state.pool.connection() as gmail:
+                result = job.function(gmail, *job.args, **job.kwargs)
+        except Exception as error:
+            with self._lock:
+                # once shut down, a job that would be retried fails instead
+                retry = _retryable(error) and job.attempts <= self.retries and not self._closed
+                progress.running -= 1
+                if retry:
+                    delay = min(self.backoff * 2 ** (job.attempts - 1), self.max_backoff)
+                    # jitter, so throttled workers don't all come back at once
+                    delay *= random.uniform(0.5, 1)
+                    progress.backoff_until = max(progress.backoff_until, time.time() + delay)
+                    progress.retries += 1
+                    progress.queued += 1
+                    state.jobs.appendleft(job)
+                else:
+                    progress.failed += 1
+            if not retry:
+                job.future.set_exception(error)
+        else:
+            size = _downloaded(result)
+            with self._lock:
+                progress.running -= 1
+                progress.done += 1
+                progress.downloaded += size
+                state.downloads.append((time.time(), size))
+            job.future.set_result(result)
+
+        if self.on_progress is not None:
+            self.on_progress(progress)
+        self._dispatch()
+
+    def shutdown(self, wait=True):
+        """Stop starting jobs, wait for the running ones and log every session out."""
+        with self._lock:
+            self._closed = True
+            timers, self._timers = list(self._timers), set()
+            pending = [job for state in self._accounts.values() for job in state.jobs]
+            for state in self._accounts.values():
+                state.jobs.clear()
+                state.progress.queued = 0
+        for timer in timers:
+            timer.cancel()
+        for job in pending:
+            # jobs waiting for a retry are already running and can't be cancelled
+            if not job.future.cancel():
+                job.future.set_exception(GmailException('The orchestrator was shut down.'))
+
+        self._executor.shutdown(wait=wait)
+        for state in self._accounts.values():
+            state.pool.close()
+
+
+def _find(gmail, mailbox_name, **kwargs):
+    return [message.detached() for message in gmail.find(mailbox_name, **kwargs)]
+
+
+def _get_mail(gmail, mailbox_name, **kwargs):
+    return [message.detached() for message in gmail.get_mailbox(mailbox_name).get_mail(**kwargs)]
+
+
+def _sync(gmail, mailbox_name, state):
+    return gmail.get_mailbox(mailbox_name).sync(state)
+
+
+def _retryable(error):
+    """Whether ``error`` is Gmail throttling the account or dropping the connection."""
+    if isinstance(error, (Throttled, imaplib.IMAP4.abort, OSError)):
+        return True
+    return 'THROTTLED' in str(error)
+
+
+def _downloaded(result):
+    """Estimate the bytes a job downloaded from the messages it returned."""
+    if isinstance(result, Message):
+        return result._size
+    if isinstance(result, (list, tuple)):
+        return sum(message._size for message in result if isinstance(message, Message))
+    return 0
@@ -0,0 +1,67 @@
+import threading
+import time
+
+import pytest
+
+from gmail.exceptions import GmailException, Throttled
+from gmail.orchestrator import Account, Orchestrator
+from gmail.pool_test import FakePool
+
+
+def orchestrator(**kwargs):
+    orchestrator = Orchestrator([Account('a@example.com', 'password')], **kwargs)
+    for state in orchestrator._accounts.values():
+        state.pool = FakePool(size=orchestrator.connections)
+    return orchestrator
+
+
+def test_jobs_run_on_a_pooled_session():
+    with orchestrator() as jobs:
+        future = jobs.submit('a@example.com', lambda gmail: gmail.inbox.count())
+        assert future.result(timeout=5) == 3
+    assert jobs.progress['a@example.com'].done == 1
+
+
+def test_throttled_jobs_are_retried():
+    attempts = []
+
+    def job(gmail):
+        attempts.append(1)
+        if len(attempts) < 3:
+            raise Throttled('NO [THROTTLED]')
+        return len(attempts)
+
+    with orchestrator(backoff=0.01) as jobs:
+        assert jobs.submit('a@example.com', job).result(timeout=5) == 3
+    assert jobs.progress['a@example.com'].retries == 2
+
+
+def test_found_messages_are_detached_from_the_pool():
+    with orchestrator() as jobs:
+        found = jobs.get_mail('INBOX', profile='flags')['a@example.com'].result(timeout=5)
+    assert [message.uid for message in found] == [b'1', b'2', b'3']
+    assert all(message.mailbox is None for message in found)
+
+
+def test_a_job_failing_during_shutdown_is_not_retried():
+    started, failing = threading.Event(), threading.Event()
+
+    def job(gmail):
+        started.set()
+        failing.wait(5)
+        raise Throttled('NO [THROTTLED]')
+
+    jobs = orchestrator(backoff=0.01)
+    future = jobs.submit('a@example.com', job)
+    started.wait(5)
+    shutdown = threading.Thread(target=jobs.shutdown)
+    shutdown.start()
+    while not jobs._closed:
+        time.sleep(0.01)
+    failing.set()
+
+    with pytest.raises(Throttled):
+        future.result(timeout=2)
+    shutdown.join(5)
+    with pytest.raises(GmailException):
+        jobs.submit('a@example.com', job)
@@ -0,0 +1,345 @@
+# -*- coding: utf-8 -*-
+
+"""
+gmail.parser
+~~~~~~~~~~~~~~~~~~~
+
+This module parses the parenthesized IMAP responses returned by imaplib
+(FETCH items, ENVELOPE, BODYSTRUCTURE, LIST and STATUS) into plain python
+values.
+
+"""
+
+import re
+from email.utils import collapse_rfc2231_value
+
+
+class _Literal(bytes):
+    """The payload of an IMAP ``{size}`` literal."""
+
+
+def _segments(parts):
+    # imaplib returns ``(line, literal)`` tuples for lines ending in a literal
+    for part in parts:
+        if isinstance(part, tuple):
+            yield part[0]
+            yield _Literal(part[1])
+        elif part:
+            yield part
+
+
+def tokenize(parts):
+    """
+        Parse one IMAP response into nested lists. Atoms, quoted strings and
+        literals become bytes and NIL becomes None.
+    """
+    stack = [[]]
+    for segment in _segments(parts):
+        if isinstance(segment, _Literal):
+            stack[-1].append(bytes(segment))
+            continue
+
+        i, length = 0, len(segment)
+        while i < length:
+            char = segment[i:i + 1]
+            if char in b' \r\n':
+                i += 1
+            elif char == b'(':
+                stack.append([])
+                i += 1
+            elif char == b')':
+                if len(stack) > 1:
+                    done = stack.pop()
+                    stack[-1].append(done)
+                i += 1
+            elif char == b'"':
+                i += 1
+                quoted = bytearray()
+                while i < length and segment[i:i + 1] != b'"':
+                    if segment[i:i + 1] == b'\\':
+                        i += 1
+                    quoted += segment[i:i + 1]
+                    i += 1
+                stack[-1].append(bytes(quoted))
+                i += 1
+            elif char == b'{':
+                # the literal itself is the next segment
+                i = segment.index(b'}', i) + 1
+            else:
+                start, depth = i, 0
+                while i < length:
+                    char = segment[i:i + 1]
+                    if char == b'[':
+                        depth += 1
+                    elif char == b']':
+                        depth -= 1
+                    elif not depth and char in b' ()"\r\n':
+                        break
+                    i += 1
+                atom = segment[start:i]
+                stack[-1].append(None if atom.upper() == b'NIL' else atom)
+
+    while len(stack) > 1:
+        done = stack.pop()
+        stack[-1].append(done)
+    return stack[0]
+
+
+def fetch_items(tokens):
+    """
+        Turn the tokens of one ``<seq> (<name> <value> ...)`` FETCH response into
+        a dict keyed by upper-cased item name, e.g. ``'UID'`` or ``'BODY[]'``.
+    """
+    items = {}
+    values = tokens[1] if len(tokens) > 1 and isinstance(tokens[1], list) else []
+    for i in range(0, len(values) - 1, 2):
+        name = values[i]
+        if isinstance(name, bytes):
+            items[name.decode('ascii', 'replace').upper()] = values[i + 1]
+    return items
+
+
+def parse_fetch(data):
+    """
+        Split an imaplib FETCH response, possibly covering many messages, into
+        one dict of FETCH items per message.
+    """
+    responses = []
+    for part in data:
+        line = part[0] if isinstance(part, tuple) else part
+        if not line:
+            continue
+        if re.match(br'\d+ \(', line):
+            responses.append([])
+        elif not responses:
+            continue
+        responses[-1].append(part)
+
+    return [fetch_items(tokenize(parts)) for parts in responses]
+
+
+def _responses(data):
+    # one response per line opening with "(" or a name; literal trailers are kept
+    responses = []
+    for part in data:
+        line = part[0] if isinstance(part, tuple) else part
+        if not line:
+            continue
+        if line[:1] == b'(' or not responses or isinstance(responses[-1][-1], bytes):
+            responses.append([])
+        responses[-1].append(part)
+    return responses
+
+
+def parse_list(data):
+    """
+        Split an imaplib LIST response into ``(attributes, delimiter, name)``
+        tuples: attributes as str such as ``'\\Trash'``, the delimiter as str
+        (or None) and the raw mailbox name as bytes.
+    """
+    mailboxes = []
+    for parts in _responses(data):
+        tokens = tokenize(parts)
+        if len(tokens) < 3 or not isinstance(tokens[0], list) or tokens[2] is None:
+            continue
+        attributes = tuple(attribute.decode() for attribute in tokens[0])
+        delimiter = tokens[1].decode() if tokens[1] else None
+        mailboxes.append((attributes, delimiter, tokens[2]))
+    return mailboxes
+
+
+def parse_statuses(data):
+    """
+        Turn the ``"<name>" (MESSAGES 3 UNSEEN 1 ...)`` STATUS responses in
+        ``data`` into ``{name: {'MESSAGES': 3, 'UNSEEN': 1}}``, names as bytes.
+    """
+    statuses = {}
+    for parts in _responses(data):
+        tokens = tokenize(parts)
+        if len(tokens) < 2 or tokens[0] is None or not isinstance(tokens[1], list):
+            continue
+        values = tokens[1]
+        statuses[tokens[0]] = dict((values[i].decode().upper(), int(values[i + 1]))
+                                   for i in range(0, len(values) - 1, 2))
+    return statuses
+
+
+def format_addresses(addresses):
+    """Format an ENVELOPE address list the way it would appear in a header."""
+    formatted = []
+    for name, _, mailbox, host in addresses or []:
+        if mailbox is None or host is None:
+            # start or end of an RFC 2822 group
+            continue
+        address = '%s@%s' % (mailbox.decode(), host.decode())
+        if name:
+            address = '%s <%s>' % (name.decode('utf-8', 'replace'), address)
+        formatted.append(address)
+    return ', '.join(formatted) or None
+
+
+class BodyPart:
+    """One node of a BODYSTRUCTURE tree."""
+
+    def __init__(self, section, content_type, params=None, encoding=None,
+                 size=0, disposition=None, disposition_params=None, parts=None):
+        self.section = section
+        self.content_type = content_type
+        self.params = params or {}
+        self.encoding = encoding
+        self.size = size
+        self.disposition = disposition
+        self.disposition_params = disposition_params or {}
+        self.parts = parts or []
+
+    def __repr__(self):
+        return '<BodyPart {} {}>'.format(self.section, self.content_type)
+
+    @property
+    def is_multipart(self):
+        return self.content_type.startswith('multipart/')
+
+    @property
+    def charset(self):
+        return self.params.get('charset')
+
+    @property
+    def filename(self):
+        return self.disposition_params.get('filename') or self.params.get('name')
+
+    @property
+    def is_attachment(self):
+        return self.disposition == 'attachment' or (
+            not self.is_multipart and self.disposition is not None and self.filename is not None)
+
+    def walk(self):
+        yield self
+        for part in self.parts:
+            for child in part.walk():
+                yield child
+
+
+def _text(value):
+    return value.decode('utf-8', 'replace') if isinstance(value, bytes) else value
+
+
+def _params(values):
+    if not isinstance(values, list):
+        return {}
+    return dict((_text(values[i]).lower(), _text(values[i + 1]))
+                for i in range(0, len(values) - 1, 2))
+
+
+def _disposition(value):
+    if isinstance(value, list) and value:
+        return _text(value[0]).lower(), _params(value[1] if len(value) > 1 else None)
+    return None, {}
+
+
+def parse_bodystructure(structure, section=''):
+    """Build a ``BodyPart`` tree from a tokenized BODYSTRUCTURE."""
+    if structure and isinstance(structure[0], list):
+        # multipart: (part)(part)... subtype [params disposition ...]
+        children = []
+        for part in structure:
+            if not isinstance(part, list):
+                break
+            children.append(part)
+        extension = structure[len(children):]
+        subtype = _text(extension[0]).lower() if extension else 'mixed'
+        parts = [parse_bodystructure(child,
+                                     '%s.%d' % (section, i) if section else str(i))
+                 for i, child in enumerate(children, 1)]
+        disposition, disposition_params = _disposition(
+            extension[2] if len(extension) > 2 else None)
+        return BodyPart(section or 'TEXT', 'multipart/' + subtype,
+                        params=_params(extension[1] if len(extension) > 1 else None),
+                        disposition=disposition,
+                        disposition_params=disposition_params,
+                        parts=parts)
+
+    content_type = '%s/%s' % (_text(structure[0]).lower(), _text(structure[1]).lower())
+    # a single-part message is addressed as part 1
+    section = section or '1'
+
+    extension_start = 7
+    if content_type.startswith('text/'):
+        extension_start = 8
+    elif content_type == 'message/rfc822':
+        extension_start = 10
+
+    disposition, disposition_params = _disposition(
+        structure[extension_start + 1] if len(structure) > extension_start + 1 else None)
+
+    try:
+        size = int(structure[6])
+    except (TypeError, ValueError, IndexError):
+        size = 0
+
+    return BodyPart(section, content_type,
+                    params=_params(structure[2]),
+                    encoding=_text(structure[5]).lower() if structure[5] else None,
+                    size=size,
+                    disposition=disposition,
+                    disposition_params=disposition_params)
+
+
+def _mime_params(message, header='content-type'):
+    params = message.get_params(header=header) or []
+    return dict((key.lower(), collapse_rfc2231_value(value)) for key, value in params[1:])
+
+
+def _mime_children(message):
+    # message/rfc822 parts are leaves, as in BODYSTRUCTURE
+    if message.is_multipart() and message.get_content_maintype() == 'multipart':
+        return message.get_payload()
+    return None
+
+
+def mime_structure(message, section=''):
+    """
+        Build a ``BodyPart`` tree from a parsed ``email.message.Message``, with
+        sections numbered the way the server numbers them in BODYSTRUCTURE.
+    """
+    disposition_params = _mime_params(message, 'content-disposition')
+    if message.get_filename() is not None:
+        disposition_params['filename'] = message.get_filename()
+
+    part = BodyPart(section, message.get_content_type(),
+                    params=_mime_params(message),
+                    encoding=(message.get('content-transfer-encoding') or '').strip().lower() or None,
+                    disposition=message.get_content_disposition(),
+                    disposition_params=disposition_params)
+
+    children = _mime_children(message)
+    if children is not None:
+        part.section = section or 'TEXT'
+        part.parts = [mime_structure(child, '%s.%d' % (section, i) if section else str(i))
+                      for i, child in enumerate(children, 1)]
+    else:
+        part.section = section or '1'
+        part.size = len(mime_payload(message))
+    return part
+
+
+def mime_part(message, section):
+    """Find the part numbered ``section`` of a parsed ``email.message.Message``."""
+    if section in ('1', 'TEXT') and _mime_children(message) is None:
+        return message
+    for number in section.split('.'):
+        children = _mime_children(message)
+        if children is None or not 0 < int(number) <= len(children):
+            return None
+        message = children[int(number) - 1]
+    return message
+
+
+def mime_payload(message):
+    """The payload of a single MIME part, still transfer-encoded, as bytes."""
+    if message.is_multipart():
+        return b''.join(part.as_bytes() for part in message.get_payload())
+    payload = message.get_payload()
+    if isinstance(payload, bytes):
+        return payload
+    # the email package keeps undecodable bytes as surrogates
+    return payload.encode('ascii', 'surrogateescape')
@@ -0,0 +1,120 @@
+import email
+
+from gmail.parser import (mime_part, mime_structure, parse_bodystructure, parse_fetch, parse_list,
+                          parse_statuses, tokenize)
+
+RAW = (b'From: a@b.com\r\n'
+       b'Subject: hi\r\n'
+       b'MIME-Version: 1.0\r\n'
+       b'Content-Type: multipart/mixed; boundary=OUTER\r\n'
+       b'\r\n'
+       b'--OUTER\r\n'
+       b'Content-Type: multipart/alternative; boundary=INNER\r\n'
+       b'\r\n'
+       b'--INNER\r\n'
+       b'Content-Type: text/plain; charset=utf-8\r\n'
+       b'\r\n'
+       b'hello\r\n'
+       b'--INNER\r\n'
+       b'Content-Type: text/html; charset=utf-8\r\n'
+       b'\r\n'
+       b'<p>hello</p>\r\n'
+       b'--INNER--\r\n'
+       b'--OUTER\r\n'
+       b'Content-Type: message/rfc822\r\n'
+       b'Content-Disposition: attachment\r\n'
+       b'\r\n'
+       b'Subject: forwarded\r\n'
+       b'\r\n'
+       b'inner body\r\n'
+       b'--OUTER\r\n'
+       b'Content-Type: application/pdf; name=f.pdf\r\n'
+       b'Content-Disposition: attachment; filename=f.pdf\r\n'
+       b'Content-Transfer-Encoding: base64\r\n'
+       b'\r\n'
+       b'UERGREFUQQ==\r\n'
+       b'--OUTER--\r\n')
+
+# the BODYSTRUCTURE a server sends for RAW
+BODYSTRUCTURE = (
+    b'((("TEXT" "PLAIN" ("CHARSET" "utf-8") NIL NIL "7BIT" 5 1 NIL NIL NIL)'
+    b'("TEXT" "HTML" ("CHARSET" "utf-8") NIL NIL "7BIT" 12 1 NIL NIL NIL) "ALTERNATIVE" ("BOUNDARY" "INNER") NIL NIL)'
+    b'("MESSAGE" "RFC822" NIL NIL NIL "7BIT" 35 (NIL "forwarded" NIL NIL NIL NIL NIL NIL NIL NIL)'
+    b' ("TEXT" "PLAIN" NIL NIL NIL "7BIT" 10 1 NIL NIL NIL) 3 NIL ("ATTACHMENT" NIL) NIL)'
+    b'("APPLICATION" "PDF" ("NAME" "f.pdf") NIL NIL "BASE64" 12 NIL ("ATTACHMENT" ("FILENAME" "f.pdf")) NIL)'
+    b' "MIXED" ("BOUNDARY" "OUTER") NIL NIL)')
+
+
+def _sections(part):
+    return [(node.section, node.content_type) for node in part.walk()]
+
+
+def test_tokenize_nests_lists_and_reads_nil_and_quotes():
+    tokens = tokenize([b'1 (FLAGS (\\Seen) X-GM-LABELS ("\\\\Inbox" "a \\"b\\"") ENVELOPE (NIL "x"))'])
+    assert tokens == [b'1', [b'FLAGS', [b'\\Seen'], b'X-GM-LABELS', [b'\\Inbox', b'a "b"'],
+                             b'ENVELOPE', [None, b'x']]]
+
+
+def test_tokenize_keeps_literals_as_is():
+    tokens = tokenize([(b'1 (UID 4 BODY[] {9}', b'a (b) "c"'), b')'])
+    assert tokens == [b'1', [b'UID', b'4', b'BODY[]', b'a (b) "c"']]
+
+
+def test_section_atoms_keep_their_brackets():
+    tokens = tokenize([(b'1 (BODY[HEADER.FIELDS (FROM SUBJECT)] {3}', b'a\r\n'), b')'])
+    assert tokens[1][0] == b'BODY[HEADER.FIELDS (FROM SUBJECT)]'
+
+
+def test_parse_fetch_splits_messages():
+    data = [(b'1 (UID 7 BODY[] {2}', b'hi'), b')', b'2 (UID 8 FLAGS ())',
+            (b'3 (UID 9 BODY[1]<0> {1}', b'x'), b' FLAGS (\\Seen))']
+    fetched = parse_fetch(data)
+    assert [message['UID'] for message in fetched] == [b'7', b'8', b'9']
+    assert fetched[0]['BODY[]'] == b'hi'
+    assert fetched[1]['FLAGS'] == []
+    assert fetched[2]['BODY[1]<0>'] == b'x'
+    assert fetched[2]['FLAGS'] == [b'\\Seen']
+
+
+def test_parse_bodystructure_of_a_single_part():
+    part = parse_bodystructure(tokenize([b'("TEXT" "PLAIN" ("CHARSET" "us-ascii") NIL NIL "QUOTED-PRINTABLE" 42 2 NIL NIL NIL)'])[0])
+    assert (part.section, part.content_type, part.charset, part.encoding, part.size) == \
+        ('1', 'text/plain', 'us-ascii', 'quoted-printable', 42)
+    assert not part.is_attachment
+
+
+def test_parse_bodystructure_of_nested_multiparts():
+    structure = parse_bodystructure(tokenize([BODYSTRUCTURE])[0])
+    assert _sections(structure) == [
+        ('TEXT', 'multipart/mixed'),
+        ('1', 'multipart/alternative'),
+        ('1.1', 'text/plain'),
+        ('1.2', 'text/html'),
+        ('2', 'message/rfc822'),
+        ('3', 'application/pdf'),
+    ]
+    forwarded, pdf = structure.parts[1], structure.parts[2]
+    assert forwarded.is_attachment and forwarded.disposition == 'attachment'
+    assert pdf.filename == 'f.pdf' and pdf.encoding == 'base64' and pdf.size == 12
+
+
+def test_mime_structure_numbers_sections_like_bodystructure():
+    message = email.message_from_bytes(RAW)
+    assert _sections(mime_structure(message)) == _sections(parse_bodystructure(tokenize([BODYSTRUCTURE])[0]))
+    assert mime_part(message, '1.2').get_content_type() == 'text/html'
+    assert mime_part(message, '3').get_filename() == 'f.pdf'
+    assert mime_part(message, '4') is None
+
+
+def test_mime_structure_of_a_single_part():
+    message = email.message_from_bytes(b'Content-Type: text/plain\r\n\r\nhi\r\n')
+    assert _sections(mime_structure(message)) == [('1', 'text/plain')]
+    assert mime_part(message, '1') is message
+
+
+def test_parse_list_and_statuses():
+    listed = parse_list([b'(\\HasNoChildren \\Trash) "/" "[Gmail]/Trash"',
+                         (b'(\\HasNoChildren) "/" {4}', b'W "x')])
+    assert listed == [(('\\HasNoChildren', '\\Trash'), '/', b'[Gmail]/Trash'),
+                      (('\\HasNoChildren',), '/', b'W "x')]
+    assert parse_statuses([b'"INBOX" (MESSAGES 3 unseen 1)']) == {b'INBOX': {'MESSAGES': 3, 'UNSEEN': 1}}
@@ -0,0 +1,145 @@
+# -*- coding: utf-8 -*-
+
+"""
+gmail.pool
+~~~~~~~~~~~~~~~~~~~
+
+This module contains a thread-safe pool of authenticated Gmail sessions
+for a single account.
+
+"""
+
+import imaplib
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+from .exceptions import Timeout
+from .gmail import Gmail
+
+
+class ConnectionPool:
+    """
+        Hands out authenticated Gmail sessions, each with its own IMAP connection
+        and selected mailbox, so threads never share one. Sessions are checked
+        with NOOP after sitting idle, and replaced after an error or once older
+        than ``max_age`` seconds.
+    """
+
+    # Gmail allows at most 15 simultaneous IMAP connections per account
+    MAX_CONNECTIONS = 15
+
+    def __init__(self,
+                 username,
+                 password=None,
+                 access_token=None,
+                 size=4,
+                 max_age=30 * 60,
+                 check_after=30,
+                 **gmail_kwargs):
+        if not 0 < size <= self.MAX_CONNECTIONS:
+            raise ValueError('size must be between 1 and %d' % self.MAX_CONNECTIONS)
+
+        self.username = username
+        self.password = password
+        self.access_token = access_token
+        self.size = size
+        self.max_age = max_age
+        # seconds a session may sit idle before it is checked with NOOP
+        self.check_after = check_after
+        self.gmail_kwargs = gmail_kwargs
+        self.gmail_kwargs.setdefault('debug', False)
+
+        self._lock = threading.Lock()
+        self._available = threading.BoundedSemaphore(size)
+        # idle sessions, most recently used last
+        self._idle = deque()
+        # session -> (created at, last released at)
+        self._times = {}
+
+    def __repr__(self):
+        return '<ConnectionPool {} {}/{} idle>'.format(self.username, len(self._idle), self.size)
+
+    def _open(self):
+        gmail = Gmail(**self.gmail_kwargs)
+        if self.access_token:
+            gmail.authenticate(self.username, self.access_token)
+        else:
+            gmail.login(self.username, self.password, only_fetch=True)
+
+        with self._lock:
+            self._times[gmail] = (time.time(), time.time())
+        return gmail
+
+    def _close(self, gmail):
+        with self._lock:
+            self._times.pop(gmail, None)
+        try:
+            gmail.logout()
+        except (imaplib.IMAP4.error, OSError):
+            pass
+
+    def _usable(self, gmail):
+        created, released = self._times[gmail]
+        now = time.time()
+        if now - created > self.max_age:
+            return False
+        if now - released < self.check_after:
+            return True
+        try:
+            response, _ = gmail.imap.noop()
+        except (imaplib.IMAP4.error, OSError):
+            return False
+        return response == 'OK'
+
+    def acquire(self, timeout=None):
+        """Take a session out of the pool, opening one if none is idle."""
+        if not self._available.acquire(timeout=timeout):
+            raise Timeout('No connection to %s available' % self.username)
+
+        try:
+            while True:
+                with self._lock:
+                    gmail = self._idle.pop() if self._idle else None
+                if gmail is None:
+                    return self._open()
+                if self._usable(gmail):
+                    return gmail
+                self._close(gmail)
+        except BaseException:
+            self._available.release()
+            raise
+
+    def release(self, gmail, broken=False):
+        """Give a session back; ``broken`` ones are logged out instead."""
+        try:
+            if broken or not gmail.logged_in or gmail not in self._times:
+                self._close(gmail)
+            else:
+                with self._lock:
+                    self._times[gmail] = (self._times[gmail][0], time.time())
+                    self._idle.append(gmail)
+        finally:
+            self._available.release()
+
+    @contextmanager
+    def connection(self, timeout=None):
+        gmail = self.acquire(timeout)
+        try:
+            yield gmail
+        except (imaplib.IMAP4.error, OSError):
+            self.release(gmail, broken=True)
+            raise
+        except BaseException:
+            self.release(gmail)
+            raise
+        else:
+            self.release(gmail)
+
+    def close(self):
+        """Log out every idle session."""
+        with self._lock:
+            idle, self._idle = list(self._idle), deque()
+        for gmail in idle:
+            self._close(gmail)
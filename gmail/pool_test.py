@@ -0,0 +1,79 @@
+import imaplib
+import time
+
+import pytest
+
+from gmail.exceptions import Timeout
+from gmail.pool import ConnectionPool
+from gmail.session_test import login
+
+
+class FakePool(ConnectionPool):
+    """A ConnectionPool whose sessions are logged in to FakeServers."""
+
+    def __init__(self, *args, **kwargs):
+        ConnectionPool.__init__(self, 'a@example.com', 'password', *args, **kwargs)
+        # the server of each session opened, in order
+        self.servers = []
+
+    def _open(self):
+        gmail, server = login()
+        self.servers.append(server)
+        with self._lock:
+            self._times[gmail] = (time.time(), time.time())
+        return gmail
+
+
+def test_sessions_are_reused():
+    pool = FakePool(size=2)
+    with pool.connection() as first:
+        pass
+    with pool.connection() as second:
+        assert second is first
+    assert len(pool.servers) == 1
+
+
+def test_no_more_than_size_sessions_are_handed_out():
+    pool = FakePool(size=1)
+    gmail = pool.acquire()
+    with pytest.raises(Timeout):
+        pool.acquire(timeout=0.05)
+    pool.release(gmail)
+    assert pool.acquire(timeout=0.05) is gmail
+
+
+def test_a_session_failing_with_an_imap_error_is_replaced():
+    pool = FakePool()
+    with pytest.raises(imaplib.IMAP4.error):
+        with pool.connection() as broken:
+            raise imaplib.IMAP4.abort('connection dropped')
+    assert pool.servers[0].commands[-1] == 'LOGOUT'
+    with pool.connection() as gmail:
+        assert gmail is not broken
+
+
+def test_idle_sessions_are_checked_with_noop():
+    pool = FakePool(check_after=0)
+    with pool.connection() as first:
+        pass
+    with pool.connection() as second:
+        assert second is first
+    assert pool.servers[0].commands[-1] == 'NOOP'
+
+
+def test_old_sessions_are_replaced():
+    pool = FakePool(max_age=0)
+    with pool.connection() as first:
+        pass
+    time.sleep(0.01)
+    with pool.connection() as second:
+        assert second is not first
+    assert pool.servers[0].commands[-1] == 'LOGOUT'
+
+
+def test_close_logs_out_the_idle_sessions():
+    pool = FakePool()
+    with pool.connection():
+        pass
+    pool.close()
+    assert pool.servers[0].commands[-1] == 'LOGOUT'
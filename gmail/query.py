@@ -0,0 +1,243 @@
+# -*- coding: utf-8 -*-
+
+"""
+gmail.query
+~~~~~~~~~~~~~~~~~~~
+
+This module contains Query, a search condition built from the get_mail
+keyword arguments and combined with ``&``, ``|`` and ``~``. It compiles
+to IMAP SEARCH criteria or to Gmail's own search syntax (X-GM-RAW).
+
+"""
+
+import datetime
+import re
+
+DATE_FORMAT = "%d-%b-%Y"
+
+AND = 'AND'
+OR = 'OR'
+NOT = 'NOT'
+
+# keys whose value is a date, a number or a sequence set
+_DATE_KEYS = ('BEFORE', 'SINCE', 'ON')
+_NUMBER_KEYS = ('LARGER', 'SMALLER', 'X-GM-THRID', 'X-GM-MSGID')
+_SET_KEYS = ('UID',)
+
+_SEQUENCE_SET = re.compile(r'^(\d+|\*)(:(\d+|\*))?(,(\d+|\*)(:(\d+|\*))?)*$')
+
+# flag keyword arguments and the SEARCH key each one sets
+_FLAGS = (
+    ('read', 'SEEN'),
+    ('unread', 'UNSEEN'),
+    ('starred', 'FLAGGED'),
+    ('unstarred', 'UNFLAGGED'),
+    ('deleted', 'DELETED'),
+    ('undeleted', 'UNDELETED'),
+    ('draft', 'DRAFT'),
+    ('undraft', 'UNDRAFT'),
+    ('answered', 'ANSWERED'),
+    ('unanswered', 'UNANSWERED'),
+)
+
+# keyword arguments taking a value, and their SEARCH key
+_VALUES = (
+    ('sender', 'FROM'),
+    ('fr', 'FROM'),
+    ('from', 'FROM'),
+    ('to', 'TO'),
+    ('cc', 'CC'),
+    ('bcc', 'BCC'),
+    ('subject', 'SUBJECT'),
+    ('body', 'BODY'),
+    ('text', 'TEXT'),
+    ('label', 'X-GM-LABELS'),
+    ('query', 'X-GM-RAW'),
+    ('before', 'BEFORE'),
+    ('after', 'SINCE'),
+    ('on', 'ON'),
+    ('larger', 'LARGER'),
+    ('smaller', 'SMALLER'),
+    ('thread_id', 'X-GM-THRID'),
+    ('message_id', 'X-GM-MSGID'),
+    ('uid', 'UID'),
+)
+
+# Gmail search operators for the SEARCH keys which have one
+_GMAIL = {
+    'SEEN': 'is:read',
+    'UNSEEN': 'is:unread',
+    'FLAGGED': 'is:starred',
+    'UNFLAGGED': '-is:starred',
+    'DRAFT': 'in:drafts',
+    'FROM': 'from:',
+    'TO': 'to:',
+    'CC': 'cc:',
+    'BCC': 'bcc:',
+    'SUBJECT': 'subject:',
+    'BODY': '',
+    'TEXT': '',
+    'X-GM-LABELS': 'label:',
+    'BEFORE': 'before:',
+    'SINCE': 'after:',
+    'LARGER': 'larger:',
+    'SMALLER': 'smaller:',
+}
+
+
+class Query:
+    """
+        A SEARCH condition. Keyword arguments are those of ``get_mail`` and are
+        ANDed; queries combine with ``&`` (and), ``|`` (or) and ``~`` (not):
+
+            Query(unread=True) & (Query(fr='a@b.com') | ~Query(label='Work'))
+    """
+
+    def __init__(self, **kwargs):
+        self.op = AND
+        # (SEARCH key, value) pairs and nested queries
+        self.terms = []
+
+        for name, key in _FLAGS:
+            if kwargs.get(name):
+                self.terms.append((key, None))
+
+        if kwargs.get('header'):
+            self.terms.append(('HEADER', tuple(kwargs['header'])))
+        if kwargs.get('not_from'):
+            self.terms.append(~Query(fr=kwargs['not_from']))
+
+        for name, key in _VALUES:
+            value = kwargs.get(name)
+            if isinstance(value, Query):
+                self.terms.append(value)
+            elif value:
+                if isinstance(value, datetime.datetime):
+                    value = value.date()
+                self.terms.append((key, value))
+
+    @classmethod
+    def _combine(cls, op, terms):
+        query = cls()
+        query.op = op
+        query.terms = terms
+        return query
+
+    def __and__(self, other):
+        return Query._combine(AND, [self, other])
+
+    def __or__(self, other):
+        return Query._combine(OR, [self, other])
+
+    def __invert__(self):
+        return Query._combine(NOT, [self])
+
+    def __repr__(self):
+        return '<Query {}>'.format(' '.join(self.criteria()))
+
+    def criteria(self, date_format=DATE_FORMAT):
+        """The SEARCH criteria, as the arguments of ``UID SEARCH``."""
+        if self.op == AND:
+            return ['ALL'] + self._keys(date_format)
+        return self._keys(date_format)
+
+    def _keys(self, date_format):
+        if self.op == NOT:
+            return ['NOT', self.terms[0]._key(date_format)]
+
+        keys = [_term_key(term, date_format) for term in self.terms]
+        if self.op == AND:
+            return [token for key in keys for token in key]
+
+        # OR takes exactly two search keys, so longer lists are nested
+        single = [_single(key) for key in keys]
+        tokens = single[-1:]
+        for key in reversed(single[:-1]):
+            tokens = ['OR', key] + tokens
+            tokens = [' '.join(tokens)]
+        return tokens
+
+    def _key(self, date_format):
+        return _single(self._keys(date_format))
+
+    def raw(self):
+        """
+            The query in Gmail's search syntax, for X-GM-RAW. Raises ValueError for
+            conditions Gmail search can't express, such as UID or HEADER.
+        """
+        if self.op == NOT:
+            return '-' + _raw_unit(self.terms[0])
+
+        parts = [_raw_unit(term) if isinstance(term, Query) else _gmail_term(*term)
+                 for term in self.terms]
+        if self.op == OR:
+            return '{%s}' % ' '.join(parts)
+        return ' '.join(parts)
+
+
+def quote(value):
+    """Quote a label or mailbox name as an IMAP string."""
+    return '"%s"' % value.replace('\\', '\\\\').replace('"', '\\"')
+
+
+def _single(tokens):
+    # a list of search keys as one key, parenthesized when needed
+    if not tokens:
+        return 'ALL'
+    if len(tokens) == 1 or (tokens and tokens[0] == 'NOT' and len(tokens) == 2):
+        return ' '.join(tokens)
+    return '(%s)' % ' '.join(tokens)
+
+
+def _term_key(term, date_format):
+    if isinstance(term, Query):
+        # nested ANDs need no parentheses
+        return term._keys(date_format) if term.op == AND else [term._key(date_format)]
+
+    key, value = term
+    if value is None:
+        return [key]
+    if key == 'HEADER':
+        return [key, quote(value[0]), quote(value[1])]
+    if key in _DATE_KEYS:
+        return [key, value.strftime(date_format)]
+    if key in _NUMBER_KEYS:
+        return [key, str(int(value))]
+    if key in _SET_KEYS:
+        return [key, _sequence_set(value)]
+    return [key, quote(str(value))]
+
+
+def _sequence_set(value):
+    # sent as an atom, so anything else could add search keys
+    value = str(value)
+    if not _SEQUENCE_SET.match(value):
+        raise ValueError('%r is not a sequence set such as "1:5,9"' % value)
+    return value
+
+
+def _group(raw):
+    return '(%s)' % raw if ' ' in raw else raw
+
+
+def _raw_unit(query):
+    # OR ({...}) and NOT (-...) already read as one term
+    return _group(query.raw()) if query.op == AND else query.raw()
+
+
+def _gmail_term(key, value):
+    if key == 'X-GM-RAW':
+        return _group(value)
+    if key == 'ON':
+        return '(after:%s before:%s)' % (value.strftime('%Y/%m/%d'),
+                                         (value + datetime.timedelta(days=1)).strftime('%Y/%m/%d'))
+    if key not in _GMAIL:
+        raise ValueError('%s has no Gmail search equivalent' % key)
+    if value is None:
+        return _GMAIL[key]
+    if key in _DATE_KEYS:
+        value = value.strftime('%Y/%m/%d')
+    value = str(value)
+    if ' ' in value or '"' in value:
+        value = '"%s"' % value.replace('"', '')
+    return _GMAIL[key] + value
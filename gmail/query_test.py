@@ -0,0 +1,77 @@
+import datetime
+
+import pytest
+
+from gmail import Query
+from gmail.uidset import UIDSet
+
+
+def test_keywords_are_anded():
+    query = Query(unread=True, fr='boss@corp.com')
+    assert query.criteria() == ['ALL', 'UNSEEN', 'FROM', '"boss@corp.com"']
+    assert query.raw() == 'is:unread from:boss@corp.com'
+
+
+def test_readme_example():
+    query = Query(unread=True) & (Query(fr='boss@corp.com') | ~Query(label='Newsletters'))
+    assert query.criteria() == ['ALL', 'UNSEEN', 'OR (FROM "boss@corp.com") NOT (X-GM-LABELS "Newsletters")']
+    assert query.raw() == 'is:unread {from:boss@corp.com -label:Newsletters}'
+
+
+def test_readme_size_and_date_example():
+    query = Query(larger=5 * 1024 * 1024) & Query(after=datetime.date(2020, 1, 1))
+    assert query.criteria() == ['ALL', 'LARGER', '5242880', 'SINCE', '01-Jan-2020']
+    assert query.raw() == 'larger:5242880 after:2020/01/01'
+
+
+def test_or_of_more_than_two_keys_nests_in_prefix_form():
+    query = Query(fr='a') | Query(fr='b') | Query(fr='c')
+    assert query.criteria() == ['OR OR (FROM "a") (FROM "b") (FROM "c")']
+    assert query.raw() == '{{from:a from:b} from:c}'
+
+
+def test_not_of_several_keys():
+    query = ~(Query(unread=True) & Query(fr='x'))
+    assert query.criteria() == ['NOT', '(UNSEEN FROM "x")']
+    assert query.raw() == '-(is:unread from:x)'
+
+
+def test_values_are_quoted():
+    assert Query(subject='say "hi"').criteria() == ['ALL', 'SUBJECT', '"say \\"hi\\""']
+    assert Query(label='\\Inbox').criteria() == ['ALL', 'X-GM-LABELS', '"\\\\Inbox"']
+    assert Query(subject='"as is"').criteria() == ['ALL', 'SUBJECT', '"\\"as is\\""']
+    assert Query(query='"a" "b"').criteria() == ['ALL', 'X-GM-RAW', '"\\"a\\" \\"b\\""']
+    assert Query(subject='say "hi"').raw() == 'subject:"say hi"'
+
+
+def test_numbers_atoms_and_headers():
+    assert Query(uid='1:5', thread_id=7).criteria() == ['ALL', 'X-GM-THRID', '7', 'UID', '1:5']
+    assert Query(header=('X-Mailer', 'a b')).criteria() == ['ALL', 'HEADER', '"X-Mailer"', '"a b"']
+
+
+def test_uid_must_be_a_sequence_set():
+    assert Query(uid=UIDSet([1, 2, 3, 9])).criteria() == ['ALL', 'UID', '1:3,9']
+    assert Query(uid='5:*').criteria() == ['ALL', 'UID', '5:*']
+    with pytest.raises(ValueError):
+        Query(uid='1:5 OR ALL').criteria()
+
+
+def test_on_is_a_one_day_range_in_gmail_search():
+    query = Query(on=datetime.datetime(2009, 1, 1, 12, 30))
+    assert query.criteria() == ['ALL', 'ON', '01-Jan-2009']
+    assert query.raw() == '(after:2009/01/01 before:2009/01/02)'
+
+
+def test_raw_query_is_grouped():
+    assert Query(query='has:attachment in:inbox').raw() == '(has:attachment in:inbox)'
+
+
+def test_raw_refuses_what_gmail_search_cannot_say():
+    with pytest.raises(ValueError):
+        Query(uid='1:5').raw()
+    with pytest.raises(ValueError):
+        Query(header=('X-Mailer', 'x')).raw()
+
+
+def test_empty_query_matches_all():
+    assert Query().criteria() == ['ALL']
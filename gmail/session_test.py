@@ -0,0 +1,321 @@
+import email
+import io
+import re
+import socket
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from gmail import Gmail
+from gmail.compress import DeflateCodec
+from gmail.connection import IMAPConnection
+from gmail.exceptions import GmailException
+from gmail.message import FLAGS, STRUCTURE
+from gmail.parser import mime_part, mime_payload
+from gmail.parser_test import BODYSTRUCTURE, RAW
+from gmail.uidset import UIDSet
+
+# Gmail lists most extensions only once the client is logged in
+BEFORE_LOGIN = 'IMAP4rev1 IDLE SASL-IR AUTH=XOAUTH2'
+AFTER_LOGIN = 'IMAP4rev1 IDLE ENABLE MOVE UIDPLUS ESEARCH CONDSTORE LIST-EXTENDED LIST-STATUS SPECIAL-USE'
+
+MAILBOXES = (
+    ('\\HasNoChildren', 'INBOX'),
+    ('\\HasChildren \\Noselect', '[Gmail]'),
+    ('\\All \\HasNoChildren', '[Gmail]/All Mail'),
+    ('\\HasNoChildren \\Trash', '[Gmail]/Trash'),
+)
+
+
+class FakeServer(threading.Thread):
+    """Answers one IMAP client over a socket pair, recording its commands."""
+
+    def __init__(self, sock, capabilities=AFTER_LOGIN, uids=(1, 2, 3), trash=(7,)):
+        threading.Thread.__init__(self)
+        self.daemon = True
+        self.sock = sock
+        self.capabilities = capabilities
+        # what was received but not read yet, and the DeflateCodec after COMPRESS
+        self.buffer = b''
+        self.codec = None
+        # the UIDs in each mailbox
+        self.contents = {'INBOX': list(uids), '[Gmail]/All Mail': list(uids),
+                         '[Gmail]/Trash': list(trash)}
+        self.selected = 'INBOX'
+        self.commands = []
+        # the untagged responses pushed during each IDLE, in turn
+        self.pushes = []
+        # the offsets of partial fetches which fail, once each
+        self.failing = set()
+        # the X-GM-THRID of each UID
+        self.threads = {}
+
+    @property
+    def uids(self):
+        return self.contents.get(self.selected, [])
+
+    def search(self, command):
+        # only UID sets without * and X-GM-THRID narrow the search
+        uids = self.uids
+        for uid_set in re.findall(r'\bUID ([\d:,]+)(?!\S)', command):
+            uids = [uid for uid in uids if uid in UIDSet(uid_set)]
+        thread_ids = [int(thread_id) for thread_id in re.findall(r'X-GM-THRID (\d+)', command)]
+        if thread_ids:
+            uids = [uid for uid in uids if self.threads.get(uid) in thread_ids]
+        return uids
+
+    def send(self, *lines):
+        data = b''.join(line.encode() + b'\r\n' for line in lines)
+        self.sock.sendall(self.codec.compress(data) if self.codec else data)
+
+    def readline(self):
+        while b'\n' not in self.buffer:
+            data = self.sock.recv(65536)
+            if not data:
+                return ''
+            self.buffer += self.codec.decompress(data) if self.codec else data
+        line, _, self.buffer = self.buffer.partition(b'\n')
+        return line.decode().rstrip('\r')
+
+    def run(self):
+        self.send('* OK [CAPABILITY %s] ready' % BEFORE_LOGIN)
+        for line in iter(self.readline, ''):
+            tag, _, command = line.partition(' ')
+            self.commands.append(command)
+            if command == 'IDLE':
+                self.idle(tag)
+                continue
+            untagged, text = self.answer(command)
+            if not text.startswith(('NO ', 'BAD ')):
+                text = 'OK ' + text
+            self.send(*[('* ' + response) for response in untagged] + [tag + ' ' + text])
+            if command == 'COMPRESS DEFLATE':
+                self.codec = DeflateCodec()
+            if command == 'LOGOUT':
+                break
+
+    def idle(self, tag):
+        pushed = self.pushes.pop(0) if self.pushes else []
+        self.send('+ idling', *[('* ' + response) for response in pushed])
+        self.commands.append(self.readline())
+        self.send(tag + ' OK IDLE terminated')
+
+    def answer(self, command):
+        name = command.split(' ', 1)[0]
+        if name == 'LOGIN':
+            return [], '[CAPABILITY %s] logged in' % self.capabilities
+        if name == 'CAPABILITY':
+            return ['CAPABILITY ' + BEFORE_LOGIN], 'done'
+        if name == 'ENABLE':
+            return ['ENABLED ' + command.split(' ', 1)[1]], 'done'
+        if name == 'LIST':
+            if 'SPECIAL-USE' in command and 'LIST-EXTENDED' not in self.capabilities:
+                return [], 'BAD RETURN needs LIST-EXTENDED'
+            return self.list(command), 'done'
+        if name in ('SELECT', 'EXAMINE'):
+            self.selected = command.split(' ', 1)[1].strip('"')
+            return ['%d EXISTS' % len(self.uids), 'OK [UIDVALIDITY 1] ok',
+                    'OK [UIDNEXT %d] ok' % (max(self.uids or [0]) + 1),
+                    'OK [HIGHESTMODSEQ 10] ok'], 'selected'
+        if name == 'STATUS':
+            mailbox = command.split(' (')[0].split(' ', 1)[1]
+            return ['STATUS %s (MESSAGES %d)' % (mailbox, len(self.contents.get(mailbox.strip('"'), [])))], 'done'
+        if command.startswith('UID SEARCH RETURN'):
+            uids = self.search(command)
+            return ['ESEARCH (TAG "x") UID COUNT %d ALL %s' % (len(uids), _sequence(uids))], 'done'
+        if command.startswith('UID SEARCH'):
+            return ['SEARCH ' + ' '.join(str(uid) for uid in self.search(command))], 'done'
+        if command.startswith('UID FETCH'):
+            if 'CHANGEDSINCE' in command:
+                return [], 'done'
+            if 'BODY.PEEK[]' in command:
+                return ['%d FETCH (UID %d BODY[] {%d}\r\n%s)' % (uid, uid, len(RAW), RAW.decode())
+                        for uid in UIDSet(command.split()[2]) if uid in self.uids], 'done'
+            partial = re.search(r'BODY\.PEEK\[([\d.]+)\]<(\d+)\.(\d+)>', command)
+            if partial:
+                return self.partial(int(command.split()[2]), *partial.groups())
+            structure = ' BODYSTRUCTURE ' + BODYSTRUCTURE.decode() if 'BODYSTRUCTURE' in command else ''
+            return ['%d FETCH (UID %d FLAGS (\\Seen)%s%s)' % (uid, uid, self.thread(uid), structure)
+                    for uid in UIDSet(command.split()[2]) if uid in self.uids], 'done'
+        return [], 'done'
+
+    def thread(self, uid):
+        return ' X-GM-THRID %d' % self.threads[uid] if uid in self.threads else ''
+
+    def partial(self, uid, section, offset, length):
+        if int(offset) in self.failing:
+            self.failing.remove(int(offset))
+            return [], 'NO fetch failed'
+        payload = mime_payload(mime_part(email.message_from_bytes(RAW), section))
+        data = payload[int(offset):int(offset) + int(length)].decode()
+        return ['%d FETCH (UID %d BODY[%s]<%s> {%d}\r\n%s)' % (uid, uid, section, offset, len(data), data)], 'done'
+
+    def list(self, command):
+        responses = ['LIST (%s) "/" "%s"' % mailbox for mailbox in MAILBOXES]
+        if 'STATUS' in command:
+            responses += ['STATUS "%s" (MESSAGES %d)' % (name, len(self.contents.get(name, [])))
+                          for attributes, name in MAILBOXES if 'Noselect' not in attributes]
+        return responses
+
+
+def _sequence(uids):
+    return ','.join(str(uid) for uid in uids)
+
+
+def login(capabilities=AFTER_LOGIN, **kwargs):
+    """A Gmail session logged in to a FakeServer, and the server."""
+    client, server = socket.socketpair()
+    fake = FakeServer(server, capabilities, **kwargs)
+    fake.start()
+
+    class Connection(IMAPConnection):
+        def _create_socket(self, timeout):
+            return client
+
+    gmail = Gmail(debug=False)
+    gmail.imap = Connection('fake')
+    gmail.login('user@example.com', 'password', only_fetch=True)
+    fake.commands[:] = []
+    return gmail, fake
+
+
+def test_capabilities_are_read_again_after_login():
+    gmail, _ = login()
+    assert 'MOVE' in gmail.imap.capabilities
+    assert 'UIDPLUS' in gmail.imap.capabilities
+
+
+def test_delete_moves_to_trash():
+    gmail, fake = login()
+    gmail.inbox.delete([2])
+    assert 'UID MOVE 2 "[Gmail]/Trash"' in fake.commands
+    assert not [command for command in fake.commands if 'EXPUNGE' in command]
+
+
+def test_move_without_uidplus_never_expunges_the_mailbox():
+    gmail, fake = login('IMAP4rev1 SPECIAL-USE')
+    gmail.inbox.move([2], 'Archive')
+    assert fake.commands[-2:] == ['UID COPY 2 "Archive"', 'UID STORE 2 +FLAGS (\\Deleted)']
+    assert not [command for command in fake.commands if re.search(r'\bEXPUNGE\b', command)]
+
+
+def test_sync_of_a_quiet_mailbox_reports_nothing():
+    gmail, fake = login()
+    result = gmail.inbox.sync()
+    assert result.new == [1, 2, 3]
+
+    fake.commands[:] = []
+    result = gmail.inbox.sync(result.state)
+    assert (result.new, result.changed, result.vanished) == ([], [], [])
+    assert fake.commands == ['SELECT "INBOX"']
+
+
+def test_sync_without_condstore_does_not_know_what_changed():
+    gmail, fake = login('IMAP4rev1 SPECIAL-USE')
+    result = gmail.inbox.sync(gmail.inbox.sync().state)
+    assert result.changed is None
+    assert not result
+
+
+def test_counts_come_from_one_list_status():
+    gmail, fake = login()
+    counts = gmail.counts(('MESSAGES',))
+    assert counts['INBOX'] == {'MESSAGES': 3}
+    assert fake.commands == ['LIST "" "*" RETURN (SPECIAL-USE STATUS (MESSAGES))']
+
+
+def test_special_use_is_not_asked_for_without_list_extended():
+    gmail, fake = login('IMAP4rev1 SPECIAL-USE')
+    assert gmail.trash_name == '[Gmail]/Trash'
+    gmail.fetch_mailboxes()
+    assert fake.commands == ['LIST "" *']
+
+
+def test_system_mailboxes_are_found_by_special_use():
+    gmail, _ = login()
+    assert gmail.trash_name == '[Gmail]/Trash'
+    assert gmail.special_mailbox('\\All').name == '[Gmail]/All Mail'
+    assert [mailbox.name for mailbox in gmail.mailboxes[b'[Gmail]'].children] == \
+        ['[Gmail]/All Mail', '[Gmail]/Trash']
+
+
+def test_count_uses_esearch_advertised_after_login():
+    gmail, fake = login()
+    assert gmail.inbox.count(unread=True) == 3
+    assert fake.commands[-1] == 'UID SEARCH RETURN (COUNT) ALL UNSEEN'
+
+
+def test_count_without_esearch_reads_the_uid_list():
+    gmail, fake = login('IMAP4rev1')
+    assert gmail.inbox.count() == 3
+    assert fake.commands[-1] == 'UID SEARCH ALL'
+
+
+def test_attachments_of_a_body_parsed_in_the_executor_are_not_fetched_again():
+    gmail, fake = login()
+    with ThreadPoolExecutor(1) as executor:
+        gmail.parse_executor = executor
+        message, = gmail.inbox.fetch(UIDSet([2]))
+    assert message.message is not None and message.subject == 'hi'
+    fake.commands[:] = []
+    assert [attachment.payload for attachment in message.attachments][-1] == b'PDFDATA'
+    assert fake.commands == []
+
+
+def test_detached_messages_keep_their_fields_and_fetch_nothing():
+    gmail, fake = login()
+    message = gmail.inbox.get_mail(prefetch=True, profile=FLAGS)[0].detached()
+    assert message.mailbox is None and message.flags == ['\\Seen']
+    with pytest.raises(GmailException):
+        message.subject
+
+    full = gmail.inbox.fetch(UIDSet([2]))[0].detached()
+    assert full.subject == 'hi' and full.attachments[-1].message is full
+    assert full.attachments[-1].payload == b'PDFDATA'
+
+    fake.commands[:] = []
+    gmail.inbox.mark_read([full])
+    assert fake.commands == ['UID STORE 2 +FLAGS (\\Seen)']
+
+
+def test_refetching_a_message_does_not_grow_its_size():
+    gmail, fake = login()
+    message, = gmail.inbox.fetch(UIDSet([2]))
+    assert message._size == len(RAW)
+    message.fetch()
+    with ThreadPoolExecutor(1) as executor:
+        gmail.parse_executor = executor
+        gmail.inbox.fetch([message], refresh=True)
+    assert message._size == len(RAW)
+    assert gmail.inbox._messages.bytes == len(RAW)
+
+
+def test_a_failed_download_resumes_after_the_last_chunk_written():
+    gmail, fake = login()
+    message, = gmail.inbox.fetch(UIDSet([2]), profile=STRUCTURE)
+    attachment = message.attachments[-1]
+    attachment.CHUNK_SIZE = 4
+    fake.failing = {8}
+    fake.commands[:] = []
+    fileobj = io.BytesIO()
+    with pytest.raises(GmailException):
+        attachment.write(fileobj)
+    attachment.write(fileobj, resume=True)
+    assert fileobj.getvalue() == b'PDFDATA'
+    assert [re.search(r'<\d+', command).group() for command in fake.commands] == ['<0', '<4', '<8', '<8', '<12']
+
+
+def test_threads_gather_each_conversation_of_the_matches():
+    gmail, fake = login(uids=(1, 2, 3, 4))
+    fake.threads = {1: 10, 2: 20, 3: 10, 4: 30}
+    threads = gmail.inbox.threads(uid='1:2', profile=FLAGS)
+    assert [[message.uid for message in thread] for thread in threads] == [[b'1', b'3'], [b'2']]
+    # the matches are in the cache, so only the rest of their conversations is fetched
+    assert fake.commands[-2:] == ['UID SEARCH RETURN (ALL) ALL OR (X-GM-THRID 10) (X-GM-THRID 20)',
+                                  'UID FETCH 3 (FLAGS X-GM-THRID X-GM-MSGID X-GM-LABELS)']
+
+    fake.commands[:] = []
+    message = threads[1][0]
+    assert message.fetch_thread() == [message]
+    assert fake.commands == ['UID SEARCH RETURN (ALL) ALL X-GM-THRID 20']
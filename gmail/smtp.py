@@ -0,0 +1,265 @@
+# -*- coding: utf-8 -*-
+
+"""
+gmail.smtp
+~~~~~~~~~~~~~~~~~~~
+
+This module contains the SMTP side of Gmail: a connection which pipelines
+the envelope of each message, and a queue sending many messages over a
+few connections kept open between sends.
+
+"""
+
+import base64
+import queue
+import smtplib
+from concurrent.futures import ThreadPoolExecutor
+from smtplib import (SMTPAuthenticationError, SMTPDataError, SMTPRecipientsRefused,
+                     SMTPResponseException, SMTPSenderRefused, SMTPServerDisconnected)
+
+from .exceptions import AuthenticationError
+
+GMAIL_SMTP_HOST = 'smtp.gmail.com'
+GMAIL_SMTP_PORT = 587
+
+
+class SMTPConnection(smtplib.SMTP):
+    """
+        smtplib.SMTP sending MAIL, RCPT and DATA together when the server offers
+        PIPELINING (RFC 2920), so a message costs two round trips instead of one
+        per command.
+    """
+
+    def sendmail(self, from_addr, to_addrs, msg, mail_options=(), rcpt_options=()):
+        self.ehlo_or_helo_if_needed()
+        if not self.has_extn('pipelining') or any(
+                option.lower() == 'smtputf8' for option in mail_options):
+            return smtplib.SMTP.sendmail(self, from_addr, to_addrs, msg, mail_options, rcpt_options)
+
+        if isinstance(to_addrs, str):
+            to_addrs = [to_addrs]
+        if isinstance(msg, str):
+            msg = smtplib._fix_eols(msg).encode('ascii')
+        mail_options = list(mail_options)
+        if self.has_extn('size'):
+            mail_options.append('size=%d' % len(msg))
+
+        self.putcmd('mail', 'FROM:%s%s' % (smtplib.quoteaddr(from_addr), _options(mail_options)))
+        for address in to_addrs:
+            self.putcmd('rcpt', 'TO:%s%s' % (smtplib.quoteaddr(address), _options(rcpt_options)))
+        self.putcmd('data')
+
+        # the replies come back in the order the commands were sent
+        sender = self.getreply()
+        refused = {}
+        for address in to_addrs:
+            code, reply = self.getreply()
+            if code not in (250, 251):
+                refused[address] = (code, reply)
+        code, reply = self.getreply()
+
+        if sender[0] != 250 or len(refused) == len(to_addrs):
+            if code == 354:
+                # the server wants a message anyway; send an empty one and drop it
+                self.send(b'.' + smtplib.bCRLF)
+                self.getreply()
+            self._reset(sender[0] if sender[0] != 250 else code)
+            if sender[0] != 250:
+                raise SMTPSenderRefused(sender[0], sender[1], from_addr)
+            raise SMTPRecipientsRefused(refused)
+        if code != 354:
+            self._reset(code)
+            raise SMTPDataError(code, reply)
+
+        data = smtplib._quote_periods(msg)
+        if data[-2:] != smtplib.bCRLF:
+            data += smtplib.bCRLF
+        self.send(data + b'.' + smtplib.bCRLF)
+        code, reply = self.getreply()
+        if code != 250:
+            self._reset(code)
+            raise SMTPDataError(code, reply)
+        return refused
+
+    def _reset(self, code):
+        # 421 means the server is closing the connection
+        if code == 421:
+            self.close()
+            return
+        try:
+            self.rset()
+        except SMTPServerDisconnected:
+            pass
+
+
+class SendResult:
+    """The outcome of sending one message from a SendQueue."""
+
+    def __init__(self, message, refused=None, error=None):
+        self.message = message
+        # recipients the server refused, as {address: (code, reply)}
+        self.refused = refused or {}
+        self.error = error
+
+    def __repr__(self):
+        return '<SendResult {}>'.format('ok' if self.ok else repr(self.error))
+
+    @property
+    def ok(self):
+        return self.error is None
+
+
+class SendQueue:
+    """
+        Sends messages on ``connections`` threads, each keeping an authenticated SMTP
+        connection open between messages. Connections are replaced after
+        ``rotate_after`` messages, or when Gmail drops them, and a failed message
+        doesn't stop the others.
+    """
+
+    def __init__(self,
+                 username,
+                 password=None,
+                 access_token=None,
+                 connections=2,
+                 rotate_after=100,
+                 debug=False,
+                 host=GMAIL_SMTP_HOST,
+                 port=GMAIL_SMTP_PORT):
+        self.username = username
+        self.password = password
+        self.access_token = access_token
+        self.rotate_after = rotate_after
+        self.debug = debug
+        self.host = host
+        self.port = port
+
+        self._executor = ThreadPoolExecutor(max_workers=connections)
+        # (connection, messages sent on it) of the connections not in use
+        self._idle = queue.LifoQueue()
+
+    def __repr__(self):
+        return '<SendQueue {}>'.format(self.username)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def submit(self, message):
+        """Queue ``message``, returning a future of its SendResult."""
+        return self._executor.submit(self._send, message)
+
+    def send(self, messages):
+        """Send ``messages`` and return their SendResults, in the same order."""
+        futures = [self.submit(message) for message in messages]
+        return [future.result() for future in futures]
+
+    def _send(self, message):
+        try:
+            return SendResult(message, refused=self._deliver(message))
+        except Exception as error:
+            return SendResult(message, error=error)
+
+    def _deliver(self, message):
+        retried = False
+        while True:
+            connection, sent = self._borrow()
+            try:
+                refused = connection.sendmail(self.username, recipients(message), message.as_string())
+            except Exception as error:
+                if not dropped(error):
+                    # the connection was reset and can carry on
+                    self._release(connection, sent)
+                    raise
+                _quit(connection)
+                if retried:
+                    raise
+                retried = True
+            else:
+                self._release(connection, sent + 1)
+                return refused
+
+    def _borrow(self):
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            return self._connect(), 0
+
+    def _connect(self):
+        return connect_smtp(self.username, self.password, self.access_token,
+                            self.debug, self.host, self.port)
+
+    def _release(self, connection, sent):
+        if sent >= self.rotate_after or connection.sock is None:
+            _quit(connection)
+        else:
+            self._idle.put((connection, sent))
+
+    def close(self):
+        """Wait for the queued messages, then close every connection."""
+        self._executor.shutdown(wait=True)
+        while True:
+            try:
+                connection, _ = self._idle.get_nowait()
+            except queue.Empty:
+                break
+            _quit(connection)
+
+
+def connect_smtp(username, password=None, access_token=None, debug=False,
+                 host=GMAIL_SMTP_HOST, port=GMAIL_SMTP_PORT):
+    """Open an SMTPConnection and log in with ``password`` or XOAUTH2."""
+    smtp = SMTPConnection(host, port)
+    smtp.set_debuglevel(debug)
+
+    smtp.ehlo()
+    smtp.starttls()
+    smtp.ehlo()
+
+    try:
+        if access_token:
+            auth_string = base64.b64encode(xoauth2_string(username, access_token).encode()).decode()
+            code, reply = smtp.docmd('AUTH', 'XOAUTH2 ' + auth_string)
+            if code != 235:
+                raise SMTPAuthenticationError(code, reply)
+        else:
+            smtp.login(username, password)
+    except SMTPAuthenticationError:
+        smtp.close()
+        raise AuthenticationError
+
+    return smtp
+
+
+def dropped(error):
+    """Whether ``error`` means the server closed the connection, as Gmail does when idle."""
+    if isinstance(error, SMTPResponseException):
+        return error.smtp_code == 421
+    if isinstance(error, smtplib.SMTPException):
+        return isinstance(error, SMTPServerDisconnected)
+    return isinstance(error, OSError)
+
+
+def recipients(message):
+    recepients = []
+    recepients.extend(message.get_all('To') or [])
+    recepients.extend(message.get_all('Bcc') or [])
+    recepients.extend(message.get_all('Cc') or [])
+    return recepients
+
+
+def xoauth2_string(username, access_token):
+    return 'user=%s\1auth=Bearer %s\1\1' % (username, access_token)
+
+
+def _options(options):
+    return ''.join(' ' + option for option in options)
+
+
+def _quit(connection):
+    try:
+        connection.quit()
+    except (smtplib.SMTPException, OSError):
+        connection.close()
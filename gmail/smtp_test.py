@@ -0,0 +1,127 @@
+import socket
+import threading
+from email.mime.text import MIMEText
+from smtplib import SMTPRecipientsRefused
+
+from gmail.smtp import SMTPConnection, SendQueue
+
+
+class FakeSMTPServer(threading.Thread):
+    """
+        Answers SMTP clients on a local port, recording their commands. With
+        ``pipelining`` the replies to MAIL and RCPT are held back until DATA, so
+        a client waiting for each reply times out.
+    """
+
+    def __init__(self, pipelining=True, drop_after=None):
+        threading.Thread.__init__(self)
+        self.daemon = True
+        self.pipelining = pipelining
+        # messages accepted on a connection before the server closes it
+        self.drop_after = drop_after
+        self.listener = socket.socket()
+        self.listener.bind(('127.0.0.1', 0))
+        self.listener.listen(5)
+        self.port = self.listener.getsockname()[1]
+        self.commands = []
+        self.connections = 0
+        self.start()
+
+    def run(self):
+        while True:
+            sock, _ = self.listener.accept()
+            self.connections += 1
+            threading.Thread(target=self.serve, args=(sock,), daemon=True).start()
+
+    def serve(self, sock):
+        file = sock.makefile('rb')
+        sock.sendall(b'220 ready\r\n')
+        held, accepted = [], 0
+        for line in file:
+            command = line.decode().rstrip('\r\n')
+            self.commands.append(command)
+            verb = command[:4].upper()
+            if verb == 'EHLO':
+                sock.sendall(b'250-fake\r\n' + (b'250-PIPELINING\r\n' if self.pipelining else b'') +
+                             b'250 SIZE 1000000\r\n')
+            elif verb in ('MAIL', 'RCPT'):
+                reply = b'550 no such user\r\n' if 'refused' in command else b'250 ok\r\n'
+                if self.pipelining:
+                    held.append(reply)
+                else:
+                    sock.sendall(reply)
+            elif verb == 'DATA':
+                sock.sendall(b''.join(held) + b'354 go ahead\r\n')
+                held = []
+                while file.readline() != b'.\r\n':
+                    pass
+                accepted += 1
+                sock.sendall(b'250 queued\r\n')
+                if accepted == self.drop_after:
+                    sock.close()
+                    return
+            elif verb == 'RSET':
+                sock.sendall(b'250 ok\r\n')
+            elif verb == 'QUIT':
+                sock.sendall(b'221 bye\r\n')
+                sock.close()
+                return
+
+
+class FakeSendQueue(SendQueue):
+
+    def __init__(self, server, **kwargs):
+        SendQueue.__init__(self, 'me@example.com', 'password', **kwargs)
+        self.server = server
+
+    def _connect(self):
+        return SMTPConnection('127.0.0.1', self.server.port, timeout=2)
+
+
+def message(to):
+    message = MIMEText('hello')
+    message['To'] = to
+    message['Subject'] = 'hi'
+    return message
+
+
+def test_the_envelope_is_pipelined():
+    server = FakeSMTPServer()
+    smtp = SMTPConnection('127.0.0.1', server.port, timeout=2)
+    refused = smtp.sendmail('me@example.com', ['a@example.com', 'refused@example.com'],
+                            'Subject: hi\r\n\r\n.dot\r\n')
+    smtp.quit()
+    assert refused == {'refused@example.com': (550, b'no such user')}
+    assert server.commands[1:5] == ['mail FROM:<me@example.com> size=21', 'rcpt TO:<a@example.com>',
+                                    'rcpt TO:<refused@example.com>', 'data']
+
+
+def test_without_pipelining_commands_are_sent_one_by_one():
+    server = FakeSMTPServer(pipelining=False)
+    smtp = SMTPConnection('127.0.0.1', server.port, timeout=2)
+    assert smtp.sendmail('me@example.com', ['a@example.com'], 'Subject: hi\r\n\r\nbody') == {}
+    smtp.quit()
+
+
+def test_a_queue_keeps_its_connection_and_rotates_it():
+    server = FakeSMTPServer()
+    with FakeSendQueue(server, connections=1, rotate_after=2) as queue:
+        results = queue.send([message('%d@example.com' % n) for n in range(5)])
+    assert all(result.ok for result in results)
+    assert server.connections == 3
+
+
+def test_a_dropped_connection_is_replaced_and_the_message_sent_again():
+    server = FakeSMTPServer(drop_after=1)
+    with FakeSendQueue(server, connections=1) as queue:
+        results = queue.send([message('a@example.com'), message('b@example.com')])
+    assert all(result.ok for result in results)
+    assert server.connections == 2
+
+
+def test_a_failed_message_does_not_stop_the_others():
+    server = FakeSMTPServer()
+    with FakeSendQueue(server, connections=1) as queue:
+        refused, sent = queue.send([message('refused@example.com'), message('a@example.com')])
+    assert isinstance(refused.error, SMTPRecipientsRefused) and sent.ok
+    assert server.connections == 1
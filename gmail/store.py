@@ -0,0 +1,76 @@
+# -*- coding: utf-8 -*-
+
+"""
+gmail.store
+~~~~~~~~~~~~~~~~~~~
+
+This module contains the optional on-disk store of raw messages, which
+lets message bodies survive between processes.
+
+"""
+
+import sqlite3
+import threading
+
+
+class MessageStore:
+    """
+        A SQLite store of raw RFC822 messages keyed by (mailbox, UIDVALIDITY, UID).
+        Gmail never changes a message body, so a stored body is always correct.
+        Flags and labels do change, so they are always fetched from the server.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        with self.connection:
+            self.connection.execute(
+                'CREATE TABLE IF NOT EXISTS messages ('
+                'mailbox TEXT, uidvalidity INTEGER, uid INTEGER, raw BLOB, '
+                'gm_msgid TEXT, gm_thrid TEXT, '
+                'PRIMARY KEY (mailbox, uidvalidity, uid))')
+            # flags and labels were once kept here, but never read back
+            self.connection.execute('DROP TABLE IF EXISTS state')
+
+    def __repr__(self):
+        return '<MessageStore {}>'.format(self.path)
+
+    def get_messages(self, mailbox, uidvalidity, uids):
+        """Return ``{uid: (raw, gm_msgid, gm_thrid)}`` for the stored ``uids``."""
+        found = {}
+        uids = list(uids)
+        with self._lock:
+            # stay under SQLite's limit on bound parameters
+            for start in range(0, len(uids), 500):
+                chunk = uids[start:start + 500]
+                rows = self.connection.execute(
+                    'SELECT uid, raw, gm_msgid, gm_thrid FROM messages '
+                    'WHERE mailbox = ? AND uidvalidity = ? AND uid IN (%s)'
+                    % ','.join('?' * len(chunk)),
+                    [mailbox, uidvalidity] + chunk)
+                for uid, raw, gm_msgid, gm_thrid in rows:
+                    found[uid] = (bytes(raw), gm_msgid, gm_thrid)
+        return found
+
+    def put_messages(self, mailbox, uidvalidity, messages):
+        """Store ``(uid, raw, gm_msgid, gm_thrid)`` rows."""
+        with self._lock, self.connection:
+            self.connection.executemany(
+                'INSERT OR REPLACE INTO messages VALUES (?, ?, ?, ?, ?, ?)',
+                [(mailbox, uidvalidity, uid, sqlite3.Binary(raw), gm_msgid, gm_thrid)
+                 for uid, raw, gm_msgid, gm_thrid in messages])
+
+    def discard(self, mailbox, uidvalidity=None):
+        """Forget a mailbox, or only the entries of an older UIDVALIDITY."""
+        with self._lock, self.connection:
+            if uidvalidity is None:
+                self.connection.execute('DELETE FROM messages WHERE mailbox = ?', (mailbox,))
+            else:
+                self.connection.execute(
+                    'DELETE FROM messages WHERE mailbox = ? AND uidvalidity != ?',
+                    (mailbox, uidvalidity))
+
+    def close(self):
+        with self._lock:
+            self.connection.close()
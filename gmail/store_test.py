@@ -0,0 +1,40 @@
+import sqlite3
+
+from gmail.parser_test import RAW
+from gmail.session_test import login
+from gmail.store import MessageStore
+from gmail.uidset import UIDSet
+
+
+def test_messages_are_kept_by_mailbox_and_uidvalidity():
+    store = MessageStore(':memory:')
+    store.put_messages('INBOX', 1, [(2, b'raw', '10', '20')])
+    assert store.get_messages('INBOX', 1, [1, 2]) == {2: (b'raw', '10', '20')}
+    assert store.get_messages('INBOX', 2, [2]) == {}
+
+    store.discard('INBOX', 2)
+    assert store.get_messages('INBOX', 1, [2]) == {}
+
+
+def test_stored_bodies_are_not_fetched_again():
+    store = MessageStore(':memory:')
+    gmail, fake = login()
+    gmail.store = store
+    gmail.inbox.fetch(UIDSet([2]))
+
+    gmail, fake = login()
+    gmail.store = store
+    message, = gmail.inbox.fetch(UIDSet([2]))
+    assert message.subject == 'hi' and message._size == len(RAW)
+    assert message.flags == ['\\Seen']
+    assert [command for command in fake.commands if 'BODY' in command] == []
+
+
+def test_the_unused_state_table_is_dropped(tmp_path):
+    path = str(tmp_path / 'messages.sqlite')
+    with sqlite3.connect(path) as connection:
+        connection.execute('CREATE TABLE state (uid INTEGER)')
+    MessageStore(path).close()
+    with sqlite3.connect(path) as connection:
+        tables = [row[0] for row in connection.execute('SELECT name FROM sqlite_master')]
+    assert 'state' not in tables
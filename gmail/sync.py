@@ -0,0 +1,45 @@
+# -*- coding: utf-8 -*-
+
+"""
+gmail.sync
+~~~~~~~~~~~~~~~~~~~
+
+This module contains the state kept between two incremental syncs of a
+mailbox and the changes a sync reports.
+
+"""
+
+
+class SyncState:
+    """What a mailbox looked like at the end of the last sync."""
+
+    def __init__(self, uidvalidity=None, uidnext=None, highestmodseq=None, uids=None):
+        self.uidvalidity = uidvalidity
+        self.uidnext = uidnext
+        self.highestmodseq = highestmodseq
+        # every UID known to be in the mailbox, sorted
+        self.uids = uids or []
+
+    def __repr__(self):
+        return '<SyncState uidvalidity={} uidnext={} highestmodseq={}>'.format(
+            self.uidvalidity, self.uidnext, self.highestmodseq)
+
+
+class SyncResult:
+    """The UIDs which appeared, changed flags/labels or vanished since a sync."""
+
+    def __init__(self, state, new=None, changed=(), vanished=None, reset=False):
+        self.state = state
+        self.new = new or []
+        # None when the server can't tell which messages changed (no CONDSTORE)
+        self.changed = list(changed) if changed is not None else None
+        self.vanished = vanished or []
+        # set when the UIDVALIDITY changed and every UID has to be refetched
+        self.reset = reset
+
+    def __repr__(self):
+        return '<SyncResult new={} changed={} vanished={}>'.format(
+            len(self.new), '?' if self.changed is None else len(self.changed), len(self.vanished))
+
+    def __bool__(self):
+        return bool(self.new or self.changed or self.vanished)
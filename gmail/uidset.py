@@ -0,0 +1,243 @@
+# -*- coding: utf-8 -*-
+
+"""
+gmail.uidset
+~~~~~~~~~~~~~~~~~~~
+
+This module contains UIDSet, a set of message UIDs stored as sorted
+ranges, which reads SEARCH and ESEARCH responses and writes IMAP
+sequence sets.
+
+"""
+
+from array import array
+from bisect import bisect_right
+
+
+class UIDSet:
+    """
+        An immutable set of UIDs kept as sorted, disjoint ranges in two arrays, so
+        a mailbox of consecutive UIDs costs a few bytes however many there are.
+        Built from UIDs, Message objects or a sequence set such as ``1:5,9``;
+        ``str()`` gives the sequence set back for UID FETCH, STORE, MOVE or COPY.
+    """
+
+    def __init__(self, uids=()):
+        # first and last UID of every range
+        self._starts = array('L')
+        self._ends = array('L')
+
+        if isinstance(uids, UIDSet):
+            self._starts.extend(uids._starts)
+            self._ends.extend(uids._ends)
+        elif isinstance(uids, (str, bytes)):
+            self._extend(_parse_ranges(uids))
+        else:
+            self._extend(_ranges(int(getattr(uid, 'uid', uid)) for uid in uids))
+
+    @classmethod
+    def _from_ranges(cls, ranges):
+        uidset = cls()
+        uidset._extend(ranges)
+        return uidset
+
+    @classmethod
+    def from_search(cls, data):
+        """
+            The UIDs of a UID SEARCH response, either the plain UID list or the ALL
+            of an ESEARCH response.
+        """
+        ranges = []
+        for value in data:
+            if not value:
+                continue
+            if isinstance(value, str):
+                value = value.encode()
+            tokens = value.split()
+            if tokens[0].isdigit():
+                ranges.extend(_ranges(int(uid) for uid in tokens))
+            elif b'ALL' in tokens:
+                ranges.extend(_parse_ranges(tokens[tokens.index(b'ALL') + 1]))
+        return cls._from_ranges(_merged(sorted(ranges)))
+
+    def _extend(self, ranges):
+        for first, last in ranges:
+            if self._ends and first <= self._ends[-1] + 1:
+                self._ends[-1] = max(self._ends[-1], last)
+            else:
+                self._starts.append(first)
+                self._ends.append(last)
+
+    def ranges(self):
+        """Yield the (first, last) UIDs of every range, in order."""
+        return zip(self._starts, self._ends)
+
+    @property
+    def first(self):
+        return self._starts[0] if self._starts else None
+
+    @property
+    def last(self):
+        return self._ends[-1] if self._ends else None
+
+    def __len__(self):
+        return sum(self._ends) - sum(self._starts) + len(self._starts)
+
+    def __bool__(self):
+        return bool(self._starts)
+
+    def __iter__(self):
+        for first, last in self.ranges():
+            for uid in range(first, last + 1):
+                yield uid
+
+    def __reversed__(self):
+        for first, last in reversed(list(self.ranges())):
+            for uid in range(last, first - 1, -1):
+                yield uid
+
+    def __contains__(self, uid):
+        uid = int(getattr(uid, 'uid', uid))
+        index = bisect_right(self._starts, uid) - 1
+        return index >= 0 and uid <= self._ends[index]
+
+    def __eq__(self, other):
+        if not isinstance(other, UIDSet):
+            return NotImplemented
+        return self._starts == other._starts and self._ends == other._ends
+
+    def __ne__(self, other):
+        equal = self.__eq__(other)
+        return equal if equal is NotImplemented else not equal
+
+    def __str__(self):
+        return ','.join(str(first) if first == last else '%d:%d' % (first, last)
+                        for first, last in self.ranges())
+
+    def __repr__(self):
+        sequence = str(self)
+        if len(sequence) > 60:
+            sequence = sequence[:57] + '...'
+        return '<UIDSet {} ({} UIDs)>'.format(sequence, len(self))
+
+    def union(self, other):
+        other = _uidset(other)
+        return UIDSet._from_ranges(_merged(sorted(list(self.ranges()) + list(other.ranges()))))
+
+    def intersection(self, other):
+        other = _uidset(other)
+        ranges = []
+        mine, theirs = list(self.ranges()), list(other.ranges())
+        i = j = 0
+        while i < len(mine) and j < len(theirs):
+            first = max(mine[i][0], theirs[j][0])
+            last = min(mine[i][1], theirs[j][1])
+            if first <= last:
+                ranges.append((first, last))
+            # move past whichever range ends first
+            if mine[i][1] < theirs[j][1]:
+                i += 1
+            else:
+                j += 1
+        return UIDSet._from_ranges(ranges)
+
+    def difference(self, other):
+        other = list(_uidset(other).ranges())
+        ranges = []
+        j = 0
+        for first, last in self.ranges():
+            while j < len(other) and other[j][1] < first:
+                j += 1
+            k = j
+            while k < len(other) and other[k][0] <= last:
+                if other[k][0] > first:
+                    ranges.append((first, other[k][0] - 1))
+                first = max(first, other[k][1] + 1)
+                k += 1
+            if first <= last:
+                ranges.append((first, last))
+        return UIDSet._from_ranges(ranges)
+
+    __or__ = union
+    __and__ = intersection
+    __sub__ = difference
+
+    def chunks(self, size):
+        """Yield UIDSets of at most ``size`` UIDs each, lowest UIDs first."""
+        chunk, count = [], 0
+        for first, last in self.ranges():
+            while first <= last:
+                end = min(last, first + size - count - 1)
+                chunk.append((first, end))
+                count += end - first + 1
+                first = end + 1
+                if count == size:
+                    yield UIDSet._from_ranges(chunk)
+                    chunk, count = [], 0
+        if chunk:
+            yield UIDSet._from_ranges(chunk)
+
+    def page(self, number, size, newest=True):
+        """
+            UIDs ``number * size`` up to ``(number + 1) * size``, counted from the
+            highest UID when ``newest``, without expanding the whole set.
+        """
+        if newest:
+            ranges = [range(last, first - 1, -1) for first, last in reversed(list(self.ranges()))]
+        else:
+            ranges = [range(first, last + 1) for first, last in self.ranges()]
+
+        skip = number * size
+        uids = []
+        for uid_range in ranges:
+            if skip >= len(uid_range):
+                skip -= len(uid_range)
+                continue
+            uids.extend(uid_range[skip:skip + size - len(uids)])
+            skip = 0
+            if len(uids) == size:
+                break
+        return uids
+
+
+def _uidset(uids):
+    return uids if isinstance(uids, UIDSet) else UIDSet(uids)
+
+
+def _ranges(uids):
+    """Ranges of consecutive UIDs; sorts only when ``uids`` come out of order."""
+    ranges = []
+    ordered = True
+    for uid in uids:
+        if ranges and uid == ranges[-1][1] + 1:
+            ranges[-1][1] = uid
+        else:
+            if ranges and uid <= ranges[-1][1]:
+                ordered = False
+            ranges.append([uid, uid])
+    if ordered:
+        return ranges
+    return _merged(sorted(ranges))
+
+
+def _merged(ranges):
+    merged = []
+    for first, last in ranges:
+        if merged and first <= merged[-1][1] + 1:
+            merged[-1][1] = max(merged[-1][1], last)
+        else:
+            merged.append([first, last])
+    return merged
+
+
+def _parse_ranges(sequence):
+    """The ranges of a sequence set such as ``1,5,9:20``, in order."""
+    if isinstance(sequence, bytes):
+        sequence = sequence.decode()
+    ranges = []
+    for item in sequence.split(','):
+        if ':' in item:
+            ranges.append(sorted(int(uid) for uid in item.split(':')))
+        elif item:
+            ranges.append([int(item), int(item)])
+    return _merged(sorted(ranges))
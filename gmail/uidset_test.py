@@ -0,0 +1,69 @@
+from gmail.uidset import UIDSet
+
+
+def test_consecutive_uids_are_stored_as_ranges():
+    uids = UIDSet([5, 1, 2, 3, 9, 4])
+    assert list(uids.ranges()) == [(1, 5), (9, 9)]
+    assert str(uids) == '1:5,9'
+    assert len(uids) == 6
+
+
+def test_sequence_sets_are_parsed():
+    assert list(UIDSet('9,1:3,2:5')) == [1, 2, 3, 4, 5, 9]
+    assert list(UIDSet(b'7:5')) == [5, 6, 7]
+    assert UIDSet('') == UIDSet()
+
+
+def test_from_search_reads_search_and_esearch():
+    assert str(UIDSet.from_search([b'1 2 3 7'])) == '1:3,7'
+    assert str(UIDSet.from_search([b'(TAG "A5") UID ALL 1:3,7'])) == '1:3,7'
+    assert not UIDSet.from_search([b''])
+
+
+def test_membership_and_ends():
+    uids = UIDSet('1:3,10:20')
+    assert 2 in uids and 15 in uids
+    assert 5 not in uids and 21 not in uids and 0 not in uids
+    assert (uids.first, uids.last) == (1, 20)
+    assert UIDSet().first is None
+
+
+def test_iteration_both_ways():
+    uids = UIDSet('1:2,5')
+    assert list(uids) == [1, 2, 5]
+    assert list(reversed(uids)) == [5, 2, 1]
+
+
+def test_union():
+    assert str(UIDSet('1:3') | UIDSet('4,8')) == '1:4,8'
+    assert str(UIDSet('1:3').union([10])) == '1:3,10'
+
+
+def test_intersection():
+    assert str(UIDSet('1:10,20:30') & UIDSet('5:25')) == '5:10,20:25'
+    assert not UIDSet('1:3') & UIDSet('4:6')
+
+
+def test_difference():
+    assert str(UIDSet('1:10') - UIDSet('3,5:6')) == '1:2,4,7:10'
+    assert str(UIDSet('1:10') - UIDSet('1:10')) == ''
+    assert str(UIDSet('5:10') - UIDSet('1:6,9:20')) == '7:8'
+
+
+def test_chunks_split_ranges():
+    chunks = [str(chunk) for chunk in UIDSet('1:5,8:9').chunks(3)]
+    assert chunks == ['1:3', '4:5,8', '9']
+
+
+def test_page_counts_from_the_newest():
+    uids = UIDSet('1:5,10:12')
+    assert uids.page(0, 4) == [12, 11, 10, 5]
+    assert uids.page(1, 4) == [4, 3, 2, 1]
+    assert uids.page(0, 4, newest=False) == [1, 2, 3, 4]
+    assert uids.page(5, 4) == []
+
+
+def test_large_sets_stay_small():
+    uids = UIDSet(range(1, 1000001))
+    assert str(uids) == '1:1000000'
+    assert len(uids) == 1000000
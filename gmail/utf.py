@@ -23,7 +23,7 @@
 # WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
 
 text_type = str
-binary_type = str
+binary_type = bytes
 
 PRINTABLE = set(range(0x20, 0x26)) | set(range(0x27, 0x7f))
 